@@ -2,37 +2,192 @@
 API dependencies and security helpers
 """
 
-from fastapi import Depends, HTTPException, status, Security
+from typing import Optional
+
+from fastapi import Depends, Header, HTTPException, Request, Response, WebSocket, status, Security
 from fastapi.security.api_key import APIKeyHeader
 
 from app.core.config import settings
+from app.schemas.image import ImageGenerationRequest, ImageModels
+from app.services.key_registry import ANONYMOUS_KEY, ApiKeyRecord, is_auth_enabled, key_registry
+from app.services.model_router import NoEligibleModel, model_router
+from app.services.rate_limit import RateLimitResult, check_rate_limit, estimate_image_tokens
+from app.services.request_log import trace_request
 
 # API key security scheme
 api_key_header = APIKeyHeader(name=settings.API_KEY_NAME, auto_error=False)
 
 
-async def get_api_key(api_key_header: str = Security(api_key_header)) -> str:
+async def get_api_key(api_key_header: str = Security(api_key_header)) -> ApiKeyRecord:
     """
     Validate the API key from the request header
-    
-    This is a simple security measure for the MVP. In a production environment,
-    this would be replaced with a more robust auth system like OAuth or JWT.
-    
+
+    Keys are looked up in the in-memory key registry, which holds only
+    hashes and is refreshed in the background, so this does no I/O.
+
     Returns:
-        str: The validated API key
-        
+        ApiKeyRecord: The record of the validated API key
+
     Raises:
         HTTPException: If the API key is invalid or missing
     """
     # If API key security is not enabled, allow all requests
-    if not settings.API_KEY:
-        return "no_key_required"
-        
-    if api_key_header and api_key_header == settings.API_KEY:
-        return api_key_header
+    if not is_auth_enabled():
+        return ANONYMOUS_KEY
+
+    record = key_registry.lookup(api_key_header)
+    if record is not None:
+        return record
     else:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or missing API key",
             headers={"WWW-Authenticate": "ApiKey"}
-        ) 
\ No newline at end of file
+        )
+
+
+def websocket_api_key(websocket: WebSocket) -> Optional[ApiKeyRecord]:
+    """
+    Validate the API key of a WebSocket handshake
+
+    Browsers cannot set headers on WebSocket connections, so the key may
+    also be passed as the ``api_key`` query parameter.
+
+    Returns:
+        ApiKeyRecord: The record of the validated API key, or None if it is invalid or missing
+    """
+    if not is_auth_enabled():
+        return ANONYMOUS_KEY
+    api_key = websocket.headers.get(settings.API_KEY_NAME) or websocket.query_params.get("api_key")
+    return key_registry.lookup(api_key)
+
+
+async def require_admin(api_key: ApiKeyRecord = Depends(get_api_key)) -> ApiKeyRecord:
+    """
+    Require an admin API key
+
+    Returns:
+        ApiKeyRecord: The record of the validated admin key
+
+    Raises:
+        HTTPException: 403 if the key is valid but not an admin key
+    """
+    if not api_key.admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin API key required"
+        )
+    return api_key
+
+
+def _reject(api_key: ApiKeyRecord, request: ImageGenerationRequest, status_code: int, detail: str, headers=None):
+    """Record a rejected generation in the request log and raise"""
+    trace = trace_request(api_key.key_id, request)
+    trace.status = status_code
+    trace.error = detail
+    trace.write()
+    raise HTTPException(status_code=status_code, detail=detail, headers=headers)
+
+
+def route_request(
+    request: ImageGenerationRequest,
+    api_key: ApiKeyRecord,
+    deadline_seconds: Optional[float] = None
+) -> ImageGenerationRequest:
+    """
+    Resolve ``model: auto`` to a concrete model; other requests pass through
+
+    Returns:
+        ImageGenerationRequest: The request to admit, limit and generate
+
+    Raises:
+        HTTPException: 403 if the key may not use any suitable model, 422 if no model is suitable
+    """
+    if request.model != ImageModels.AUTO:
+        # A tier marks routed requests, so it is dropped from explicit ones
+        return request if request.tier is None else request.model_copy(update={"tier": None})
+    try:
+        return model_router.route(request, api_key, deadline_seconds)
+    except NoEligibleModel as e:
+        _reject(
+            api_key, request,
+            status.HTTP_403_FORBIDDEN if e.forbidden else status.HTTP_422_UNPROCESSABLE_ENTITY,
+            str(e)
+        )
+
+
+async def routed_request(
+    http_request: Request,
+    request: ImageGenerationRequest,
+    api_key: ApiKeyRecord = Depends(get_api_key),
+    x_deadline_ms: Optional[int] = Header(default=None, ge=1)
+) -> ImageGenerationRequest:
+    """
+    Resolve the request body's ``model: auto``, honouring the client deadline
+
+    The body as sent is kept in ``http_request.state.client_request`` for the request log.
+
+    Returns:
+        ImageGenerationRequest: The request with a concrete model
+    """
+    http_request.state.client_request = request
+    return route_request(request, api_key, x_deadline_ms / 1000 if x_deadline_ms else None)
+
+
+async def check_key_limits(request: ImageGenerationRequest, api_key: ApiKeyRecord) -> Optional[RateLimitResult]:
+    """
+    Apply the key's model allowlist and rate limits to a generation request
+
+    Requests are not rate limited when API key security is disabled.
+
+    Returns:
+        RateLimitResult: The rate limit state, or None if the key is not rate limited
+
+    Raises:
+        HTTPException: 403 if the model is not allowed, 429 if rate limited
+    """
+    if not api_key.allows_model(request.model.value):
+        _reject(
+            api_key, request, status.HTTP_403_FORBIDDEN,
+            f"API key is not allowed to use model {request.model.value}"
+        )
+
+    # With auth disabled every caller is the same anonymous record, and one
+    # shared bucket would let any client throttle all the others
+    if api_key is ANONYMOUS_KEY:
+        return None
+
+    result = await check_rate_limit(
+        api_key.key_id,
+        api_key.requests_per_minute,
+        api_key.image_tokens_per_minute,
+        estimate_image_tokens(request)
+    )
+    if result is not None and not result.allowed:
+        _reject(
+            api_key, request, status.HTTP_429_TOO_MANY_REQUESTS,
+            "Rate limit exceeded", result.headers()
+        )
+    return result
+
+
+async def enforce_key_limits(
+    response: Response,
+    request: ImageGenerationRequest = Depends(routed_request),
+    api_key: ApiKeyRecord = Depends(get_api_key)
+) -> ApiKeyRecord:
+    """
+    Apply the key's model allowlist and rate limits to a generation request
+
+    Sets ``RateLimit-*`` headers on the response.
+
+    Returns:
+        ApiKeyRecord: The record of the validated API key
+
+    Raises:
+        HTTPException: 403 if the model is not allowed, 429 if rate limited
+    """
+    result = await check_key_limits(request, api_key)
+    if result is not None:
+        response.headers.update(result.headers())
+    return api_key
@@ -4,7 +4,7 @@ API router for v1 endpoints
 
 from fastapi import APIRouter
 
-from app.api.v1.endpoints import generate
+from app.api.v1.endpoints import cache, generate, history, metrics, profile, session, usage
 
 # Create API router for v1
 api_router = APIRouter(
@@ -21,4 +21,40 @@ api_router.include_router(
     generate.router,
     prefix="/generate",
     tags=["image-generation"],
-) 
\ No newline at end of file
+) 
+
+api_router.include_router(
+    session.router,
+    prefix="/generate",
+    tags=["image-generation"],
+)
+
+api_router.include_router(
+    cache.router,
+    prefix="/cache",
+    tags=["cache"],
+)
+
+api_router.include_router(
+    history.router,
+    prefix="/history",
+    tags=["history"],
+)
+
+api_router.include_router(
+    metrics.router,
+    prefix="/metrics",
+    tags=["metrics"],
+)
+
+api_router.include_router(
+    profile.router,
+    prefix="/profile",
+    tags=["metrics"],
+)
+
+api_router.include_router(
+    usage.router,
+    prefix="/usage",
+    tags=["usage"],
+)
\ No newline at end of file
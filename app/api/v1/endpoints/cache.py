@@ -0,0 +1,54 @@
+"""
+Peer endpoints of the cluster-wide result cache
+
+Only other nodes of the cluster call these; they must send the shared
+``CLUSTER_SECRET``. Lookups only consult this node's local cache, so a
+request is never forwarded twice.
+"""
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Path, Request, Response
+from pydantic import ValidationError
+
+from app.schemas.image import ImageGenerationResponse
+from app.services.result_cache import result_cache
+from app.utils.json_response import image_response
+
+# Create router
+router = APIRouter()
+
+KEY_PATH = Path(..., pattern="^[0-9a-f]{64}$", description="Cache key (hex SHA-256)")
+
+
+def _require_peer(secret: Optional[str]) -> None:
+    if not result_cache.enabled:
+        raise HTTPException(status_code=404, detail="Result cache is disabled")
+    if not result_cache.authorized(secret):
+        raise HTTPException(status_code=403, detail="Cluster secret required")
+
+
+@router.get("/{key}", include_in_schema=False)
+async def get_cached(key: str = KEY_PATH, x_cluster_secret: Optional[str] = Header(default=None)) -> Response:
+    """Return this node's cached result for ``key``"""
+    _require_peer(x_cluster_secret)
+    response = result_cache.local.get(key)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not cached")
+    return image_response(response)
+
+
+@router.put("/{key}", status_code=204, include_in_schema=False)
+async def put_cached(
+    http_request: Request,
+    key: str = KEY_PATH,
+    x_cluster_secret: Optional[str] = Header(default=None)
+) -> Response:
+    """Store a result this node owns"""
+    # Check the secret before reading a potentially large body
+    _require_peer(x_cluster_secret)
+    try:
+        response = ImageGenerationResponse.model_validate_json(await http_request.body())
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    result_cache.local.put(key, response)
+    return Response(status_code=204)
@@ -1,39 +1,280 @@
 """
 Image generation API endpoints
 """
-from fastapi import APIRouter, Depends, HTTPException
+import logging
+import math
+import time
+from typing import Mapping, Optional, Tuple
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
 from fastapi.responses import JSONResponse
+from starlette.background import BackgroundTasks
 
 from app.schemas.image import ImageGenerationRequest, ImageGenerationResponse
+from app.services.cancellation import ClientDisconnected, cancel_on_disconnect, cancellation_stats
+from app.services.deadlines import Deadline, DeadlineExceeded, latency_model
+from app.services.history import generation_history, history_entry
 from app.services.image_service import generate_image
-from app.api.deps import get_api_key
+from app.services.key_registry import ANONYMOUS_KEY, ApiKeyRecord
+from app.services.memory_budget import MemoryBudgetExceeded, estimate_request_bytes, memory_budget
+from app.services.model_router import is_upstream_failure, model_router
+from app.services.rate_limit import adjust_rate_limit, estimate_image_tokens
+from app.services.request_log import CANCELLED_STATUS, RequestTrace, trace_request
+from app.services.result_cache import HIT, MISS, NEAR_HIT, result_cache
+from app.services.scheduler import PriorityClass, SchedulerTimeout, resolve_priority, scheduler
+from app.services.upstream_pool import NoUpstreamAvailable
+from app.services.usage_ledger import record_generation
+from app.utils.json_response import image_response
+from app.api.deps import enforce_key_limits, routed_request
+
+# Configure logging
+logger = logging.getLogger(__name__)
 
 # Create router
 router = APIRouter()
 
+# Suggested client back-off when a request expires in the scheduler queue
+SCHEDULER_RETRY_AFTER_SECONDS = 10
+# Suggested client back-off when the worker's memory budget is exhausted
+MEMORY_RETRY_AFTER_SECONDS = 5
+
+
+def _deadline_exceeded(detail: str) -> HTTPException:
+    return HTTPException(status_code=504, detail=detail)
+
 
 @router.post("/", response_model=ImageGenerationResponse, status_code=200)
 async def create_image(
-    request: ImageGenerationRequest,
-    api_key: str = Depends(get_api_key)
-) -> ImageGenerationResponse:
+    http_request: Request,
+    http_response: Response,
+    request: ImageGenerationRequest = Depends(routed_request),
+    api_key: ApiKeyRecord = Depends(enforce_key_limits),
+    x_priority: Optional[str] = Header(default=None, description="Optionally lower the request's priority class (batch, background)"),
+    x_deadline_ms: Optional[int] = Header(default=None, ge=1, description="Milliseconds the client will wait for the response")
+) -> Response:
     """
     Generate an image based on the provided prompt and parameters.
     
-    - **model**: The model to use for image generation (gpt-image-1, dall-e-3, dall-e-2)
+    - **model**: The model to use for image generation (gpt-image-1, dall-e-3, dall-e-2, or auto)
     - **prompt**: The text prompt to generate an image from
     - **n**: Number of images to generate (1-10)
     - **size**: Size of the generated image
     - **quality**: Quality of the generated image
     - **format**: Format to return the image in (png, jpeg)
+    - **tier**: With model auto, pick the cheapest (cheap) or fastest (fast) suitable model
+
+    With an ``x-deadline-ms`` header, requests that cannot be answered in time
+    fail fast with 504 instead of being queued or sent upstream.
+    """
+    deadline = Deadline(x_deadline_ms / 1000 if x_deadline_ms else None)
+    priority = resolve_priority(api_key.priority, x_priority)
+    reserved_bytes = estimate_request_bytes(request)
+    with trace_request(api_key.key_id, request, http_request.state.client_request) as trace:
+        predicted = await admit(request, deadline, reserved_bytes)
+        after_response = BackgroundTasks()
+        try:
+            # Abandoned requests give up their slot and abort the upstream call
+            result = await cancel_on_disconnect(
+                _generate(request, api_key, priority, trace, deadline, predicted, http_response.headers, after_response),
+                http_request.receive
+            )
+        except ClientDisconnected as e:
+            memory_budget.release(reserved_bytes)
+            record_cancellation(trace, request)
+            raise HTTPException(status_code=CANCELLED_STATUS, detail=str(e))
+        except BaseException:
+            memory_budget.release(reserved_bytes)
+            raise
+        # The reservation covers the response body (and the images the history
+        # keeps until it has saved them), so hold it until both are done
+        after_response.add_task(memory_budget.release, reserved_bytes)
+        result.background = after_response
+        return result
+
+
+async def admit(request: ImageGenerationRequest, deadline: Deadline, reserved_bytes: int) -> float:
+    """
+    Reject a request that cannot meet its deadline, then reserve its memory.
+
+    Returns:
+        The predicted upstream latency in seconds (0.0 while the model is learning)
+
+    Raises:
+        HTTPException: 504 if the deadline cannot be met, 503 if memory stays exhausted
+    """
+    # Time the upstream call is expected to need once the request is admitted
+    predicted = latency_model.predict(request) or 0.0
+    if deadline.expired(predicted):
+        latency_model.rejected_early += 1
+        raise _deadline_exceeded("Request cannot complete within its deadline")
+    try:
+        await memory_budget.acquire(reserved_bytes, max_wait=deadline.budget(predicted))
+    except MemoryBudgetExceeded as e:
+        if deadline.expired(predicted):
+            latency_model.expired += 1
+            raise _deadline_exceeded("Request deadline passed while waiting for memory")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(MEMORY_RETRY_AFTER_SECONDS)}
+        )
+    return predicted
+
+
+def _phase(trace: RequestTrace) -> str:
+    """Which stage a request had reached, from the marks on its trace"""
+    if "queue_ms" not in trace.timings:
+        return "queue"
+    if "generate_ms" not in trace.timings:
+        return "generate"
+    return "respond"
+
+
+def served_from_cache(trace: RequestTrace) -> bool:
+    """Whether the response is an earlier generation's result, which the history already holds"""
+    return trace.fields.get("cache") in (HIT, NEAR_HIT)
+
+
+def record_cancellation(trace: RequestTrace, request: ImageGenerationRequest) -> None:
+    """Count a generation abandoned by its client, by the stage it had reached"""
+    cancellation_stats.record(_phase(trace), request.n, estimate_image_tokens(request))
+
+
+async def _generate(
+    request: ImageGenerationRequest,
+    api_key: ApiKeyRecord,
+    priority: PriorityClass,
+    trace: RequestTrace,
+    deadline: Deadline,
+    predicted: float,
+    headers: Optional[Mapping[str, str]] = None,
+    after_response: Optional[BackgroundTasks] = None,
+) -> Response:
+    """Run a generation through the scheduler and build the HTTP response"""
+    response = await run_generation(request, api_key, priority, trace, deadline, predicted)
+    if after_response is not None and not served_from_cache(trace):
+        after_response.add_task(
+            generation_history.save,
+            history_entry(trace.request_id, api_key.key_id, request, response)
+        )
+    if "cache" in trace.fields:
+        headers = dict(headers or {}, **{"X-Cache": trace.fields["cache"].upper()})
+    # Encode directly rather than through response_model; keep headers set by dependencies
+    return image_response(response, headers=headers)
+
+
+async def run_generation(
+    request: ImageGenerationRequest,
+    api_key: ApiKeyRecord,
+    priority: PriorityClass,
+    trace: RequestTrace,
+    deadline: Deadline,
+    predicted: float,
+) -> ImageGenerationResponse:
+    """
+    Run an admitted generation through the scheduler and record its usage.
+
+    Results of identical earlier requests (or near-identical ones, for keys
+    that opt in) are served from the result cache without taking a
+    scheduler slot.
+
+    Raises:
+        HTTPException: With the status the client should see if the generation failed
     """
+    # Settle against what was charged at admission, even if a fallback model is used
+    charged_tokens = estimate_image_tokens(request)
+    cached, outcome = await result_cache.lookup(request, api_key.near_duplicates)
+    if cached is not None:
+        trace.mark("cache")
+        trace.fields["cache"] = outcome
+        trace.set_response(cached)
+        if api_key is not ANONYMOUS_KEY:
+            # Nothing was generated: give back the tokens charged up front
+            await adjust_rate_limit(api_key.key_id, api_key.image_tokens_per_minute, -charged_tokens)
+        return cached
+
     try:
-        return await generate_image(request)
+        # Stop queueing once the remaining time no longer covers the upstream call
+        async with scheduler.slot(api_key.key_id, priority, api_key.weight, request.n, deadline.budget(predicted)):
+            trace.mark("queue")
+            response, generated, upstream_seconds = await _generate_with_fallback(request, api_key, deadline)
+            latency_ms = trace.mark("generate")
+    except SchedulerTimeout as e:
+        if deadline.expired(predicted):
+            latency_model.expired += 1
+            raise _deadline_exceeded("Request deadline passed while queued")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(SCHEDULER_RETRY_AFTER_SECONDS)}
+        )
+    except DeadlineExceeded as e:
+        latency_model.expired += 1
+        raise _deadline_exceeded(str(e))
+    except NoUpstreamAvailable as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Image generation failed: {str(e)}"
         )
+    if generated is not request:
+        trace.fields["fallback_model"] = generated.model.value
+        request = generated
+    trace.set_response(response)
+    latency_model.observe(request, upstream_seconds)
+
+    # Settle the token bucket with the actual usage reported upstream
+    if api_key is not ANONYMOUS_KEY and response.usage is not None:
+        await adjust_rate_limit(
+            api_key.key_id,
+            api_key.image_tokens_per_minute,
+            response.usage.total_tokens - charged_tokens
+        )
+    record_generation(trace.request_id, api_key.key_id, request, response, latency_ms)
+    if result_cache.enabled:
+        trace.fields["cache"] = MISS
+        result_cache.put(request, response)
+    if deadline.expired():
+        latency_model.expired += 1
+        raise _deadline_exceeded("Request deadline passed before the response was ready")
+    return response
+
+
+async def _generate_with_fallback(
+    request: ImageGenerationRequest,
+    api_key: ApiKeyRecord,
+    deadline: Deadline,
+) -> Tuple[ImageGenerationResponse, ImageGenerationRequest, float]:
+    """
+    Call upstream, moving a routed request to another model when its model fails.
+
+    Returns:
+        The response, the request that produced it and the upstream latency in seconds
+    """
+    tried = []
+    while True:
+        started = time.perf_counter()
+        try:
+            response = await generate_image(request, deadline)
+        except Exception as e:
+            if not is_upstream_failure(e):
+                raise
+            model_router.record(request.model.value, e)
+            tried.append(request.model.value)
+            # Only routed requests carry a tier; explicit models are never swapped
+            fallback = model_router.fallback(request, tried, api_key, deadline.remaining()) if request.tier else None
+            if fallback is None:
+                raise
+            logger.warning("Model %s failed (%s), retrying on %s", request.model.value, e, fallback.model.value)
+            request = fallback
+            continue
+        model_router.record(request.model.value)
+        return response, request, time.perf_counter() - started
 
 
 # Add OpenAPI documentation code samples
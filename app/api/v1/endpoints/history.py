@@ -0,0 +1,72 @@
+"""
+Generation history endpoints
+"""
+import os
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse
+
+from app.api.deps import get_api_key
+from app.services.history import InvalidCursor, generation_history
+from app.services.key_registry import ApiKeyRecord
+
+# Create router
+router = APIRouter()
+
+
+@router.get("/")
+async def list_history(
+    http_request: Request,
+    q: Optional[str] = Query(default=None, description="Words that must appear in the prompt (prefix match)"),
+    model: Optional[str] = Query(default=None, description="Only generations from this model"),
+    since: Optional[float] = Query(default=None, description="Unix timestamp lower bound"),
+    until: Optional[float] = Query(default=None, description="Unix timestamp upper bound (exclusive)"),
+    key_id: Optional[str] = Query(default=None, description="Restrict to one API key (admin keys only)"),
+    limit: int = Query(default=20, ge=1, le=100, description="Page size"),
+    cursor: Optional[str] = Query(default=None, description="next_cursor from the previous page"),
+    api_key: ApiKeyRecord = Depends(get_api_key)
+) -> Dict[str, Any]:
+    """
+    Search past generations, newest first.
+
+    Pages are keyset-paginated: pass ``next_cursor`` back as ``cursor`` to
+    get the next page. Non-admin keys only see their own generations.
+    """
+    if not api_key.admin:
+        key_id = api_key.key_id
+    try:
+        items, next_cursor = await generation_history.search(key_id, q, model, since, until, limit, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    for item in items:
+        item["image_urls"] = [
+            http_request.url_for("history_image", request_id=item["request_id"], index=i).path
+            for i in range(item["images"])
+        ]
+    return {"data": items, "next_cursor": next_cursor}
+
+
+@router.get("/{request_id}/images/{index}", name="history_image", response_class=FileResponse)
+async def get_history_image(
+    request_id: str,
+    index: int,
+    api_key: ApiKeyRecord = Depends(get_api_key)
+) -> FileResponse:
+    """
+    Download an image from a past generation.
+
+    Non-admin keys can only download their own images.
+    """
+    item = await generation_history.get(request_id)
+    if item is None or (not api_key.admin and item["key_id"] != api_key.key_id) or not 0 <= index < item["images"]:
+        raise HTTPException(status_code=404, detail="Image not found")
+    path = generation_history.image_path(request_id, index, item["filetype"])
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(
+        path,
+        media_type=f"image/{item['filetype']}",
+        headers={"Cache-Control": "private, max-age=31536000, immutable"},
+    )
@@ -0,0 +1,50 @@
+"""
+Service metrics endpoints
+"""
+from typing import Any, Dict
+
+from fastapi import APIRouter, Depends
+
+from app.api.deps import require_admin
+from app.services.cache_warming import cache_warmer
+from app.services.cancellation import cancellation_stats
+from app.services.deadlines import latency_model
+from app.services.history import generation_history
+from app.services.key_registry import ApiKeyRecord
+from app.services.memory_budget import memory_budget
+from app.services.model_router import model_router
+from app.services.profiling import loop_monitor
+from app.services.readiness import readiness
+from app.services.request_log import request_log
+from app.services.result_cache import result_cache
+from app.services.scheduler import scheduler
+from app.services.usage_ledger import usage_ledger
+from app.utils.openai_utils import get_client
+
+# Create router
+router = APIRouter()
+
+
+@router.get("/")
+async def get_metrics(api_key: ApiKeyRecord = Depends(require_admin)) -> Dict[str, Any]:
+    """
+    Report scheduler queues, memory admission and upstream account health for this worker.
+
+    Requires an admin API key.
+    """
+    pool = get_client()
+    return {
+        "readiness": readiness(),
+        "scheduler": scheduler.metrics(),
+        "memory": memory_budget.metrics(),
+        "cancellation": cancellation_stats.metrics(),
+        "deadlines": latency_model.metrics(),
+        "event_loop": loop_monitor.metrics(),
+        "upstream": pool.snapshot() if pool else [],
+        "model_router": model_router.metrics(),
+        "result_cache": result_cache.metrics(),
+        "cache_warming": cache_warmer.metrics(),
+        "usage_ledger": usage_ledger.metrics(),
+        "history": generation_history.metrics(),
+        "request_log": request_log.metrics(),
+    }
@@ -0,0 +1,36 @@
+"""
+On-demand profiling endpoints
+"""
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from app.api.deps import require_admin
+from app.core.config import settings
+from app.services.key_registry import ApiKeyRecord
+from app.services.profiling import ProfilerBusy, sampling_profiler
+
+# Create router
+router = APIRouter()
+
+
+@router.get("/", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(default=10.0, gt=0, le=settings.PROFILER_MAX_SECONDS, description="How long to sample"),
+    interval_ms: float = Query(default=5.0, ge=1, le=1000, description="Milliseconds between samples"),
+    all_threads: bool = Query(default=False, description="Sample every thread, not only the event loop's"),
+    api_key: ApiKeyRecord = Depends(require_admin)
+) -> PlainTextResponse:
+    """
+    Sample this worker's stacks and return a collapsed-stack profile.
+
+    The output feeds straight into flamegraph.pl or speedscope. Only one
+    profile runs per worker at a time. Requires an admin API key.
+    """
+    try:
+        collapsed = await sampling_profiler.profile(seconds, interval_ms / 1000, all_threads)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(
+        collapsed,
+        headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'},
+    )
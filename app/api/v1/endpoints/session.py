@@ -0,0 +1,305 @@
+"""
+WebSocket generation sessions
+
+One authenticated connection carries many generations. Client messages are
+JSON text frames:
+
+    {"type": "generate", "id": "a1", "request": {...}, "priority": "batch", "deadline_ms": 30000}
+    {"type": "cancel", "id": "a1"}
+
+Server messages are JSON text frames, except that every ``image`` message is
+immediately followed by one binary frame holding the raw image bytes:
+
+    {"type": "image", "id": "a1", "index": 0, "count": 2, "filetype": "png", "size": "1024x1024", "bytes": 1234}
+    {"type": "done", "id": "a1", "model": "gpt-image-1", "created": 1700000000, "images": 2, "usage": {...}}
+    {"type": "cancelled", "id": "a1"}
+    {"type": "error", "id": "a1", "status": 429, "detail": "Rate limit exceeded"}
+
+Generations on one connection run concurrently (up to ``WS_MAX_IN_FLIGHT``)
+through the same admission, scheduling and accounting as the HTTP endpoint,
+and each image is sent as soon as its generation has finished. Outgoing
+frames pass through a per-connection buffer capped at
+``WS_MAX_BUFFERED_BYTES``: when a client reads slowly, its generations wait
+for the buffer to drain instead of piling up decoded images in the worker,
+and a client that stops reading for ``WS_SEND_TIMEOUT_SECONDS`` is
+disconnected.
+
+Replies to the client's own messages (errors, ``cancelled``) skip that
+buffer and go out before any queued image, so reading messages never waits
+on a slow client and a cancel takes effect at once. Frames still queued for
+a cancelled generation are dropped.
+"""
+import asyncio
+import base64
+import json
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+from pydantic import ValidationError
+
+from app.api.deps import check_key_limits, route_request, websocket_api_key
+from app.api.v1.endpoints.generate import admit, record_cancellation, run_generation, served_from_cache
+from app.core.config import settings
+from app.schemas.image import ImageGenerationRequest
+from app.services.deadlines import Deadline
+from app.services.history import generation_history, history_entry
+from app.services.key_registry import ApiKeyRecord
+from app.services.memory_budget import estimate_request_bytes, memory_budget
+from app.services.request_log import trace_request
+from app.services.scheduler import resolve_priority
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Create router
+router = APIRouter()
+
+Frame = Union[str, bytes]
+
+# Most replies that may wait to be sent; more means the client is not reading
+MAX_PENDING_REPLIES = 256
+
+
+class ClientNotReading(Exception):
+    """Raised when a client leaves frames unread for too long"""
+
+
+class _Outbox:
+    """
+    Outgoing frames of one connection.
+
+    Generation frames are bounded by their total size; replies are small,
+    never wait for space and are sent first.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.buffered = 0
+        self._items: Deque[Tuple[List[Frame], int, Optional[str]]] = deque()
+        self._replies: Deque[str] = deque()
+        self._changed = asyncio.Condition()
+
+    async def put(self, frames: List[Frame], gen_id: Optional[str] = None) -> None:
+        """Queue a generation's frames to be sent together, waiting while the buffer is full"""
+        size = sum(len(frame) for frame in frames)
+        async with self._changed:
+            # A message larger than the whole buffer is still sent, on its own
+            await self._changed.wait_for(lambda: self.buffered == 0 or self.buffered + size <= self.max_bytes)
+            self._items.append((frames, size, gen_id))
+            self.buffered += size
+            self._changed.notify_all()
+
+    async def reply(self, frame: str) -> None:
+        """
+        Queue a reply ahead of generation frames without waiting for space
+
+        Raises:
+            ClientNotReading: If too many replies are already waiting
+        """
+        async with self._changed:
+            if len(self._replies) >= MAX_PENDING_REPLIES:
+                raise ClientNotReading(f"Client left {MAX_PENDING_REPLIES} replies unread")
+            self._replies.append(frame)
+            self._changed.notify_all()
+
+    async def discard(self, gen_id: str) -> None:
+        """Drop frames still queued for a generation"""
+        async with self._changed:
+            kept = deque(item for item in self._items if item[2] != gen_id)
+            self.buffered -= sum(item[1] for item in self._items if item[2] == gen_id)
+            self._items = kept
+            self._changed.notify_all()
+
+    async def get(self) -> Tuple[List[Frame], int]:
+        async with self._changed:
+            await self._changed.wait_for(lambda: bool(self._replies or self._items))
+            if self._replies:
+                return [self._replies.popleft()], 0
+            frames, size, _ = self._items.popleft()
+            return frames, size
+
+    async def sent(self, size: int) -> None:
+        async with self._changed:
+            self.buffered -= size
+            self._changed.notify_all()
+
+
+def _message(**fields: Any) -> str:
+    return json.dumps(fields)
+
+
+class GenerationSession:
+    """The generations running on one WebSocket connection"""
+
+    def __init__(self, websocket: WebSocket, api_key: ApiKeyRecord):
+        self.websocket = websocket
+        self.api_key = api_key
+        self.outbox = _Outbox(settings.WS_MAX_BUFFERED_BYTES)
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    async def send(self, **fields: Any) -> None:
+        """Send a generation's message after its queued images"""
+        await self.outbox.put([_message(**fields)], fields.get("id"))
+
+    async def reply(self, **fields: Any) -> None:
+        """Answer a client message without waiting for queued images"""
+        await self.outbox.reply(_message(**fields))
+
+    async def run(self) -> None:
+        """Serve the connection until the client leaves or stops reading"""
+        writer = asyncio.create_task(self._write())
+        reader = asyncio.create_task(self._read())
+        try:
+            done, _ = await asyncio.wait({reader, writer}, return_when=asyncio.FIRST_COMPLETED)
+            error = next((t.exception() for t in done if not t.cancelled() and t.exception()), None)
+            if isinstance(error, ClientNotReading):
+                logger.warning("Closing generation session: %s", error)
+                try:
+                    await asyncio.wait_for(
+                        self.websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Client is not reading"),
+                        timeout=1.0
+                    )
+                except Exception:
+                    # The transport is stuck or gone; the server drops it when we return
+                    pass
+        finally:
+            reader.cancel()
+            writer.cancel()
+            for task in list(self.tasks.values()):
+                task.cancel()
+            await asyncio.gather(reader, writer, *self.tasks.values(), return_exceptions=True)
+
+    async def _write(self) -> None:
+        while True:
+            frames, size = await self.outbox.get()
+            for frame in frames:
+                if isinstance(frame, bytes):
+                    send = self.websocket.send_bytes(frame)
+                else:
+                    send = self.websocket.send_text(frame)
+                try:
+                    await asyncio.wait_for(send, timeout=settings.WS_SEND_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    raise ClientNotReading(f"Client did not read for {settings.WS_SEND_TIMEOUT_SECONDS:.0f}s")
+            await self.outbox.sent(size)
+
+    async def _read(self) -> None:
+        try:
+            while True:
+                raw = await self.websocket.receive_text()
+                try:
+                    message = json.loads(raw)
+                    kind, gen_id = message["type"], message.get("id")
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    await self.reply(type="error", id=None, status=400, detail="Messages must be JSON objects with a type")
+                    continue
+                if kind == "generate":
+                    await self._start(gen_id, message)
+                elif kind == "cancel":
+                    await self._cancel(gen_id)
+                else:
+                    await self.reply(type="error", id=gen_id, status=400, detail=f"Unknown message type: {kind}")
+        except (WebSocketDisconnect, KeyError):
+            # KeyError: the client sent a binary frame where text was expected
+            pass
+
+    async def _start(self, gen_id: Any, message: Dict[str, Any]) -> None:
+        if not isinstance(gen_id, str) or not gen_id:
+            await self.reply(type="error", id=gen_id, status=400, detail="Generate messages need a string id")
+            return
+        if gen_id in self.tasks:
+            await self.reply(type="error", id=gen_id, status=409, detail="A generation with this id is already running")
+            return
+        if len(self.tasks) >= settings.WS_MAX_IN_FLIGHT:
+            await self.reply(
+                type="error", id=gen_id, status=429,
+                detail=f"At most {settings.WS_MAX_IN_FLIGHT} generations may run at once on a connection"
+            )
+            return
+        try:
+            request = ImageGenerationRequest.model_validate(message.get("request"))
+            deadline_ms = message.get("deadline_ms")
+            if deadline_ms is not None and (not isinstance(deadline_ms, int) or deadline_ms < 1):
+                raise ValueError("deadline_ms must be a positive integer")
+        except (ValidationError, ValueError) as e:
+            await self.reply(type="error", id=gen_id, status=422, detail=str(e))
+            return
+        deadline = Deadline(deadline_ms / 1000 if deadline_ms else None)
+        task = asyncio.create_task(self._generate(gen_id, request, message.get("priority"), deadline))
+        self.tasks[gen_id] = task
+        task.add_done_callback(lambda t: self.tasks.pop(gen_id) if self.tasks.get(gen_id) is t else None)
+
+    async def _cancel(self, gen_id: Any) -> None:
+        task = self.tasks.pop(gen_id, None)
+        if task is None:
+            await self.reply(type="error", id=gen_id, status=404, detail="No generation with this id is running")
+            return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # Images the client no longer wants are not sent
+        await self.outbox.discard(gen_id)
+        await self.reply(type="cancelled", id=gen_id)
+
+    async def _generate(self, gen_id: str, request: ImageGenerationRequest, priority: Optional[str], deadline: Deadline) -> None:
+        try:
+            client_request = request
+            request = route_request(request, self.api_key, deadline.remaining())
+            await check_key_limits(request, self.api_key)
+            reserved_bytes = estimate_request_bytes(request)
+            with trace_request(self.api_key.key_id, request, client_request) as trace:
+                try:
+                    predicted = await admit(request, deadline, reserved_bytes)
+                    try:
+                        response = await run_generation(
+                            request, self.api_key, resolve_priority(self.api_key.priority, priority),
+                            trace, deadline, predicted
+                        )
+                        images = len(response.images)
+                        entry = None
+                        if not served_from_cache(trace):
+                            entry = history_entry(trace.request_id, self.api_key.key_id, request, response)
+                        await self._send_images(gen_id, response.images)
+                        await self.send(
+                            type="done", id=gen_id, model=response.model, created=response.created,
+                            images=images, usage=response.usage.model_dump() if response.usage else None,
+                        )
+                        if entry is not None:
+                            await generation_history.save(entry)
+                    finally:
+                        memory_budget.release(reserved_bytes)
+                except asyncio.CancelledError:
+                    record_cancellation(trace, request)
+                    raise
+        except HTTPException as e:
+            await self.send(type="error", id=gen_id, status=e.status_code, detail=e.detail)
+        except Exception as e:
+            logger.error("Generation %s failed in session: %s", gen_id, e)
+            await self.send(type="error", id=gen_id, status=500, detail="Image generation failed")
+
+    async def _send_images(self, gen_id: str, images: list) -> None:
+        for index, image in enumerate(images):
+            # Decode one image at a time; the outbox bounds how many wait to be sent
+            data = base64.b64decode(image.b64_json)
+            header = _message(
+                type="image", id=gen_id, index=index, count=len(images),
+                filetype=image.filetype, size=image.size, bytes=len(data),
+            )
+            await self.outbox.put([header, data], gen_id)
+
+
+@router.websocket("/ws")
+async def generation_session(websocket: WebSocket):
+    """
+    Run many generations over one WebSocket connection.
+
+    Authenticate with the API key header or the ``api_key`` query parameter.
+    See the module docstring for the message protocol.
+    """
+    api_key = websocket_api_key(websocket)
+    if api_key is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid or missing API key")
+        return
+    await websocket.accept()
+    await GenerationSession(websocket, api_key).run()
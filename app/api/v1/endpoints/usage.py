@@ -0,0 +1,45 @@
+"""
+Usage and cost reporting endpoints
+"""
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.api.deps import get_api_key
+from app.services.key_registry import ApiKeyRecord
+from app.services.usage_ledger import GROUP_BY, usage_ledger
+
+# Create router
+router = APIRouter()
+
+
+@router.get("/")
+async def get_usage(
+    group_by: str = Query(default="key", description="Comma-separated dimensions: key, model, hour, size"),
+    key_id: Optional[str] = Query(default=None, description="Restrict to one API key (admin keys only)"),
+    since: Optional[float] = Query(default=None, description="Unix timestamp lower bound, rounded down to the hour"),
+    until: Optional[float] = Query(default=None, description="Unix timestamp upper bound (exclusive), rounded up to the hour"),
+    api_key: ApiKeyRecord = Depends(get_api_key)
+) -> Dict[str, Any]:
+    """
+    Aggregate request counts, images, tokens, latency and estimated cost.
+
+    Results come from hourly summaries, so ``since`` and ``until`` select
+    whole hours: every hour overlapping the range is counted in full. Usage
+    recorded in the last few seconds may not be included yet. Non-admin
+    keys only see their own usage.
+    """
+    dimensions = [g.strip() for g in group_by.split(",") if g.strip()]
+    unknown = [g for g in dimensions if g not in GROUP_BY]
+    if unknown:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unknown group_by dimension(s): {', '.join(unknown)}"
+        )
+    if not api_key.admin:
+        key_id = api_key.key_id
+
+    return {
+        "group_by": dimensions,
+        "data": await usage_ledger.summary(dimensions, key_id, since, until),
+    }
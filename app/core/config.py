@@ -1,7 +1,7 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, field_validator
 import os
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from functools import lru_cache
 
 
@@ -19,6 +19,16 @@ class Settings(BaseSettings):
     
     # OpenAI API settings
     OPENAI_API_KEY: Optional[str] = None
+    OPENAI_BASE_URL: Optional[str] = None
+    # Upstream account pool, as a JSON list of
+    # {"name", "api_key", "org_id", "base_url", "weight"} objects
+    OPENAI_ACCOUNTS: List[Dict[str, Any]] = []
+    UPSTREAM_TIMEOUT_SECONDS: float = 120.0
+    UPSTREAM_MAX_CONNECTIONS: int = 20
+    UPSTREAM_MAX_ATTEMPTS: int = 2
+    UPSTREAM_EJECT_AFTER_FAILURES: int = 3
+    UPSTREAM_EJECTION_SECONDS: float = 30.0
+    UPSTREAM_MAX_EJECTION_SECONDS: float = 300.0
     
     # Image Generation Settings
     DEFAULT_MODEL: str = "gpt-image-1"
@@ -30,6 +40,104 @@ class Settings(BaseSettings):
     # (For MVP, we'll use API key in header, later implement Auth0/SSO)
     API_KEY_NAME: str = "x-api-key"
     API_KEY: Optional[str] = None
+    # Multi-tenant keys: JSON file or SQLite database (.db/.sqlite) of hashed keys
+    API_KEYS_FILE: Optional[str] = None
+    API_KEY_HASH_SECRET: Optional[str] = None
+    API_KEYS_REFRESH_SECONDS: float = 30.0
+
+    # Per-key rate limiting (0 disables a limit)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = "memory"  # "memory" or "sqlite" (shared across workers)
+    RATE_LIMIT_STORE_PATH: str = "data/ratelimit.db"
+    DEFAULT_REQUESTS_PER_MINUTE: int = 60
+    DEFAULT_IMAGE_TOKENS_PER_MINUTE: int = 100000
+
+    # Request scheduling (per worker)
+    SCHEDULER_MAX_CONCURRENCY: int = 8
+    SCHEDULER_DEADLINE_SECONDS: Dict[str, float] = {"interactive": 60.0, "batch": 600.0, "background": 1800.0}
+    SCHEDULER_STARVATION_SECONDS: float = 30.0
+
+    # Usage and cost ledger
+    USAGE_DB_PATH: str = "data/usage.db"
+    USAGE_FLUSH_SECONDS: float = 5.0
+    USAGE_BATCH_SIZE: int = 500
+
+    # Result cache: identical requests are answered from a cache (off by
+    # default, since it makes repeated prompts return the same images)
+    RESULT_CACHE_ENABLED: bool = False
+    RESULT_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    RESULT_CACHE_TTL_SECONDS: float = 24 * 3600
+    # Cluster-wide cache: each key is owned by one node (rendezvous hashing)
+    CLUSTER_SELF_URL: Optional[str] = None  # This node's base URL as peers reach it
+    CLUSTER_PEERS: List[str] = []  # Peer base URLs
+    CLUSTER_PEERS_FILE: Optional[str] = None  # One peer URL per line, re-read on change
+    CLUSTER_PEERS_REFRESH_SECONDS: float = 5.0  # How often the peers file is checked
+    CLUSTER_SECRET: Optional[str] = None  # Required on peer-to-peer cache requests
+    CLUSTER_PEER_TIMEOUT_SECONDS: float = 0.5
+    # Near-duplicate prompts: keys with near_duplicates set may be served the
+    # result of a recent prompt whose words are at least this similar
+    NEAR_DUPLICATE_ENABLED: bool = False
+    NEAR_DUPLICATE_THRESHOLD: float = 0.8
+    NEAR_DUPLICATE_INDEX_SIZE: int = 10000
+    # Off-peak cache warming: once per daily UTC window, pre-generate the most
+    # requested results from the request log, up to a spend budget per window
+    CACHE_WARMING_ENABLED: bool = False
+    CACHE_WARMING_START_HOUR_UTC: int = 2
+    CACHE_WARMING_END_HOUR_UTC: int = 5
+    CACHE_WARMING_BUDGET_USD: float = 5.0
+    CACHE_WARMING_LOOKBACK_HOURS: float = 72.0
+    CACHE_WARMING_MAX_ENTRIES: int = 100
+    CACHE_WARMING_MIN_REQUESTS: int = 3
+    CACHE_WARMING_MAX_LOAD: float = 0.5  # Only warm while live load is below this
+    CACHE_WARMING_POLL_SECONDS: float = 60.0
+
+    # WebSocket generation sessions (per connection)
+    WS_MAX_IN_FLIGHT: int = 4
+    WS_MAX_BUFFERED_BYTES: int = 16 * 1024 * 1024
+    WS_SEND_TIMEOUT_SECONDS: float = 30.0
+
+    # Generation history: metadata in SQLite, image files on disk
+    HISTORY_ENABLED: bool = True
+    HISTORY_DB_PATH: str = "data/history.db"
+    HISTORY_IMAGE_DIR: str = "data/images"
+
+    # Structured request log (JSONL, written by a background thread)
+    REQUEST_LOG_ENABLED: bool = True
+    REQUEST_LOG_PATH: str = "logs/requests.jsonl"
+    REQUEST_LOG_MAX_BYTES: int = 50 * 1024 * 1024
+    REQUEST_LOG_MAX_SECONDS: float = 24 * 3600
+    REQUEST_LOG_BACKUP_COUNT: int = 14
+    REQUEST_LOG_BUFFER_SIZE: int = 10000
+
+    # Model router for model "auto": a model that is rate limited, or whose
+    # error rate (EWMA) reaches the maximum, is skipped for the cooldown
+    ROUTER_ERROR_ALPHA: float = 0.2
+    ROUTER_MAX_ERROR_RATE: float = 0.5
+    ROUTER_MIN_REQUESTS: int = 5
+    ROUTER_COOLDOWN_SECONDS: float = 30.0
+
+    # Online latency model used to reject requests that cannot meet their deadline
+    LATENCY_MODEL_ALPHA: float = 0.1
+    LATENCY_MODEL_Z: float = 1.28  # Predict roughly the 90th percentile
+    LATENCY_MODEL_MIN_SAMPLES: int = 5
+
+    # Memory admission control (per worker, 0 disables the budget)
+    MEMORY_BUDGET_BYTES: int = 1024 * 1024 * 1024
+    MEMORY_ADMISSION_WAIT_SECONDS: float = 10.0
+
+    # Responses whose image payloads exceed this many bytes are streamed
+    RESPONSE_STREAMING_MIN_BYTES: int = 4 * 1024 * 1024
+    RESPONSE_STREAMING_CHUNK_BYTES: int = 256 * 1024
+
+    # Readiness: report not-ready once the load score reaches this value
+    # (1.0 = every scheduler slot or the whole memory budget in use)
+    READINESS_MAX_LOAD: float = 1.5
+
+    # Event-loop lag monitor (0 interval disables it) and on-demand profiler
+    LOOP_LAG_INTERVAL_SECONDS: float = 0.05
+    LOOP_LAG_THRESHOLD_SECONDS: float = 0.1
+    LOOP_LAG_EVENTS_KEPT: int = 50
+    PROFILER_MAX_SECONDS: float = 60.0
     
     # Define settings for loading from .env file
     model_config = SettingsConfigDict(
@@ -1,28 +1,43 @@
 """
 Main FastAPI application entry point
+
+Importing this module is on the critical path of every worker boot and test
+run, so it only builds the app. Doc-page dependencies (Jinja templates,
+markdown) load on first use, the upstream pool and the OpenAI SDK load at
+startup, and account validation runs in the background after startup.
+Use ``python profile_imports.py`` to see where import time goes.
 """
 
+import asyncio
 import logging
 import os
-import markdown
+from functools import lru_cache
 from pathlib import Path
-from dotenv import load_dotenv, find_dotenv
+from typing import Optional
+from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse, HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from fastapi.openapi.docs import get_swagger_ui_html, get_redoc_html
 
 from app.api.v1.api import api_router
 from app.core.config import settings
-from app.utils.openai_client import initialize_openai_client
-from app.utils.openai_utils import cleanup_client
+from app.services.cache_warming import cache_warmer
+from app.services.key_registry import key_registry
+from app.services.profiling import loop_monitor
+from app.services.readiness import readiness
+from app.services.result_cache import result_cache
+from app.services.request_log import request_log
+from app.services.usage_ledger import usage_ledger
+from app.utils.openai_client import initialize_openai_client, validate_openai_client
+from app.utils.openai_utils import cleanup_client, is_fallback_mode
 
-# Load environment variables from .env at the very top
+# Load environment variables from the .env file settings are read from
+# (no find_dotenv() directory walk)
 try:
-    dotenv_path = find_dotenv()
-    if dotenv_path:
+    dotenv_path = Path(settings.model_config["env_file"])
+    if dotenv_path.is_file():
         load_dotenv(dotenv_path)
         print(f"Loaded environment variables from {dotenv_path}")
     else:
@@ -37,10 +52,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client
-client, model, fallback = initialize_openai_client()
-if fallback:
-    logger.warning("⚠️ Running in fallback mode! OpenAI API client initialization failed.")
+# Background validation of the upstream accounts, started at startup
+validation_task: Optional[asyncio.Task] = None
 
 # Create FastAPI application
 app = FastAPI(
@@ -79,15 +92,22 @@ async def generic_exception_handler(request: Request, exc: Exception):
 # Include API router
 app.include_router(api_router, prefix=settings.API_PREFIX)
 
-# Mount static files and templates
+# Mount static files
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
-templates = Jinja2Templates(directory="app/templates")
+
+
+@lru_cache(maxsize=None)
+def get_templates():
+    """Load the Jinja templates on first use; only the doc pages need them"""
+    from fastapi.templating import Jinja2Templates
+    return Jinja2Templates(directory="app/templates")
+
 
 # Root endpoint - serve the UI
 @app.get("/", include_in_schema=False)
 async def root(request: Request):
     """Serve the web UI"""
-    return templates.TemplateResponse(
+    return get_templates().TemplateResponse(
         "index.html", 
         {"request": request, "title": settings.PROJECT_NAME}
     )
@@ -96,7 +116,7 @@ async def root(request: Request):
 @app.get("/docs", include_in_schema=False)
 async def swagger_ui(request: Request):
     """Serve custom Swagger UI"""
-    return templates.TemplateResponse(
+    return get_templates().TemplateResponse(
         "api.html", 
         {
             "request": request, 
@@ -110,7 +130,7 @@ async def swagger_ui(request: Request):
 @app.get("/api", include_in_schema=False)
 async def redoc_ui(request: Request):
     """Serve simple API documentation instead of ReDoc"""
-    return templates.TemplateResponse(
+    return get_templates().TemplateResponse(
         "simple_api.html", 
         {
             "request": request, 
@@ -122,7 +142,7 @@ async def redoc_ui(request: Request):
 @app.get("/swagger-ui", include_in_schema=False)
 async def swagger_ui_html(request: Request):
     """Serve raw Swagger UI HTML"""
-    return templates.TemplateResponse(
+    return get_templates().TemplateResponse(
         "swagger.html", 
         {
             "request": request,
@@ -136,7 +156,7 @@ async def swagger_ui_html(request: Request):
 async def redoc_ui_html(request: Request):
     """Serve raw ReDoc HTML"""
     # Simple implementation to avoid loading issues
-    return templates.TemplateResponse(
+    return get_templates().TemplateResponse(
         "redoc.html", 
         {
             "request": request,
@@ -150,7 +170,7 @@ async def redoc_ui_html(request: Request):
 @app.get("/simple-api", include_in_schema=False)
 async def simple_api_docs(request: Request):
     """Serve a simple, custom API documentation page without ReDoc"""
-    return templates.TemplateResponse(
+    return get_templates().TemplateResponse(
         "simple_api.html", 
         {
             "request": request,
@@ -166,7 +186,7 @@ async def help_page(request: Request):
         help_md_path = Path("docs/help.md")
         if not help_md_path.exists():
             logger.error(f"Help markdown file not found at {help_md_path}")
-            return templates.TemplateResponse(
+            return get_templates().TemplateResponse(
                 "help.html", 
                 {
                     "request": request, 
@@ -175,13 +195,17 @@ async def help_page(request: Request):
                 }
             )
         
+        import markdown
+
         md_content = help_md_path.read_text(encoding="utf-8")
-        html_content = markdown.markdown(
-            md_content, 
+        # Rendering is CPU-bound; keep it off the event loop
+        html_content = await asyncio.to_thread(
+            markdown.markdown,
+            md_content,
             extensions=['fenced_code', 'tables', 'toc']
         )
         
-        return templates.TemplateResponse(
+        return get_templates().TemplateResponse(
             "help.html", 
             {
                 "request": request, 
@@ -191,7 +215,7 @@ async def help_page(request: Request):
         )
     except Exception as e:
         logger.error(f"Error rendering help page: {str(e)}")
-        return templates.TemplateResponse(
+        return get_templates().TemplateResponse(
             "help.html", 
             {
                 "request": request, 
@@ -200,24 +224,59 @@ async def help_page(request: Request):
             }
         )
 
-# Health check endpoint
+# Health check endpoints
 @app.get("/health", include_in_schema=False)
+@app.get("/health/live", include_in_schema=False)
 async def health():
-    """Health check endpoint"""
+    """Liveness: the worker is up and its event loop is responding"""
     return {"status": "ok", "api_version": settings.VERSION}
 
+@app.get("/health/ready", include_in_schema=False)
+async def ready():
+    """
+    Readiness: upstream health, load and memory headroom, from cached state.
+
+    Returns 503 when the worker should not be sent more traffic.
+    """
+    report = readiness()
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
     """Application startup: log the configuration and initialize components"""
     logger.info(f"Starting {settings.PROJECT_NAME} v{settings.VERSION}")
     logger.info(f"Debug mode: {settings.DEBUG}")
-    logger.info(f"OpenAI client status: {'Fallback Mode' if fallback else 'OK'}")
+    _, model, fallback = initialize_openai_client()
+    if fallback:
+        logger.warning("⚠️ Running in fallback mode! OpenAI API client initialization failed.")
     logger.info(f"Active image model: {model}")
+    # Validation calls every account; serve requests meanwhile instead of
+    # holding up boot (accounts are assumed usable until proven otherwise)
+    global validation_task
+    validation_task = asyncio.create_task(_validate_upstream())
+    loop_monitor.start()
+    key_registry.start()
+    usage_ledger.start()
+    request_log.start()
+    result_cache.start()
+    cache_warmer.start()
+
+async def _validate_upstream():
+    await validate_openai_client()
+    logger.info(f"OpenAI client status: {'Fallback Mode' if is_fallback_mode() else 'OK'}")
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
     """Application shutdown: perform cleanup"""
     logger.info(f"Shutting down {settings.PROJECT_NAME}")
-    cleanup_client() 
\ No newline at end of file
+    if validation_task is not None:
+        validation_task.cancel()
+    loop_monitor.stop()
+    await cache_warmer.stop()
+    await result_cache.aclose()
+    await key_registry.stop()
+    await usage_ledger.stop()
+    request_log.stop()
+    await cleanup_client() 
\ No newline at end of file
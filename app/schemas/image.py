@@ -8,6 +8,13 @@ class ImageModels(str, Enum):
     GPT_IMAGE = "gpt-image-1"
     DALLE_3 = "dall-e-3"
     DALLE_2 = "dall-e-2"
+    AUTO = "auto"  # Chosen per request by the model router
+
+
+class ModelTiers(str, Enum):
+    """What the model router optimizes for with model auto"""
+    CHEAP = "cheap"  # Lowest estimated cost
+    FAST = "fast"  # Lowest predicted latency
 
 
 class ImageSizes(str, Enum):
@@ -44,6 +51,7 @@ class ImageGenerationRequest(BaseModel):
     quality: ImageQualities = Field(default=ImageQualities.MEDIUM, description="The quality of the generated image")
     format: ImageFormats = Field(default=ImageFormats.PNG, description="The format to return the image in")
     background: Literal["auto", "transparent"] = Field(default="auto", description="Whether to make the background transparent")
+    tier: Optional[ModelTiers] = Field(default=None, description="With model auto: pick the cheapest (default) or fastest suitable model")
     
     model_config = {
         "json_schema_extra": {
@@ -0,0 +1,281 @@
+"""
+Off-Peak Cache Warming
+
+Traffic is diurnal and the morning burst repeats the same templated prompts
+just when upstream rate limits are tightest. The warmer mines the recent
+request log (including rotated archives) for the most requested results and
+pre-generates the ones missing from the result cache during a daily
+off-peak window, within a spend budget per window.
+
+Warming never competes with live traffic: generations run one at a time in
+the scheduler's background class, and only start while the worker's load
+score is below ``CACHE_WARMING_MAX_LOAD``. In a cluster each node only warms
+the keys it owns. Warmed entries are followed in the local cache, so the
+report shows which of them were actually hit.
+"""
+
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.core.config import settings
+from app.schemas.image import ImageGenerationRequest
+from app.services.deadlines import Deadline
+from app.services.image_service import generate_image
+from app.services.memory_budget import estimate_request_bytes, memory_budget
+from app.services.readiness import load_score
+from app.services.result_cache import ResultCache, cache_key, result_cache
+from app.services.scheduler import PriorityClass, scheduler
+from app.services.usage_ledger import estimate_cost, estimate_request_cost, record_generation
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Usage ledger and scheduler identity of warming generations
+WARMER_KEY_ID = "cache_warmer"
+
+# Stop a run after this many failed generations in a row (e.g. upstream rate limits)
+MAX_CONSECUTIVE_FAILURES = 3
+
+
+def window_start(now: float, start_hour: int, end_hour: int) -> Optional[float]:
+    """
+    Start (Unix time) of the daily UTC window ``[start_hour, end_hour)`` containing ``now``.
+
+    The window may wrap past midnight (e.g. 22 to 4). Returns None outside it.
+    """
+    length = ((end_hour - start_hour) % 24 or 24) * 3600
+    midnight = now - now % 86400
+    for start in (midnight + start_hour * 3600, midnight - 86400 + start_hour * 3600):
+        if start <= now < start + length:
+            return start
+    return None
+
+
+def log_files(path: str) -> List[str]:
+    """The request log and its rotated archives"""
+    base, ext = os.path.splitext(path)
+    return sorted(glob.glob(f"{base}-*{ext}.gz")) + ([path] if os.path.exists(path) else [])
+
+
+def _records(paths: List[str], since: float) -> Iterator[Dict[str, Any]]:
+    for path in paths:
+        if os.path.getmtime(path) < since:
+            # Rotated before the lookback period began
+            continue
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("ts", 0) >= since and record.get("status") == 200 and "request" in record:
+                    yield record
+
+
+def popular_requests(paths: List[str], since: float, limit: int, min_count: int) -> List[Dict[str, Any]]:
+    """
+    Most frequent successful requests in the logs since ``since``.
+
+    Requests are grouped by result cache key, so prompts that differ only
+    in case or punctuation count together.
+
+    Returns:
+        Up to ``limit`` dicts with ``key``, ``request`` and ``count``, most requested first
+    """
+    counts: Counter = Counter()
+    requests: Dict[str, ImageGenerationRequest] = {}
+    for record in _records(paths, since):
+        try:
+            request = ImageGenerationRequest.model_validate(record["request"])
+        except ValueError:
+            continue
+        key = cache_key(request)
+        counts[key] += 1
+        requests.setdefault(key, request)
+    return [
+        {"key": key, "request": requests[key], "count": count}
+        for key, count in counts.most_common(limit)
+        if count >= min_count
+    ]
+
+
+@dataclass
+class WarmedEntry:
+    """A result pre-generated by the warmer"""
+    key: str
+    prompt: str
+    model: str
+    size: str
+    quality: str
+    requests: int  # Times it was requested in the mined logs
+    warmed_at: float
+    cost_usd: float
+
+
+class CacheWarmer:
+    """Pre-generates popular results during the off-peak window"""
+
+    def __init__(self, cache: ResultCache, log_path: str):
+        self.cache = cache
+        self.log_path = log_path
+        self.entries: Dict[str, WarmedEntry] = {}
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._last_window: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _in_window(self, window: Optional[float]) -> bool:
+        if window is None:
+            return True
+        now = time.time()
+        return window_start(now, settings.CACHE_WARMING_START_HOUR_UTC, settings.CACHE_WARMING_END_HOUR_UTC) == window
+
+    async def _wait_for_quiet(self, window: Optional[float]) -> bool:
+        """Wait until live traffic leaves room; False once the window is over"""
+        while load_score() >= settings.CACHE_WARMING_MAX_LOAD:
+            if not self._in_window(window):
+                return False
+            await asyncio.sleep(settings.CACHE_WARMING_POLL_SECONDS)
+        return self._in_window(window)
+
+    async def _warm(self, request: ImageGenerationRequest) -> float:
+        """Generate one result into the cache and return its cost"""
+        reserved_bytes = estimate_request_bytes(request)
+        await memory_budget.acquire(reserved_bytes)
+        try:
+            started = time.perf_counter()
+            async with scheduler.slot(WARMER_KEY_ID, PriorityClass.BACKGROUND, cost=request.n):
+                response = await generate_image(request, Deadline(None))
+        finally:
+            memory_budget.release(reserved_bytes)
+        # Warming spend shows up in the usage ledger under its own key
+        record_generation(f"warm-{cache_key(request)[:16]}", WARMER_KEY_ID, request, response,
+                          (time.perf_counter() - started) * 1000)
+        self.cache.put(request, response)
+        usage = response.usage
+        return estimate_cost(
+            response.model, request.size.value, request.quality.value, len(response.images),
+            usage.prompt_tokens if usage else 0, usage.image_tokens if usage else 0
+        )
+
+    async def run(self, window: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Warm the most requested results that are not cached yet.
+
+        Args:
+            window: Start of the off-peak window to stay within (None: no time limit)
+
+        Returns:
+            Summary of the run
+        """
+        now = time.time()
+        report: Dict[str, Any] = {
+            "started": now, "finished": None, "candidates": 0, "already_cached": 0,
+            "not_owned": 0, "warmed": 0, "failed": 0, "spent_usd": 0.0, "stopped": "done",
+        }
+        self.last_run = report
+        # Entries that have left the cache can no longer be hit
+        for key in [k for k in self.entries if not self.cache.local.contains(k)]:
+            del self.entries[key]
+            self.cache.local.unwatch(key)
+
+        since = now - settings.CACHE_WARMING_LOOKBACK_HOURS * 3600
+        candidates = await asyncio.to_thread(
+            popular_requests, log_files(self.log_path), since,
+            settings.CACHE_WARMING_MAX_ENTRIES, settings.CACHE_WARMING_MIN_REQUESTS,
+        )
+        report["candidates"] = len(candidates)
+        failures = 0
+        for candidate in candidates:
+            key, request = candidate["key"], candidate["request"]
+            if not self.cache.owns(key):
+                report["not_owned"] += 1
+                continue
+            if self.cache.local.contains(key):
+                report["already_cached"] += 1
+                continue
+            if report["spent_usd"] + estimate_request_cost(request) > settings.CACHE_WARMING_BUDGET_USD:
+                report["stopped"] = "budget"
+                break
+            if not await self._wait_for_quiet(window):
+                report["stopped"] = "window closed"
+                break
+            try:
+                cost = await self._warm(request)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Cache warming generation failed: %s", e)
+                report["failed"] += 1
+                failures += 1
+                if failures >= MAX_CONSECUTIVE_FAILURES:
+                    report["stopped"] = "upstream errors"
+                    break
+                continue
+            failures = 0
+            report["warmed"] += 1
+            report["spent_usd"] = round(report["spent_usd"] + cost, 6)
+            self.entries[key] = WarmedEntry(
+                key, request.prompt, request.model.value, request.size.value, request.quality.value,
+                candidate["count"], time.time(), round(cost, 6),
+            )
+            self.cache.local.watch(key)
+
+        report["finished"] = time.time()
+        logger.info(
+            "Cache warming: %d of %d candidates warmed for $%.2f (%s)",
+            report["warmed"], report["candidates"], report["spent_usd"], report["stopped"],
+        )
+        return report
+
+    async def _loop(self) -> None:
+        while True:
+            window = window_start(time.time(), settings.CACHE_WARMING_START_HOUR_UTC, settings.CACHE_WARMING_END_HOUR_UTC)
+            if window is not None and window != self._last_window:
+                self._last_window = window
+                try:
+                    await self.run(window)
+                except Exception as e:
+                    logger.error("Cache warming run failed: %s", e)
+            await asyncio.sleep(settings.CACHE_WARMING_POLL_SECONDS)
+
+    def start(self) -> None:
+        """Start the background scheduler (no-op unless warming and the result cache are enabled)"""
+        if settings.CACHE_WARMING_ENABLED and self.cache.enabled and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def report(self) -> List[Dict[str, Any]]:
+        """Warmed entries still in the cache with their hits, most hit first"""
+        entries = [dict(asdict(entry), hits=self.cache.local.watched.get(key, 0)) for key, entry in self.entries.items()]
+        return sorted(entries, key=lambda e: e["hits"], reverse=True)
+
+    def metrics(self) -> Dict[str, Any]:
+        entries = self.report()
+        return {
+            "enabled": self._task is not None,
+            "last_run": self.last_run,
+            "warmed_entries": len(entries),
+            "entries_hit": sum(1 for e in entries if e["hits"]),
+            "hits": sum(e["hits"] for e in entries),
+            "entries": entries,
+        }
+
+
+cache_warmer = CacheWarmer(result_cache, settings.REQUEST_LOG_PATH)
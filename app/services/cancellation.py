@@ -0,0 +1,90 @@
+"""
+Client Disconnect Cancellation
+
+Runs a request's work alongside a watcher on the ASGI receive channel. When
+the client goes away before the work finishes, the work is cancelled, which
+releases its scheduler slot and aborts the upstream HTTP call, and the
+cancellation is counted along with the upstream work it avoided.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+# Phases a request can be cancelled in
+PHASES = ("queue", "generate", "respond")
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client disconnected before its work finished"""
+
+
+class CancellationStats:
+    """Counts of cancelled requests and the upstream work they avoided"""
+
+    def __init__(self):
+        self.cancelled = {phase: 0 for phase in PHASES}
+        # Generations never sent upstream because the client left while queued
+        self.avoided_images = 0
+        self.avoided_tokens = 0
+        # Upstream calls aborted mid-flight (the provider may still bill these)
+        self.aborted_images = 0
+
+    def record(self, phase: str, images: int, tokens: int) -> None:
+        self.cancelled[phase] += 1
+        if phase == "queue":
+            self.avoided_images += images
+            self.avoided_tokens += tokens
+        elif phase == "generate":
+            self.aborted_images += images
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "cancelled": dict(self.cancelled, total=sum(self.cancelled.values())),
+            "avoided_images": self.avoided_images,
+            "avoided_tokens": self.avoided_tokens,
+            "aborted_images": self.aborted_images,
+        }
+
+
+cancellation_stats = CancellationStats()
+
+
+async def wait_for_disconnect(receive: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+    """Return once the ASGI server reports that the client disconnected"""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(work: Awaitable[T], receive: Callable[[], Awaitable[Dict[str, Any]]]) -> T:
+    """
+    Await ``work``, cancelling it if the client disconnects first.
+
+    The request body must already have been read, so that ``receive`` only
+    yields the disconnect message.
+
+    Raises:
+        ClientDisconnected: If the client went away before ``work`` finished
+    """
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+
+    if task.done():
+        return task.result()
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        # However the work ended, nobody is left to receive it
+        pass
+    raise ClientDisconnected("Client disconnected before the response was ready")
@@ -0,0 +1,117 @@
+"""
+Request Deadlines and Latency Model
+
+Clients can tell the service how long they are willing to wait. The
+remaining budget caps how long a request may queue, bounds the upstream
+call's timeout and is checked again before the response is built. An
+online model of generation latency per (model, size, quality, n) predicts
+how long the upstream call will take, so a request that cannot finish in
+time is rejected up front instead of spending an upstream generation on a
+client that will have given up.
+"""
+
+import math
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.schemas.image import ImageGenerationRequest
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes, or will pass before it can finish"""
+
+
+class Deadline:
+    """A point in (monotonic) time by which a request must be answered"""
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.expires = time.monotonic() + seconds if seconds is not None else None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None when the client set no deadline"""
+        if self.expires is None:
+            return None
+        return self.expires - time.monotonic()
+
+    def budget(self, reserve: float = 0.0) -> Optional[float]:
+        """Seconds that may be spent before ``reserve`` seconds of work must start"""
+        remaining = self.remaining()
+        return None if remaining is None else remaining - reserve
+
+    def expired(self, reserve: float = 0.0) -> bool:
+        budget = self.budget(reserve)
+        return budget is not None and budget <= 0
+
+
+def _latency_key(request: ImageGenerationRequest) -> Tuple[str, str, str, int]:
+    return request.model.value, request.size.value, request.quality.value, request.n
+
+
+class _LatencyStats:
+    __slots__ = ("count", "mean", "variance")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+
+
+class LatencyModel:
+    """
+    Online estimate of upstream generation latency per request shape.
+
+    Keeps an exponentially weighted mean and variance per
+    (model, size, quality, n), and predicts a high quantile of the latency
+    as ``mean + z * stddev``.
+    """
+
+    def __init__(self, alpha: float, z: float, min_samples: int):
+        self.alpha = alpha
+        self.z = z
+        self.min_samples = min_samples
+        self._stats: Dict[Tuple[str, str, str, int], _LatencyStats] = {}
+        self.rejected_early = 0
+        self.expired = 0
+
+    def observe(self, request: ImageGenerationRequest, seconds: float) -> None:
+        """Fold a completed generation's upstream latency into the model"""
+        stats = self._stats.setdefault(_latency_key(request), _LatencyStats())
+        stats.count += 1
+        if stats.count == 1:
+            stats.mean = seconds
+            return
+        # Exponentially weighted mean and variance (West's incremental update)
+        alpha = max(self.alpha, 1.0 / stats.count)
+        delta = seconds - stats.mean
+        stats.mean += alpha * delta
+        stats.variance = (1 - alpha) * (stats.variance + alpha * delta * delta)
+
+    def predict(self, request: ImageGenerationRequest) -> Optional[float]:
+        """Predicted upstream latency in seconds, or None until enough samples exist"""
+        stats = self._stats.get(_latency_key(request))
+        if stats is None or stats.count < self.min_samples:
+            return None
+        return stats.mean + self.z * math.sqrt(stats.variance)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "rejected_early": self.rejected_early,
+            "expired": self.expired,
+            "shapes": [
+                {
+                    "model": model, "size": size, "quality": quality, "n": n,
+                    "samples": stats.count,
+                    "mean_seconds": round(stats.mean, 3),
+                    "predicted_seconds": round(stats.mean + self.z * math.sqrt(stats.variance), 3),
+                }
+                for (model, size, quality, n), stats in sorted(self._stats.items())
+            ],
+        }
+
+
+latency_model = LatencyModel(
+    settings.LATENCY_MODEL_ALPHA,
+    settings.LATENCY_MODEL_Z,
+    settings.LATENCY_MODEL_MIN_SAMPLES,
+)
@@ -0,0 +1,278 @@
+"""
+Generation History
+
+Keeps every completed generation so users can find and reuse images they
+already paid for. Metadata goes to SQLite: a full-text index on prompts,
+secondary indexes on key, model and creation time, and keyset pagination
+(newest first), so a search stays a millisecond query however long the
+history grows. Image bodies are written as files to the image directory,
+never into the database.
+
+Saving happens after the response has been sent, off the event loop.
+"""
+
+import asyncio
+import base64
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.schemas.image import ImageData, ImageGenerationRequest, ImageGenerationResponse
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    id INTEGER PRIMARY KEY,
+    request_id TEXT NOT NULL UNIQUE,
+    key_id TEXT NOT NULL,
+    created REAL NOT NULL,
+    model TEXT NOT NULL,
+    size TEXT NOT NULL,
+    quality TEXT NOT NULL,
+    filetype TEXT NOT NULL,
+    images INTEGER NOT NULL,
+    prompt TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS generations_key_created ON generations (key_id, created, id);
+CREATE INDEX IF NOT EXISTS generations_model_created ON generations (model, created, id);
+CREATE INDEX IF NOT EXISTS generations_created ON generations (created, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(
+    prompt, content='generations', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS generations_fts_insert AFTER INSERT ON generations BEGIN
+    INSERT INTO generations_fts (rowid, prompt) VALUES (new.id, new.prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS generations_fts_delete AFTER DELETE ON generations BEGIN
+    INSERT INTO generations_fts (generations_fts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+END;
+"""
+
+_FIELDS = ["id", "request_id", "key_id", "created", "model", "size", "quality", "filetype", "images", "prompt"]
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+@dataclass
+class HistoryEntry:
+    """A completed generation waiting to be saved"""
+    request_id: str
+    key_id: str
+    created: float
+    model: str
+    size: str
+    quality: str
+    filetype: str
+    prompt: str
+    images: List[ImageData]
+
+
+def encode_cursor(created: float, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created!r}:{row_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        created, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return float(created), int(row_id)
+    except ValueError as e:
+        raise InvalidCursor("Invalid pagination cursor") from e
+
+
+def match_query(text: str) -> str:
+    """
+    Turn free text into an FTS5 query: every word must match, as a prefix.
+
+    Words are quoted so FTS5 operators and punctuation in user input are
+    matched literally instead of raising syntax errors.
+    """
+    terms = [word.replace('"', '""') for word in text.split()]
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+class GenerationHistory:
+    """SQLite-indexed generation history with images on disk"""
+
+    def __init__(self, path: str, image_dir: str, enabled: bool = True):
+        self.path = path
+        self.image_dir = image_dir
+        self.enabled = enabled
+        self._initialized = False
+        self.saved = 0
+        self.save_errors = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._initialized = True
+        return conn
+
+    def image_path(self, request_id: str, index: int, filetype: str) -> str:
+        """Where image ``index`` of a generation is stored"""
+        return os.path.join(self.image_dir, request_id[:2], f"{request_id}-{index}.{filetype}")
+
+    def _save(self, entry: HistoryEntry) -> None:
+        # Files first, so a row never points at images that are not there
+        for index, image in enumerate(entry.images):
+            path = self.image_path(entry.request_id, index, entry.filetype)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(base64.b64decode(image.b64_json))
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    f"INSERT INTO generations ({', '.join(_FIELDS[1:])}) VALUES ({', '.join('?' * (len(_FIELDS) - 1))})",
+                    (entry.request_id, entry.key_id, entry.created, entry.model, entry.size,
+                     entry.quality, entry.filetype, len(entry.images), entry.prompt),
+                )
+        finally:
+            conn.close()
+
+    async def save(self, entry: HistoryEntry) -> None:
+        """Store a generation; failures are logged, never raised"""
+        if not self.enabled:
+            return
+        try:
+            await asyncio.to_thread(self._save, entry)
+            self.saved += 1
+        except Exception as e:
+            self.save_errors += 1
+            logger.error("Saving generation %s to history failed: %s", entry.request_id, e)
+
+    def _search(
+        self,
+        key_id: Optional[str],
+        text: Optional[str],
+        model: Optional[str],
+        since: Optional[float],
+        until: Optional[float],
+        limit: int,
+        cursor: Optional[str],
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        where, params = [], []
+        source = "generations g"
+        if text and text.split():
+            source += " JOIN generations_fts f ON f.rowid = g.id"
+            where.append("generations_fts MATCH ?")
+            params.append(match_query(text))
+        if key_id is not None:
+            where.append("g.key_id = ?")
+            params.append(key_id)
+        if model is not None:
+            where.append("g.model = ?")
+            params.append(model)
+        if since is not None:
+            where.append("g.created >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("g.created < ?")
+            params.append(until)
+        if cursor is not None:
+            # Keyset pagination: continue strictly after the last row returned
+            where.append("(g.created, g.id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        query = (
+            f"SELECT {', '.join('g.' + f for f in _FIELDS)} FROM {source}"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + " ORDER BY g.created DESC, g.id DESC LIMIT ?"
+        )
+        params.append(limit + 1)
+        conn = self._connect()
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+        items = [dict(zip(_FIELDS, row)) for row in rows[:limit]]
+        next_cursor = encode_cursor(items[-1]["created"], items[-1]["id"]) if len(rows) > limit else None
+        return items, next_cursor
+
+    async def search(
+        self,
+        key_id: Optional[str] = None,
+        text: Optional[str] = None,
+        model: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Find generations, newest first.
+
+        Args:
+            key_id: Restrict to one API key
+            text: Words that must all appear in the prompt (prefix match)
+            model: Restrict to one model
+            since: Unix timestamp lower bound
+            until: Unix timestamp upper bound (exclusive)
+            limit: Page size
+            cursor: ``next_cursor`` from the previous page
+
+        Returns:
+            The page of generations and the cursor for the next page (None on the last page)
+
+        Raises:
+            InvalidCursor: If ``cursor`` was not produced by this method
+        """
+        return await asyncio.to_thread(self._search, key_id, text, model, since, until, limit, cursor)
+
+    def _get(self, request_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                f"SELECT {', '.join(_FIELDS)} FROM generations WHERE request_id = ?", (request_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return dict(zip(_FIELDS, row)) if row else None
+
+    async def get(self, request_id: str) -> Optional[Dict[str, Any]]:
+        """A single generation by request id, or None"""
+        return await asyncio.to_thread(self._get, request_id)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "saved": self.saved, "save_errors": self.save_errors}
+
+
+def history_entry(
+    request_id: str,
+    key_id: str,
+    request: ImageGenerationRequest,
+    response: ImageGenerationResponse,
+) -> HistoryEntry:
+    """
+    Capture a generation for the history before its response is sent
+
+    The image list is copied because streaming responses consume it.
+    """
+    return HistoryEntry(
+        request_id=request_id,
+        key_id=key_id,
+        created=float(response.created),
+        model=response.model,
+        size=request.size.value,
+        quality=request.quality.value,
+        filetype=response.images[0].filetype if response.images else request.format.value,
+        prompt=request.prompt,
+        images=list(response.images),
+    )
+
+
+generation_history = GenerationHistory(
+    settings.HISTORY_DB_PATH,
+    settings.HISTORY_IMAGE_DIR,
+    settings.HISTORY_ENABLED,
+)
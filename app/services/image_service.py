@@ -24,6 +24,7 @@ from app.schemas.image import (
     ImageModels
 )
 from app.core.config import settings
+from app.services.deadlines import Deadline
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -32,12 +33,13 @@ logger = logging.getLogger(__name__)
 # The client is initialized in app/utils/openai_client.py which happens during application startup
 
 
-async def generate_image(request: ImageGenerationRequest) -> ImageGenerationResponse:
+async def generate_image(request: ImageGenerationRequest, deadline: Optional[Deadline] = None) -> ImageGenerationResponse:
     """
     Generate images using OpenAI's API based on the request parameters.
     
     Args:
         request: The image generation request with prompt, model, etc.
+        deadline: Optional client deadline; bounds the upstream call's timeout
         
     Returns:
         ImageGenerationResponse containing the generated images
@@ -48,66 +50,69 @@ async def generate_image(request: ImageGenerationRequest) -> ImageGenerationResp
     # Always attempt to reinitialize if needed
     reinitialize_client_if_needed()
     
-    # Get the client (should never be None now)
-    client = get_client()
-    if not client:
+    # Get the upstream account pool (should never be None now)
+    pool = get_client()
+    if not pool:
         logger.error("Critical error: OpenAI client is None even after reinitialization")
         raise Exception("OpenAI client could not be initialized. Check API key and network connection.")
     
     # Log the generation request
-    logger.info(f"Image generation request: model={request.model.value}, prompt={request.prompt[:30]}...")
+    logger.info("Image generation request: model=%s, prompt=%s...", request.model.value, request.prompt[:30])
     
     try:
         # Different API call formats depending on the model
         if request.model.value.startswith("dall-e"):
             # For DALL-E models, use the legacy parameters
-            result = client.images.generate(
+            params = dict(
                 model=request.model.value,
                 prompt=request.prompt,
                 n=request.n,
                 size=request.size.value,
-                quality=request.quality.value if request.model.value == "dall-e-3" else None,
                 response_format="b64_json"  # Always request base64 data for consistent handling
             )
+            if request.model.value == "dall-e-3":
+                params["quality"] = request.quality.value
         else:
             # For GPT Image models, which always return base64 data
             # Note: response_format is not supported for gpt-image-1
-            result = client.images.generate(
+            params = dict(
                 model=request.model.value,
                 prompt=request.prompt,
                 n=request.n,
                 size=request.size.value
             )
+
+        # The pool routes the call to the healthiest upstream account
+        def call(client):
+            remaining = deadline.remaining() if deadline is not None else None
+            if remaining is None:
+                return client.images.generate(**params)
+            return client.images.generate(**params, timeout=max(0.001, min(remaining, settings.UPSTREAM_TIMEOUT_SECONDS)))
+
+        result = await pool.run(call, deadline, request.model.value)
         
         # Process results into our response format
         images = []
         for image in result.data:
-            # For gpt-image-1, we should always have b64_json
-            if request.model.value == ImageModels.GPT_IMAGE.value and hasattr(image, 'b64_json'):
-                images.append(
-                    ImageData(
-                        b64_json=image.b64_json,
-                        filetype=request.format.value,
-                        size=request.size.value
-                    )
-                )
-            # For DALL-E models with b64_json response format
-            elif hasattr(image, 'b64_json') and image.b64_json:
+            b64_json = getattr(image, "b64_json", None)
+            # Upstream data is trusted: model_construct skips re-validating megabyte
+            # strings, so only the payload's type is checked here
+            if isinstance(b64_json, str) and b64_json:
                 images.append(
-                    ImageData(
-                        b64_json=image.b64_json,
+                    ImageData.model_construct(
+                        b64_json=b64_json,
                         filetype=request.format.value,
                         size=request.size.value
                     )
                 )
             # Fallback for URL responses (should not happen with our configuration)
             elif hasattr(image, 'url') and image.url:
-                logger.warning(f"Unexpected URL response for model {request.model.value}")
+                logger.warning("Unexpected URL response for model %s", request.model.value)
                 # We would need to download the image from URL and convert to base64
                 # This branch should not be reached with our current configuration
                 raise Exception(f"URL response format not supported for {request.model.value}")
             else:
-                logger.error(f"Invalid response format from OpenAI API for model {request.model.value}")
+                logger.error("Invalid response format from OpenAI API for model %s", request.model.value)
                 raise Exception("Image data missing from API response")
         
         # Construct usage info if available
@@ -131,11 +136,11 @@ async def generate_image(request: ImageGenerationRequest) -> ImageGenerationResp
                     )
                 except AttributeError:
                     # If any attributes are missing, log and continue without usage info
-                    logger.warning(f"Incomplete usage information in response: {result.usage}")
+                    logger.warning("Incomplete usage information in response: %s", result.usage)
                     usage = None
         
-        # Build the response
-        response = ImageGenerationResponse(
+        # Build the response (fields are already validated above)
+        response = ImageGenerationResponse.model_construct(
             id=result.id if hasattr(result, 'id') else f"img_{int(time.time())}",
             created=int(time.time()),
             images=images,
@@ -143,9 +148,9 @@ async def generate_image(request: ImageGenerationRequest) -> ImageGenerationResp
             usage=usage
         )
         
-        logger.info(f"Successfully generated {len(images)} images")
+        logger.info("Successfully generated %d images", len(images))
         return response
         
     except Exception as e:
-        logger.error(f"Error generating images: {str(e)}")
+        logger.error("Error generating images: %s", e)
         raise 
\ No newline at end of file
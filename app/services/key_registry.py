@@ -0,0 +1,309 @@
+"""
+API Key Registry
+
+This module keeps the set of client API keys used by the service. Keys are
+stored only as hashes, either in a JSON file or a SQLite database, and are
+loaded into an in-memory index so that authenticating a request never
+touches the disk. A background task refreshes the index when the backing
+store changes, so keys can be added or revoked without a restart.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ApiKeyRecord:
+    """A registered client API key and its limits"""
+    key_id: str
+    key_hash: str
+    name: str = ""
+    models: Optional[FrozenSet[str]] = None  # None means every model is allowed
+    requests_per_minute: int = 0
+    image_tokens_per_minute: int = 0
+    priority: str = "interactive"
+    weight: float = 1.0  # Fair-share weight within the priority class
+    admin: bool = False  # May read service-wide data such as other keys' usage
+    near_duplicates: bool = False  # May be served cached results of near-identical prompts
+    revoked: bool = False
+
+    def allows_model(self, model: str) -> bool:
+        """Check whether this key may use the given model"""
+        return self.models is None or model in self.models
+
+
+def hash_api_key(api_key: str) -> str:
+    """
+    Hash an API key for storage and lookup.
+
+    An HMAC with ``API_KEY_HASH_SECRET`` is used when the secret is set,
+    so a leaked key store cannot be checked offline against guessed keys.
+    """
+    if settings.API_KEY_HASH_SECRET:
+        return hmac.new(
+            settings.API_KEY_HASH_SECRET.encode("utf-8"),
+            api_key.encode("utf-8"),
+            hashlib.sha256,
+        ).hexdigest()
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def _int_or_default(value, default: int) -> int:
+    """Parse an optional limit; an explicit 0 means unlimited, only a missing value uses the default"""
+    return default if value is None else int(value)
+
+
+def _record_from_dict(data: dict) -> ApiKeyRecord:
+    """Build a record from a JSON object or SQLite row mapping"""
+    models = data.get("models")
+    if isinstance(models, str):
+        models = json.loads(models) if models else None
+    return ApiKeyRecord(
+        key_id=str(data["id"]),
+        key_hash=str(data["key_hash"]).lower(),
+        name=data.get("name") or "",
+        models=frozenset(models) if models else None,
+        requests_per_minute=_int_or_default(data.get("requests_per_minute"), settings.DEFAULT_REQUESTS_PER_MINUTE),
+        image_tokens_per_minute=_int_or_default(data.get("image_tokens_per_minute"), settings.DEFAULT_IMAGE_TOKENS_PER_MINUTE),
+        priority=data.get("priority") or "interactive",
+        weight=float(data.get("weight") or 1.0),
+        admin=bool(data.get("admin", False)),
+        near_duplicates=bool(data.get("near_duplicates") or False),
+        revoked=bool(data.get("revoked", False)),
+    )
+
+
+def _is_sqlite(path: str) -> bool:
+    return path.endswith((".db", ".sqlite", ".sqlite3"))
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS api_keys (
+    id TEXT PRIMARY KEY,
+    key_hash TEXT NOT NULL UNIQUE,
+    name TEXT,
+    models TEXT,
+    requests_per_minute INTEGER,
+    image_tokens_per_minute INTEGER,
+    priority TEXT,
+    weight REAL,
+    admin INTEGER NOT NULL DEFAULT 0,
+    near_duplicates INTEGER NOT NULL DEFAULT 0,
+    revoked INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+)
+"""
+
+# Columns added after the first release, created on stores that predate them
+_ADDED_COLUMNS = {
+    "near_duplicates": "INTEGER NOT NULL DEFAULT 0",
+}
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=5)
+    conn.row_factory = sqlite3.Row
+    conn.execute(_SCHEMA)
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(api_keys)")}
+    for column, definition in _ADDED_COLUMNS.items():
+        if column not in columns:
+            conn.execute(f"ALTER TABLE api_keys ADD COLUMN {column} {definition}")
+    return conn
+
+
+def load_records(path: str) -> List[ApiKeyRecord]:
+    """Load every key record from a JSON file or SQLite database"""
+    if _is_sqlite(path):
+        with _connect(path) as conn:
+            return [_record_from_dict(dict(row)) for row in conn.execute("SELECT * FROM api_keys")]
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    entries = data.get("keys", []) if isinstance(data, dict) else data
+    return [_record_from_dict(entry) for entry in entries]
+
+
+def store_signature(path: str) -> Tuple:
+    """Return a cheap value that changes whenever the key store changes"""
+    if _is_sqlite(path):
+        with _connect(path) as conn:
+            return tuple(conn.execute("SELECT COUNT(*), COALESCE(MAX(updated_at), 0) FROM api_keys").fetchone())
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def add_key(path: str, key_id: str, api_key: str, **fields) -> ApiKeyRecord:
+    """
+    Add or replace a key in a SQLite key store.
+
+    Args:
+        path: Path to the SQLite database
+        key_id: Stable identifier for the client
+        api_key: The plaintext key handed to the client (only its hash is stored)
+        **fields: Optional name, models, requests_per_minute, image_tokens_per_minute, priority, weight,
+            admin, near_duplicates
+
+    Returns:
+        The stored record
+    """
+    models = fields.get("models")
+    with _connect(path) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO api_keys (id, key_hash, name, models, requests_per_minute, "
+            "image_tokens_per_minute, priority, weight, admin, near_duplicates, revoked, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?)",
+            (
+                key_id,
+                hash_api_key(api_key),
+                fields.get("name"),
+                json.dumps(sorted(models)) if models else None,
+                fields.get("requests_per_minute"),
+                fields.get("image_tokens_per_minute"),
+                fields.get("priority"),
+                fields.get("weight"),
+                bool(fields.get("admin", False)),
+                bool(fields.get("near_duplicates", False)),
+                time.time(),
+            ),
+        )
+        row = conn.execute("SELECT * FROM api_keys WHERE id = ?", (key_id,)).fetchone()
+    return _record_from_dict(dict(row))
+
+
+def revoke_key(path: str, key_id: str) -> bool:
+    """Revoke a key in a SQLite key store. Returns False if the key is unknown."""
+    with _connect(path) as conn:
+        cursor = conn.execute(
+            "UPDATE api_keys SET revoked = 1, updated_at = ? WHERE id = ?",
+            (time.time(), key_id),
+        )
+    return cursor.rowcount > 0
+
+
+class KeyRegistry:
+    """
+    In-memory index of hashed API keys with background refresh.
+
+    Lookups hash the presented key and consult a dict, so the request path
+    does no I/O. The index is swapped atomically on reload.
+    """
+
+    def __init__(self, path: Optional[str] = None, refresh_seconds: float = 30.0):
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self._index: Dict[str, ApiKeyRecord] = {}
+        self._signature: Optional[Tuple] = None
+        self._task: Optional[asyncio.Task] = None
+        self.loaded_at: float = 0.0
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def set_records(self, records: Iterable[ApiKeyRecord]) -> None:
+        """Replace the index with the given records (revoked keys are dropped)"""
+        self._index = {r.key_hash: r for r in records if not r.revoked}
+        self.loaded_at = time.time()
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Reload the index from the backing store if it changed.
+
+        Returns:
+            True if the index was replaced, False otherwise
+        """
+        if not self.path:
+            return False
+        signature = store_signature(self.path)
+        if not force and signature == self._signature:
+            return False
+        self.set_records(load_records(self.path))
+        self._signature = signature
+        logger.info(f"Loaded {len(self._index)} API keys from {self.path}")
+        return True
+
+    def lookup(self, api_key: Optional[str]) -> Optional[ApiKeyRecord]:
+        """Return the active record for a plaintext key, or None"""
+        if not api_key:
+            return None
+        digest = hash_api_key(api_key)
+        record = self._index.get(digest)
+        if record is None or not hmac.compare_digest(record.key_hash, digest):
+            return None
+        return record
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await asyncio.to_thread(self.reload)
+            except Exception as e:
+                # Keep serving the last good index
+                logger.error(f"API key registry refresh failed: {e}")
+
+    def start(self) -> None:
+        """Start the background refresh task (no-op without a backing store)"""
+        if self.path and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        """Stop the background refresh task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def create_registry() -> KeyRegistry:
+    """Build the registry from settings, falling back to the single ``API_KEY``"""
+    registry = KeyRegistry(settings.API_KEYS_FILE, settings.API_KEYS_REFRESH_SECONDS)
+    if settings.API_KEYS_FILE:
+        try:
+            registry.reload(force=True)
+        except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+            # Fail closed: an empty index rejects every key until the store is fixed
+            logger.error(f"Could not load API keys from {settings.API_KEYS_FILE}: {e}")
+    elif settings.API_KEY:
+        registry.set_records([
+            ApiKeyRecord(
+                key_id="default",
+                key_hash=hash_api_key(settings.API_KEY),
+                admin=True,
+                near_duplicates=settings.NEAR_DUPLICATE_ENABLED,
+                requests_per_minute=settings.DEFAULT_REQUESTS_PER_MINUTE,
+                image_tokens_per_minute=settings.DEFAULT_IMAGE_TOKENS_PER_MINUTE,
+            )
+        ])
+    return registry
+
+
+# Anonymous record used when API key security is disabled. It is never an
+# admin: admin endpoints need a configured key.
+ANONYMOUS_KEY = ApiKeyRecord(
+    key_id="no_key_required",
+    key_hash="",
+    near_duplicates=settings.NEAR_DUPLICATE_ENABLED,
+    requests_per_minute=settings.DEFAULT_REQUESTS_PER_MINUTE,
+    image_tokens_per_minute=settings.DEFAULT_IMAGE_TOKENS_PER_MINUTE,
+)
+
+key_registry = create_registry()
+
+
+def is_auth_enabled() -> bool:
+    """Check whether requests must present an API key"""
+    return bool(settings.API_KEYS_FILE or settings.API_KEY)
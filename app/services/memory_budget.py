@@ -0,0 +1,148 @@
+"""
+Memory Admission Control
+
+Large generations pin a lot of memory in a worker: the upstream response
+body, the decoded base64 strings and the encoded response all coexist for
+a while. This module estimates each request's peak footprint from its image
+count and size, keeps a per-worker total of the bytes held by in-flight
+requests, and makes requests that would exceed the budget wait (first come,
+first served) or give up after a short while, instead of risking the
+worker being OOM-killed along with every other request it is serving.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from app.core.config import settings
+from app.schemas.image import ImageGenerationRequest
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Encoded PNG bytes per pixel for generated images (conservative)
+PNG_BYTES_PER_PIXEL = 1.5
+# Base64 expands every 3 bytes to 4 characters
+BASE64_RATIO = 4 / 3
+# Copies of the base64 payload alive at the peak: upstream body, parsed string
+# and the encoded response
+PAYLOAD_COPIES = 3
+# Pixels per image; "auto" may pick the largest size
+SIZE_PIXELS = {
+    "256x256": 256 * 256,
+    "512x512": 512 * 512,
+    "1024x1024": 1024 * 1024,
+    "1024x1536": 1024 * 1536,
+    "1536x1024": 1536 * 1024,
+    "auto": 1536 * 1024,
+}
+
+
+def estimate_request_bytes(request: ImageGenerationRequest) -> int:
+    """
+    Estimate the peak memory a generation request holds in this worker.
+
+    Upstream always returns PNG data (``format`` only labels the response),
+    so every format is estimated as PNG.
+    """
+    pixels = SIZE_PIXELS.get(request.size.value, SIZE_PIXELS["auto"])
+    payload = pixels * PNG_BYTES_PER_PIXEL * BASE64_RATIO
+    return int(request.n * payload * PAYLOAD_COPIES)
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when a request cannot be admitted within the wait limit"""
+
+
+class MemoryBudget:
+    """FIFO admission of requests against a per-worker memory budget"""
+
+    def __init__(self, budget_bytes: int, wait_seconds: float):
+        self.budget_bytes = budget_bytes
+        self.wait_seconds = wait_seconds
+        self.in_flight_bytes = 0
+        self.in_flight = 0
+        self.peak_bytes = 0
+        self._waiters: Deque[List[Any]] = deque()  # [bytes, future]
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _fits(self, size: int) -> bool:
+        # A request larger than the whole budget still runs, but only on its own
+        return self.budget_bytes <= 0 or self.in_flight == 0 or self.in_flight_bytes + size <= self.budget_bytes
+
+    def _take(self, size: int) -> None:
+        self.in_flight_bytes += size
+        self.in_flight += 1
+        self.admitted += 1
+        self.peak_bytes = max(self.peak_bytes, self.in_flight_bytes)
+
+    def _wake(self) -> None:
+        while self._waiters and self._fits(self._waiters[0][0]):
+            size, future = self._waiters.popleft()
+            if not future.done():
+                self._take(size)
+                future.set_result(None)
+
+    async def acquire(self, size: int, max_wait: Optional[float] = None) -> None:
+        """
+        Reserve ``size`` bytes, waiting for earlier requests to release theirs.
+
+        Args:
+            size: Estimated bytes to reserve
+            max_wait: Give up sooner than ``wait_seconds`` (e.g. for a client deadline)
+
+        Raises:
+            MemoryBudgetExceeded: If the bytes are not available in time
+        """
+        if not self._waiters and self._fits(size):
+            self._take(size)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [size, future]
+        self._waiters.append(entry)
+        self.queued += 1
+        try:
+            timeout = self.wait_seconds if max_wait is None else max(0.0, min(self.wait_seconds, max_wait))
+            await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done():
+                # Admitted at the same moment we gave up: hand the bytes back
+                self.release(size)
+            else:
+                future.cancel()
+                self._waiters.remove(entry)
+                # The head of the queue may have been what blocked the others
+                self._wake()
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise MemoryBudgetExceeded("Worker memory budget exhausted, try again shortly")
+            raise
+
+    def release(self, size: int) -> None:
+        """Return reserved bytes and admit waiting requests that now fit"""
+        self.in_flight_bytes -= size
+        self.in_flight -= 1
+        self._wake()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "budget_bytes": self.budget_bytes,
+            "in_flight_bytes": self.in_flight_bytes,
+            "in_flight": self.in_flight,
+            "peak_bytes": self.peak_bytes,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+        }
+
+
+memory_budget = MemoryBudget(settings.MEMORY_BUDGET_BYTES, settings.MEMORY_ADMISSION_WAIT_SECONDS)
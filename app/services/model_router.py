@@ -0,0 +1,230 @@
+"""
+Automatic Model Selection
+
+Requests with ``model: auto`` are routed to a concrete model before they
+are admitted. Latency and cost differ by an order of magnitude across
+models, sizes and qualities, so the router considers every (model, size)
+combination that can serve the request (its size unless that is ``auto``,
+``n``, background and quality, and the key's model allowlist) and picks the
+cheapest (tier ``cheap``, the default) or the fastest (tier ``fast``).
+
+Latency comes from the deadline latency model, which is measured
+continuously per request shape, with fixed priors until it has enough
+samples. When the client sets a deadline, combinations predicted to miss it
+are avoided. Every generation's outcome feeds a per-model error rate: a
+model that is rate limited, or whose error rate crosses
+``ROUTER_MAX_ERROR_RATE``, is skipped for ``ROUTER_COOLDOWN_SECONDS``, and
+a routed request whose model fails is retried once on the next candidate.
+"""
+
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.schemas.image import ImageGenerationRequest, ImageModels, ImageQualities, ImageSizes, ModelTiers
+from app.services.deadlines import latency_model
+from app.services.key_registry import ApiKeyRecord
+from app.services.upstream_pool import NoUpstreamAvailable
+from app.services.usage_ledger import estimate_request_cost
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Sizes each model can generate
+MODEL_SIZES = {
+    ImageModels.GPT_IMAGE: (ImageSizes.LARGE, ImageSizes.PORTRAIT, ImageSizes.LANDSCAPE, ImageSizes.AUTO),
+    ImageModels.DALLE_3: (ImageSizes.LARGE, ImageSizes.PORTRAIT, ImageSizes.LANDSCAPE),
+    ImageModels.DALLE_2: (ImageSizes.SMALL, ImageSizes.MEDIUM, ImageSizes.LARGE),
+}
+
+# Most images per request each model accepts
+MODEL_MAX_N = {ImageModels.DALLE_3: 1}
+
+# Latency assumed (seconds) until the latency model has measured a shape
+PRIOR_LATENCY_SECONDS = {
+    ImageModels.GPT_IMAGE: 40.0,
+    ImageModels.DALLE_3: 15.0,
+    ImageModels.DALLE_2: 8.0,
+}
+
+
+class NoEligibleModel(Exception):
+    """Raised when no model can serve an auto request"""
+
+    def __init__(self, detail: str, forbidden: bool = False):
+        super().__init__(detail)
+        # True when models exist but the key may not use them
+        self.forbidden = forbidden
+
+
+def _quality(model: ImageModels, requested: ImageQualities) -> Optional[ImageQualities]:
+    """The model's quality setting for a requested quality, or None if it has no match"""
+    if requested == ImageQualities.HD:
+        return ImageQualities.HD if model == ImageModels.DALLE_3 else None
+    return ImageQualities.MEDIUM if model == ImageModels.GPT_IMAGE else ImageQualities.STANDARD
+
+
+def _is_throttled(error: BaseException) -> bool:
+    """Rate limited, or every upstream account is (for this model)"""
+    return getattr(error, "status_code", None) == 429 or isinstance(error, NoUpstreamAvailable)
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Whether an error says something about the model (rate limits and server errors)"""
+    status = getattr(error, "status_code", None)
+    return _is_throttled(error) or (isinstance(status, int) and status >= 500)
+
+
+class _ModelHealth:
+    __slots__ = ("requests", "errors", "error_rate", "cooldown_until", "throttled")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.error_rate = 0.0
+        self.cooldown_until = 0.0
+        self.throttled = 0
+
+
+class ModelRouter:
+    """Picks a concrete model for auto requests from measured latency, cost and health"""
+
+    def __init__(self, error_alpha: float, max_error_rate: float, min_requests: int, cooldown_seconds: float):
+        self.error_alpha = error_alpha
+        self.max_error_rate = max_error_rate
+        self.min_requests = min_requests
+        self.cooldown_seconds = cooldown_seconds
+        self._health: Dict[str, _ModelHealth] = {}
+        self.routed: Dict[str, int] = {}
+        self.fallbacks = 0
+
+    def _state(self, model: str) -> _ModelHealth:
+        return self._health.setdefault(model, _ModelHealth())
+
+    def record(self, model: str, error: Optional[BaseException] = None) -> None:
+        """Fold a generation's outcome into the model's error rate"""
+        state = self._state(model)
+        state.requests += 1
+        failed = error is not None
+        state.errors += failed
+        alpha = max(self.error_alpha, 1.0 / state.requests)
+        state.error_rate += alpha * (failed - state.error_rate)
+        if not failed:
+            return
+        throttled = _is_throttled(error)
+        state.throttled += throttled
+        if throttled or (state.requests >= self.min_requests and state.error_rate >= self.max_error_rate):
+            state.cooldown_until = time.monotonic() + self.cooldown_seconds
+            logger.warning(
+                "Model %s %s; routing around it for %.0fs",
+                model, "is rate limited" if throttled else f"error rate is {state.error_rate:.0%}", self.cooldown_seconds
+            )
+
+    def is_healthy(self, model: str) -> bool:
+        state = self._health.get(model)
+        return state is None or time.monotonic() >= state.cooldown_until
+
+    def candidates(
+        self, request: ImageGenerationRequest, api_key: ApiKeyRecord, deadline_seconds: Optional[float] = None
+    ) -> List[Tuple[ImageGenerationRequest, float, float]]:
+        """
+        Concrete requests that can serve ``request``, best first.
+
+        Healthy models come before ones in cooldown, and combinations
+        predicted to meet the deadline before ones that would miss it.
+
+        Returns:
+            (concrete request, estimated cost in USD, predicted latency in seconds) tuples
+
+        Raises:
+            NoEligibleModel: If no model (or none the key may use) can serve the request
+        """
+        tier = request.tier or ModelTiers.CHEAP
+        supported, allowed = [], []
+        for model, sizes in MODEL_SIZES.items():
+            quality = _quality(model, request.quality)
+            if quality is None or request.n > MODEL_MAX_N.get(model, 10):
+                continue
+            if request.background == "transparent" and model != ImageModels.GPT_IMAGE:
+                continue
+            for size in sizes if request.size == ImageSizes.AUTO else (request.size,):
+                if size not in sizes:
+                    continue
+                concrete = request.model_copy(update={"model": model, "size": size, "quality": quality, "tier": tier})
+                supported.append(concrete)
+                if api_key.allows_model(model.value):
+                    allowed.append(concrete)
+        if not supported:
+            raise NoEligibleModel("No model supports this combination of size, quality, n and background")
+        if not allowed:
+            raise NoEligibleModel("API key is not allowed to use any model that supports this request", forbidden=True)
+
+        ranked = []
+        for concrete in allowed:
+            cost = estimate_request_cost(concrete)
+            latency = latency_model.predict(concrete) or PRIOR_LATENCY_SECONDS[concrete.model]
+            misses_deadline = deadline_seconds is not None and latency > deadline_seconds
+            primary, secondary = (cost, latency) if tier == ModelTiers.CHEAP else (latency, cost)
+            rank = (not self.is_healthy(concrete.model.value), misses_deadline, primary, secondary)
+            ranked.append((rank, concrete, cost, latency))
+        ranked.sort(key=lambda item: item[0])
+        return [(concrete, cost, latency) for _, concrete, cost, latency in ranked]
+
+    def route(
+        self, request: ImageGenerationRequest, api_key: ApiKeyRecord, deadline_seconds: Optional[float] = None
+    ) -> ImageGenerationRequest:
+        """
+        Resolve an auto request to the best concrete request.
+
+        The result keeps ``tier`` set, which marks it as routed.
+        """
+        concrete = self.candidates(request, api_key, deadline_seconds)[0][0]
+        self.routed[concrete.model.value] = self.routed.get(concrete.model.value, 0) + 1
+        return concrete
+
+    def fallback(
+        self,
+        request: ImageGenerationRequest,
+        tried: Sequence[str],
+        api_key: ApiKeyRecord,
+        deadline_seconds: Optional[float] = None,
+    ) -> Optional[ImageGenerationRequest]:
+        """The best routed alternative on a model not yet tried, or None"""
+        try:
+            candidates = self.candidates(request, api_key, deadline_seconds)
+        except NoEligibleModel:
+            return None
+        for concrete, _, latency in candidates:
+            if concrete.model.value in tried or not self.is_healthy(concrete.model.value):
+                continue
+            if deadline_seconds is not None and latency > deadline_seconds:
+                continue
+            self.fallbacks += 1
+            return concrete
+        return None
+
+    def metrics(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "routed": dict(self.routed),
+            "fallbacks": self.fallbacks,
+            "models": {
+                model: {
+                    "requests": state.requests,
+                    "errors": state.errors,
+                    "throttled": state.throttled,
+                    "error_rate": round(state.error_rate, 3),
+                    "cooldown_seconds": max(0.0, round(state.cooldown_until - now, 1)),
+                }
+                for model, state in sorted(self._health.items())
+            },
+        }
+
+
+model_router = ModelRouter(
+    settings.ROUTER_ERROR_ALPHA,
+    settings.ROUTER_MAX_ERROR_RATE,
+    settings.ROUTER_MIN_REQUESTS,
+    settings.ROUTER_COOLDOWN_SECONDS,
+)
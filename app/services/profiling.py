@@ -0,0 +1,185 @@
+"""
+Event-Loop Lag Monitor and Sampling Profiler
+
+Blocking work on the event loop (a synchronous SDK call, CPU-heavy
+rendering) stalls every request the worker is serving. The lag monitor runs
+a heartbeat task on the loop and a watchdog thread beside it; when the
+heartbeat is late by more than the threshold, the watchdog captures the
+loop thread's stack while it is still blocked, so the culprit shows up
+along with the lag it caused.
+
+The sampling profiler captures thread stacks at a fixed interval for a
+bounded time and returns them in the collapsed-stack format understood by
+flamegraph.pl, speedscope and similar tools. It only runs on request: when
+idle it has no thread and no hooks installed.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from types import FrameType
+from typing import Any, Deque, Dict, List, Optional
+
+from app.core.config import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Frames kept per recorded stack (innermost frames are kept)
+MAX_STACK_DEPTH = 64
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    # Label by the function's first line so samples in one function aggregate
+    return f"{code.co_name} ({os.path.relpath(code.co_filename)}:{code.co_firstlineno})"
+
+
+def stack_labels(frame: Optional[FrameType]) -> List[str]:
+    """Labels for ``frame`` and its callers, outermost first"""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class LoopLagMonitor:
+    """Detects event-loop stalls and records the stack that caused them"""
+
+    def __init__(self, interval: float, threshold: float, keep: int):
+        self.interval = interval
+        self.threshold = threshold
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=keep)
+        self.ticks = 0
+        self.slow = 0
+        self.max_lag = 0.0
+        self._last_tick = 0.0
+        self._stall_stack: Optional[List[str]] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """Start monitoring the running event loop"""
+        if self.interval <= 0 or self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-lag-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = now - self._last_tick - self.interval
+            self._last_tick = now
+            self.ticks += 1
+            self.max_lag = max(self.max_lag, lag)
+            stack, self._stall_stack = self._stall_stack, None
+            if lag >= self.threshold:
+                self.slow += 1
+                self.events.append({
+                    "at": round(time.time(), 3),
+                    "lag_ms": round(lag * 1000, 1),
+                    "stack": stack or [],
+                })
+                logger.warning(
+                    "Event loop blocked for %.0f ms in %s",
+                    lag * 1000, stack[-1] if stack else "unknown code",
+                )
+
+    def _watch(self) -> None:
+        captured_for = None
+        while not self._stop.wait(self.interval):
+            tick = self._last_tick
+            if tick != captured_for and time.monotonic() - tick >= self.interval + self.threshold:
+                # The loop is still blocked: its current stack is the culprit
+                captured_for = tick
+                self._stall_stack = stack_labels(sys._current_frames().get(self._loop_thread))
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "ticks": self.ticks,
+            "slow": self.slow,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "recent": list(self.events),
+        }
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+class SamplingProfiler:
+    """On-demand, time-boxed wall-clock sampling of thread stacks"""
+
+    def __init__(self):
+        self.running = False
+
+    async def profile(self, seconds: float, interval: float, all_threads: bool = False) -> str:
+        """
+        Sample stacks for ``seconds`` and return them as collapsed stacks.
+
+        Args:
+            seconds: How long to sample
+            interval: Seconds between samples
+            all_threads: Sample every thread instead of only the event loop's
+
+        Returns:
+            One ``frame;frame;... count`` line per distinct stack
+
+        Raises:
+            ProfilerBusy: If a profile is already running in this worker
+        """
+        if self.running:
+            raise ProfilerBusy("A profile is already running in this worker")
+        self.running = True
+        try:
+            only = None if all_threads else threading.get_ident()
+            counts = await asyncio.to_thread(self._sample, seconds, interval, only)
+        finally:
+            self.running = False
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+    @staticmethod
+    def _sample(seconds: float, interval: float, only: Optional[int]) -> Counter:
+        me = threading.get_ident()
+        counts: Counter = Counter()
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (only is not None and ident != only):
+                    continue
+                thread = names.get(ident, f"thread-{ident}")
+                counts[";".join([thread] + stack_labels(frame))] += 1
+            time.sleep(interval)
+        return counts
+
+
+loop_monitor = LoopLagMonitor(
+    settings.LOOP_LAG_INTERVAL_SECONDS,
+    settings.LOOP_LAG_THRESHOLD_SECONDS,
+    settings.LOOP_LAG_EVENTS_KEPT,
+)
+sampling_profiler = SamplingProfiler()
@@ -0,0 +1,150 @@
+"""
+Prompt Canonicalization and Near-Duplicate Index
+
+Prompts that differ only in case, whitespace or punctuation are reduced to
+one canonical form, so they share a result cache key. Prompts that differ a
+little more, for example in word order or one extra word, are found by a
+MinHash index over their word sets: signatures are split into bands and
+prompts that agree on any band are candidates, which are then checked
+against the exact Jaccard similarity of their words.
+
+The index keeps a bounded number of recent prompts (least recently used
+ones are dropped) and a lookup hashes a handful of words and probes a few
+dict buckets, so it stays well under a millisecond.
+"""
+
+import hashlib
+import re
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Optional, Set, Tuple
+
+# Anything that is not a word character or whitespace
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+
+
+def canonical_prompt(prompt: str) -> str:
+    """
+    Reduce a prompt to the form used for cache keys.
+
+    Unicode compatibility forms are unified, case is folded, punctuation is
+    dropped and whitespace is collapsed. Prompts made only of punctuation
+    keep it, so they do not all share one key.
+    """
+    text = unicodedata.normalize("NFKC", prompt).casefold()
+    words = _PUNCTUATION.sub(" ", text).split()
+    return " ".join(words) if words else " ".join(text.split())
+
+
+def prompt_words(prompt: str) -> FrozenSet[str]:
+    """The set of words of a prompt's canonical form"""
+    return frozenset(canonical_prompt(prompt).split())
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """Similarity of two word sets: shared words over all words"""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _word_hashes(word: str, count: int) -> array:
+    """``count`` independent 32-bit hashes of a word, from one extendable-output digest"""
+    return array("I", hashlib.shake_128(word.encode()).digest(4 * count))
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index from recent prompts to their result cache keys.
+
+    Prompts only match within the same scope (the rest of the request:
+    model, size, quality, ...). With ``bands`` bands of ``rows`` rows, pairs
+    of similarity s become candidates with probability 1 - (1 - s**rows)**bands:
+    about 95% at similarity 0.8 but only 6% at 0.5, which keeps the number of
+    candidates to check small even among prompts filled in from one template.
+    """
+
+    def __init__(self, max_entries: int, threshold: float, bands: int = 16, rows: int = 8):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self._entries: "OrderedDict[str, Tuple[str, FrozenSet[str], Tuple[int, ...]]]" = OrderedDict()
+        self._buckets: Dict[int, Set[str]] = {}
+        self.lookups = 0
+        self.matches = 0
+
+    def _band_keys(self, scope: str, words: FrozenSet[str]) -> Tuple[int, ...]:
+        signature = list(map(min, zip(*(_word_hashes(word, self.bands * self.rows) for word in words))))
+        # Only a hash of each band is kept; rare collisions are filtered out by the exact check
+        return tuple(
+            hash((scope, band, tuple(signature[band * self.rows:(band + 1) * self.rows])))
+            for band in range(self.bands)
+        )
+
+    def add(self, scope: str, prompt: str, key: str) -> None:
+        """Remember that ``key`` holds the result for ``prompt`` in ``scope``"""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        words = prompt_words(prompt)
+        if not words or self.max_entries <= 0:
+            return
+        band_keys = self._band_keys(scope, words)
+        self._entries[key] = (scope, words, band_keys)
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def discard(self, key: str) -> None:
+        """Forget a key, e.g. because its result is no longer cached"""
+        if key in self._entries:
+            self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        _, _, band_keys = self._entries.pop(key)
+        for band_key in band_keys:
+            bucket = self._buckets[band_key]
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[band_key]
+
+    def find(self, scope: str, prompt: str) -> Optional[Tuple[str, float]]:
+        """
+        Find the most similar indexed prompt in ``scope``.
+
+        Returns:
+            (cache key, similarity) of the best match at or above the threshold, or None
+        """
+        self.lookups += 1
+        words = prompt_words(prompt)
+        if not words:
+            return None
+        candidates: Set[str] = set()
+        for band_key in self._band_keys(scope, words):
+            candidates.update(self._buckets.get(band_key, ()))
+        best: Optional[Tuple[str, float]] = None
+        for key in candidates:
+            entry_scope, entry_words, _ = self._entries[key]
+            if entry_scope != scope:
+                continue
+            similarity = jaccard(words, entry_words)
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (key, similarity)
+        if best is not None:
+            self.matches += 1
+            self._entries.move_to_end(best[0])
+        return best
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "entries": len(self._entries),
+            "buckets": len(self._buckets),
+            "lookups": self.lookups,
+            "matches": self.matches,
+        }
@@ -0,0 +1,265 @@
+"""
+Per-API-key rate limiting
+
+Each key gets two token buckets: one for requests per minute and one for
+image tokens per minute. Buckets refill continuously and are checked in
+O(1) on the request path. Two backends are provided: an in-process one for
+single-worker deployments and a SQLite-backed one whose state is shared by
+every worker process on the host.
+"""
+
+import asyncio
+import math
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+from app.core.config import settings
+from app.schemas.image import ImageGenerationRequest
+
+# Approximate gpt-image-1 output tokens per image (medium quality)
+GPT_IMAGE_TOKENS_PER_IMAGE = {
+    "1024x1024": 1056,
+    "1024x1536": 1584,
+    "1536x1024": 1568,
+    "auto": 1584,
+}
+
+
+def estimate_image_tokens(request: ImageGenerationRequest) -> int:
+    """
+    Estimate the tokens a generation request will consume.
+
+    DALL-E models are not billed in tokens, so only the prompt is counted.
+    """
+    prompt_tokens = len(request.prompt) // 4 + 1
+    if not request.model.value.startswith("gpt-image"):
+        return prompt_tokens
+    return prompt_tokens + request.n * GPT_IMAGE_TOKENS_PER_IMAGE.get(request.size.value, 1584)
+
+
+@dataclass
+class RateLimitResult:
+    """Outcome of a rate limit check, expressed for the request bucket"""
+    allowed: bool
+    limit: int
+    remaining: int
+    reset: int
+    retry_after: int = 0
+
+    def headers(self) -> Dict[str, str]:
+        """Standard ``RateLimit-*`` (and ``Retry-After`` when denied) headers"""
+        headers = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(self.reset),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+def _refill(tokens: float, updated: float, capacity: int, now: float) -> float:
+    """Refill a bucket whose capacity is replenished once per minute"""
+    return min(capacity, tokens + (now - updated) * capacity / 60.0)
+
+
+def _evaluate(
+    buckets: List[Tuple[float, int, int]],
+) -> Tuple[bool, float]:
+    """
+    Decide whether every bucket can pay its cost.
+
+    Args:
+        buckets: (available tokens, capacity, cost) per bucket
+
+    Returns:
+        (allowed, seconds until the most constrained bucket can pay)
+    """
+    wait = 0.0
+    for tokens, capacity, cost in buckets:
+        if capacity <= 0:
+            continue  # Unlimited
+        cost = min(cost, capacity)
+        if tokens < cost:
+            wait = max(wait, (cost - tokens) * 60.0 / capacity)
+    return wait == 0.0, wait
+
+
+def _result(allowed: bool, wait: float, tokens: float, capacity: int) -> RateLimitResult:
+    # The token bucket can deny a request even when the request bucket is unlimited
+    retry_after = math.ceil(wait) if not allowed else 0
+    if capacity <= 0:
+        return RateLimitResult(allowed, 0, 0, 0, retry_after)
+    remaining = max(0, int(tokens))
+    reset = math.ceil((capacity - tokens) * 60.0 / capacity) if tokens < capacity else 0
+    return RateLimitResult(allowed, capacity, remaining, reset, retry_after)
+
+
+class InMemoryRateLimiter:
+    """Token buckets held in this process"""
+
+    # Checks only take an in-process lock and can run on the event loop
+    blocking = False
+
+    def __init__(self):
+        # bucket key -> [tokens, updated]
+        self._buckets: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, name: str, capacity: int, now: float) -> List[float]:
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            bucket = self._buckets[name] = [float(capacity), now]
+        else:
+            bucket[0] = _refill(bucket[0], bucket[1], capacity, now)
+            bucket[1] = now
+        return bucket
+
+    def check(self, key_id: str, requests_per_minute: int, tokens_per_minute: int, cost_tokens: int) -> RateLimitResult:
+        """Consume one request and ``cost_tokens`` image tokens if both buckets allow it"""
+        now = time.monotonic()
+        with self._lock:
+            req = self._bucket(f"{key_id}:req", requests_per_minute, now)
+            tok = self._bucket(f"{key_id}:tok", tokens_per_minute, now)
+            allowed, wait = _evaluate([
+                (req[0], requests_per_minute, 1),
+                (tok[0], tokens_per_minute, cost_tokens),
+            ])
+            if allowed:
+                if requests_per_minute > 0:
+                    req[0] -= 1
+                if tokens_per_minute > 0:
+                    tok[0] -= min(cost_tokens, tokens_per_minute)
+            return _result(allowed, wait, req[0], requests_per_minute)
+
+    def adjust(self, key_id: str, tokens_per_minute: int, delta_tokens: int) -> None:
+        """Charge (or refund) the difference between estimated and actual token usage"""
+        if tokens_per_minute <= 0 or not delta_tokens:
+            return
+        with self._lock:
+            tok = self._bucket(f"{key_id}:tok", tokens_per_minute, time.monotonic())
+            tok[0] = max(-tokens_per_minute, min(tokens_per_minute, tok[0] - delta_tokens))
+
+
+class SQLiteRateLimiter:
+    """
+    Token buckets stored in a SQLite database shared by all worker processes.
+
+    Each check is a single short ``BEGIN IMMEDIATE`` transaction touching
+    two rows by primary key. Because that transaction can wait on other
+    processes' locks, callers run it in a worker thread.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def _load(self, name: str, capacity: int, now: float) -> float:
+        row = self._conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return float(capacity)
+        return _refill(row[0], row[1], capacity, now)
+
+    def _store(self, name: str, tokens: float, now: float) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+            (name, tokens, now),
+        )
+
+    def check(self, key_id: str, requests_per_minute: int, tokens_per_minute: int, cost_tokens: int) -> RateLimitResult:
+        """Consume one request and ``cost_tokens`` image tokens if both buckets allow it"""
+        # Wall-clock time: monotonic clocks are not comparable across processes
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                req = self._load(f"{key_id}:req", requests_per_minute, now)
+                tok = self._load(f"{key_id}:tok", tokens_per_minute, now)
+                allowed, wait = _evaluate([
+                    (req, requests_per_minute, 1),
+                    (tok, tokens_per_minute, cost_tokens),
+                ])
+                if allowed:
+                    if requests_per_minute > 0:
+                        req -= 1
+                    if tokens_per_minute > 0:
+                        tok -= min(cost_tokens, tokens_per_minute)
+                self._store(f"{key_id}:req", req, now)
+                self._store(f"{key_id}:tok", tok, now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return _result(allowed, wait, req, requests_per_minute)
+
+    def adjust(self, key_id: str, tokens_per_minute: int, delta_tokens: int) -> None:
+        """Charge (or refund) the difference between estimated and actual token usage"""
+        if tokens_per_minute <= 0 or not delta_tokens:
+            return
+        now = time.time()
+        name = f"{key_id}:tok"
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                tok = self._load(name, tokens_per_minute, now)
+                tok = max(-tokens_per_minute, min(tokens_per_minute, tok - delta_tokens))
+                self._store(name, tok, now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+def create_rate_limiter() -> Optional[Union[InMemoryRateLimiter, SQLiteRateLimiter]]:
+    """Build the configured rate limiter, or None when rate limiting is disabled"""
+    if not settings.RATE_LIMIT_ENABLED:
+        return None
+    if settings.RATE_LIMIT_BACKEND == "sqlite":
+        return SQLiteRateLimiter(settings.RATE_LIMIT_STORE_PATH)
+    return InMemoryRateLimiter()
+
+
+rate_limiter = create_rate_limiter()
+
+
+async def check_rate_limit(
+    key_id: str,
+    requests_per_minute: int,
+    tokens_per_minute: int,
+    cost_tokens: int,
+) -> Optional[RateLimitResult]:
+    """
+    Run a rate limit check without blocking the event loop.
+
+    Returns:
+        The check result, or None when rate limiting is disabled
+    """
+    if rate_limiter is None:
+        return None
+    if rate_limiter.blocking:
+        return await asyncio.to_thread(rate_limiter.check, key_id, requests_per_minute, tokens_per_minute, cost_tokens)
+    return rate_limiter.check(key_id, requests_per_minute, tokens_per_minute, cost_tokens)
+
+
+async def adjust_rate_limit(key_id: str, tokens_per_minute: int, delta_tokens: int) -> None:
+    """Settle a key's token bucket without blocking the event loop"""
+    if rate_limiter is None:
+        return
+    if rate_limiter.blocking:
+        await asyncio.to_thread(rate_limiter.adjust, key_id, tokens_per_minute, delta_tokens)
+    else:
+        rate_limiter.adjust(key_id, tokens_per_minute, delta_tokens)
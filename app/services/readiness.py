@@ -0,0 +1,67 @@
+"""
+Worker Readiness and Load Score
+
+Liveness only says the event loop is answering. Readiness says whether this
+worker should be sent more traffic: it needs at least one usable upstream
+account and spare capacity. Everything here reads state the worker already
+keeps (the pool's cached account health, scheduler and memory counters),
+so a probe costs no network call.
+
+The load score is 1.0 when every scheduler slot is busy or the whole memory
+budget is reserved; queued requests push it above 1.0. Autoscalers can
+target it directly.
+"""
+
+from typing import Any, Dict
+
+from app.core.config import settings
+from app.services.memory_budget import memory_budget
+from app.services.scheduler import scheduler
+from app.utils.openai_client import get_client
+
+
+def load_score() -> float:
+    """Utilization of the busier of the scheduler and the memory budget"""
+    work = (scheduler.in_flight + scheduler.queue_depth + memory_budget.waiting) / max(scheduler.max_concurrency, 1)
+    memory = memory_budget.in_flight_bytes / memory_budget.budget_bytes if memory_budget.budget_bytes > 0 else 0.0
+    return max(work, memory)
+
+
+def readiness() -> Dict[str, Any]:
+    """
+    Readiness report for this worker.
+
+    Returns:
+        Dictionary with ``ready``, the ``load`` score, the reasons it is not
+        ready (if any) and the inputs the decision was based on
+    """
+    pool = get_client()
+    available = pool.available_count() if pool else 0
+    load = load_score()
+
+    reasons = []
+    if available == 0:
+        reasons.append("no upstream account available")
+    if load >= settings.READINESS_MAX_LOAD:
+        reasons.append("overloaded")
+
+    return {
+        "ready": not reasons,
+        "reasons": reasons,
+        "load": round(load, 3),
+        "max_load": settings.READINESS_MAX_LOAD,
+        "upstream": {
+            "accounts": len(pool.accounts) if pool else 0,
+            "available": available,
+        },
+        "scheduler": {
+            "in_flight": scheduler.in_flight,
+            "queue_depth": scheduler.queue_depth,
+            "max_concurrency": scheduler.max_concurrency,
+        },
+        "memory": {
+            "in_flight_bytes": memory_budget.in_flight_bytes,
+            "budget_bytes": memory_budget.budget_bytes,
+            "waiting": memory_budget.waiting,
+        },
+    }
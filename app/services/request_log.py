@@ -0,0 +1,232 @@
+"""
+Structured Request Log
+
+Writes one JSON line per generation request: the request parameters, phase
+timings, outcome and response size (never the image payloads). Records are
+handed to a background thread through a bounded queue, so the request path
+only builds a dict. When the disk cannot keep up, records are dropped and
+counted instead of blocking requests. Files rotate by size and age and
+rotated files are gzip-compressed.
+"""
+
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.schemas.image import ImageGenerationRequest, ImageGenerationResponse
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Status logged for requests abandoned before a response (nginx's "client closed request")
+CANCELLED_STATUS = 499
+
+
+class RequestLogWriter:
+    """Background, batching JSONL writer with rotation"""
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int,
+        max_seconds: float,
+        backup_count: int,
+        buffer_size: int,
+        batch_size: int = 256,
+        flush_seconds: float = 1.0,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=buffer_size)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._file = None
+        self._opened_at = 0.0
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.write_errors = 0
+
+    def log(self, record: Dict[str, Any]) -> None:
+        """Queue a record; drops it (and counts) if the buffer is full"""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="request-log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Drain the queue and close the file"""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not (self._stopping.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=self.flush_seconds)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        try:
+            if self._file is None:
+                self._open()
+            elif self._file.tell() >= self.max_bytes or time.time() - self._opened_at >= self.max_seconds:
+                self._rotate()
+            self._file.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in batch))
+            self._file.flush()
+            self.written += len(batch)
+        except Exception as e:
+            self.write_errors += 1
+            self.dropped += len(batch)
+            logger.error("Request log write failed: %s", e)
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._opened_at = time.time()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        self._file = None
+        base, ext = os.path.splitext(self.path)
+        rotated = f"{base}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}{ext}"
+        os.replace(self.path, rotated)
+        with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        self.rotations += 1
+
+        archives = sorted(glob.glob(f"{base}-*{ext}.gz"))
+        for old in archives[:max(0, len(archives) - self.backup_count)]:
+            os.remove(old)
+        self._open()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "rotations": self.rotations,
+            "write_errors": self.write_errors,
+        }
+
+
+request_log = RequestLogWriter(
+    settings.REQUEST_LOG_PATH,
+    settings.REQUEST_LOG_MAX_BYTES,
+    settings.REQUEST_LOG_MAX_SECONDS,
+    settings.REQUEST_LOG_BACKUP_COUNT,
+    settings.REQUEST_LOG_BUFFER_SIZE,
+)
+
+
+class RequestTrace:
+    """
+    Collects phase timings and the outcome of one request, and writes it
+    to the request log when the ``with`` block exits.
+    """
+
+    def __init__(self, key_id: str, request: ImageGenerationRequest, client_request: Optional[ImageGenerationRequest] = None):
+        self.request_id = uuid.uuid4().hex
+        self.key_id = key_id
+        self.request = request
+        self.received = time.time()
+        self._start = self._last = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+        self.fields: Dict[str, Any] = {}
+        if client_request is not None and client_request is not request:
+            # Fields the model router changed, so the client's own request can be replayed
+            sent, served = client_request.model_dump(mode="json"), request.model_dump(mode="json")
+            self.fields["client_request"] = {k: v for k, v in sent.items() if served.get(k) != v}
+        self.status = 200
+        self.error: Optional[str] = None
+
+    def mark(self, phase: str) -> float:
+        """Record the time since the previous mark as ``<phase>_ms`` and return it"""
+        now = time.perf_counter()
+        elapsed = round((now - self._last) * 1000, 1)
+        self.timings[f"{phase}_ms"] = elapsed
+        self._last = now
+        return elapsed
+
+    def set_response(self, response: ImageGenerationResponse) -> None:
+        self.fields["response_id"] = response.id
+        self.fields["images"] = len(response.images)
+        self.fields["response_bytes"] = sum(len(image.b64_json) for image in response.images)
+
+    def __enter__(self) -> "RequestTrace":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if isinstance(exc, Exception):
+            self.status = getattr(exc, "status_code", 500)
+            self.error = str(getattr(exc, "detail", exc))
+        elif exc is not None:
+            # Cancellation (usually a client disconnect) or interpreter shutdown
+            self.status = CANCELLED_STATUS
+            self.error = "cancelled"
+        self.write()
+        return False
+
+    def write(self) -> None:
+        """Hand the record to the request log writer"""
+        if settings.REQUEST_LOG_ENABLED:
+            self.timings["total_ms"] = round((time.perf_counter() - self._start) * 1000, 1)
+            request_log.log({
+                "ts": self.received,
+                "request_id": self.request_id,
+                "key_id": self.key_id,
+                "request": self.request.model_dump(mode="json"),
+                "status": self.status,
+                "error": self.error,
+                "timings": self.timings,
+                **self.fields,
+            })
+
+
+def trace_request(
+    key_id: str,
+    request: ImageGenerationRequest,
+    client_request: Optional[ImageGenerationRequest] = None,
+) -> RequestTrace:
+    """
+    Start tracing a generation request for the request log
+
+    Args:
+        key_id: The caller's API key id
+        request: The request as served (after model routing)
+        client_request: The request as the client sent it, when routing changed it
+    """
+    return RequestTrace(key_id, request, client_request)
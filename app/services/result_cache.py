@@ -0,0 +1,413 @@
+"""
+Cluster-Wide Result Cache
+
+Identical generation requests are answered from a cache instead of being
+generated again. With several replicas, each cache key is owned by exactly
+one node, chosen by rendezvous (highest random weight) hashing over the
+cluster membership, so the cluster holds one copy of each result and every
+node sees the same hit rate as a single large cache.
+
+A node looks up keys it owns in its own in-process LRU and asks the owning
+peer over HTTP (with a short timeout) for the rest; any peer failure is
+treated as a miss and the request is generated locally. New results are
+stored on their owner: locally, or pushed to the peer in the background.
+
+Membership is this node's own URL plus a static peer list and/or a file of
+peer URLs (one per line). A background task re-reads the file when it
+changes, so lookups only read an in-memory snapshot. Peer endpoints
+require the shared ``CLUSTER_SECRET``.
+
+Keys use the canonical form of the prompt, so prompts differing only in
+case, whitespace or punctuation share a result. Callers that opt in can
+also be served the result of a near-identical prompt, found through this
+node's index of recently seen prompts.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.schemas.image import ImageGenerationRequest, ImageGenerationResponse
+from app.services.prompt_index import NearDuplicateIndex, canonical_prompt
+
+if TYPE_CHECKING:
+    import httpx
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Header carrying the shared secret on peer-to-peer requests
+CLUSTER_SECRET_HEADER = "x-cluster-secret"
+
+
+# Lookup outcomes, also reported in the X-Cache response header
+HIT = "hit"
+NEAR_HIT = "near"
+MISS = "miss"
+
+
+def _digest(fields: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def cache_key(request: ImageGenerationRequest) -> str:
+    """Hex digest identifying every request that produces the same result"""
+    # The tier only says how an auto request was routed, not what it produces
+    fields = request.model_dump(mode="json", exclude={"tier"})
+    fields["prompt"] = canonical_prompt(request.prompt)
+    return _digest(fields)
+
+
+def prompt_scope(request: ImageGenerationRequest) -> str:
+    """Digest of everything but the prompt: near-duplicates must agree on it"""
+    return _digest(request.model_dump(mode="json", exclude={"prompt", "tier"}))[:16]
+
+
+def _copy(response: ImageGenerationResponse) -> ImageGenerationResponse:
+    # Streaming responses consume their image list, so never hand out the cached one
+    return response.model_copy(update={"images": list(response.images)})
+
+
+class LocalResultCache:
+    """In-process LRU of generation results, bounded by image bytes, with a TTL"""
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.bytes = 0
+        self._entries: "OrderedDict[str, Tuple[float, int, ImageGenerationResponse]]" = OrderedDict()
+        self.evictions = 0
+        # Hits on keys someone asked to follow (e.g. pre-generated entries)
+        self.watched: Dict[str, int] = {}
+
+    def get(self, key: str) -> Optional[ImageGenerationResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored, size, response = entry
+        if time.monotonic() - stored > self.ttl_seconds:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        if key in self.watched:
+            self.watched[key] += 1
+        return _copy(response)
+
+    def contains(self, key: str) -> bool:
+        """Whether ``key`` holds an unexpired result, without counting as a use"""
+        entry = self._entries.get(key)
+        return entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds
+
+    def watch(self, key: str) -> None:
+        """Start counting hits on ``key``"""
+        self.watched.setdefault(key, 0)
+
+    def unwatch(self, key: str) -> int:
+        """Stop counting hits on ``key`` and return its count"""
+        return self.watched.pop(key, 0)
+
+    def put(self, key: str, response: ImageGenerationResponse) -> None:
+        size = sum(len(image.b64_json) for image in response.images)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        while self._entries and self.bytes + size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        self._entries[key] = (time.monotonic(), size, _copy(response))
+        self.bytes += size
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _normalize_url(url: str) -> str:
+    return url.strip().rstrip("/")
+
+
+class ClusterMembership:
+    """
+    This node and its peers, from a static list and/or a peers file.
+
+    The node list is a snapshot swapped on reload; a background task
+    reloads it from the peers file, so lookups do no I/O.
+    """
+
+    def __init__(
+        self,
+        self_url: Optional[str],
+        peers: List[str],
+        peers_file: Optional[str] = None,
+        refresh_seconds: float = 5.0,
+    ):
+        self.self_url = _normalize_url(self_url) if self_url else None
+        self.static_peers = [_normalize_url(p) for p in peers if p.strip()]
+        self.peers_file = peers_file
+        self.refresh_seconds = refresh_seconds
+        self._file_peers: List[str] = []
+        self._file_mtime: Optional[float] = None
+        self._nodes: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+        self.reload()
+
+    def reload(self) -> bool:
+        """
+        Re-read the peers file if it changed and rebuild the node snapshot.
+
+        Returns:
+            True if the snapshot was replaced
+        """
+        if self.peers_file:
+            try:
+                mtime = os.stat(self.peers_file).st_mtime
+            except OSError:
+                mtime = None
+            if mtime is None:
+                self._file_peers, self._file_mtime = [], None
+            elif mtime != self._file_mtime:
+                with open(self.peers_file, encoding="utf-8") as f:
+                    lines = [line.split("#", 1)[0] for line in f]
+                self._file_peers = [_normalize_url(line) for line in lines if line.strip()]
+                self._file_mtime = mtime
+                logger.info("Cluster membership reloaded: %d peer(s) in %s", len(self._file_peers), self.peers_file)
+        nodes = set(self.static_peers) | set(self._file_peers)
+        if self.self_url:
+            nodes.add(self.self_url)
+        nodes = sorted(nodes)
+        if nodes == self._nodes:
+            return False
+        self._nodes = nodes
+        return True
+
+    def nodes(self) -> List[str]:
+        """Every node of the cluster, including this one"""
+        return self._nodes
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await asyncio.to_thread(self.reload)
+            except Exception as e:
+                # Keep routing with the last good snapshot
+                logger.error("Cluster membership refresh failed: %s", e)
+
+    def start(self) -> None:
+        """Start the background refresh task (no-op without a peers file)"""
+        if self.peers_file and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def owner(self, key: str) -> Optional[str]:
+        """
+        The node that owns ``key``: the one with the highest hash of (node, key).
+
+        When a node joins or leaves, only the keys it owns (about 1/N) move.
+        Returns None when this node is not part of a cluster.
+        """
+        nodes = self.nodes()
+        if not self.self_url or len(nodes) < 2:
+            return None
+        return max(nodes, key=lambda node: hashlib.sha256(f"{node}|{key}".encode()).digest()[:8])
+
+
+class ResultCache:
+    """Local cache plus consistent-hash lookups on peers"""
+
+    def __init__(
+        self,
+        local: LocalResultCache,
+        membership: ClusterMembership,
+        peer_timeout: float,
+        secret: Optional[str],
+        enabled: bool = True,
+        similar: Optional[NearDuplicateIndex] = None,
+    ):
+        self.local = local
+        self.membership = membership
+        self.peer_timeout = peer_timeout
+        self.secret = secret
+        self.enabled = enabled
+        self.similar = similar
+        self._client: Optional["httpx.AsyncClient"] = None
+        self._pushes: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.peer_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.peer_errors = 0
+        self.pushes = 0
+
+    def _peer_client(self) -> "httpx.AsyncClient":
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                timeout=self.peer_timeout,
+                headers={CLUSTER_SECRET_HEADER: self.secret or ""},
+            )
+        return self._client
+
+    def _peer_url(self, owner: str, key: str) -> str:
+        return f"{owner}{settings.API_PREFIX}/v1/cache/{key}"
+
+    def authorized(self, secret: Optional[str]) -> bool:
+        """Whether a peer request carries this cluster's secret"""
+        return bool(self.secret) and secret is not None and hmac.compare_digest(secret, self.secret)
+
+    async def lookup(
+        self, request: ImageGenerationRequest, near_duplicates: bool = False
+    ) -> Tuple[Optional[ImageGenerationResponse], str]:
+        """
+        Look up a cached result for ``request``.
+
+        Args:
+            request: The generation request
+            near_duplicates: Also accept the result of a near-identical prompt
+
+        Returns:
+            A copy of the cached response (None on a miss, including any peer
+            failure) and the outcome: HIT, NEAR_HIT or MISS
+        """
+        if not self.enabled:
+            return None, MISS
+        key = cache_key(request)
+        response, outcome = await self._get(key), HIT
+        if response is None and near_duplicates and self.similar is not None:
+            match = self.similar.find(prompt_scope(request), request.prompt)
+            if match is not None:
+                response, outcome = await self._get(match[0]), NEAR_HIT
+                if response is None:
+                    # Evicted or expired on its owner
+                    self.similar.discard(match[0])
+        if response is None:
+            self.misses += 1
+            return None, MISS
+        if outcome == NEAR_HIT:
+            self.near_hits += 1
+        else:
+            self.hits += 1
+            self._remember(request, key)
+        return response, outcome
+
+    async def _get(self, key: str) -> Optional[ImageGenerationResponse]:
+        if self.owns(key):
+            return self.local.get(key)
+        owner = self.membership.owner(key)
+        response = await self._fetch(owner, key)
+        if response is not None:
+            self.peer_hits += 1
+        return response
+
+    def owns(self, key: str) -> bool:
+        """Whether this node stores ``key`` (always true outside a cluster)"""
+        owner = self.membership.owner(key)
+        return owner is None or owner == self.membership.self_url
+
+    def _remember(self, request: ImageGenerationRequest, key: str) -> None:
+        if self.similar is not None:
+            self.similar.add(prompt_scope(request), request.prompt, key)
+
+    async def _fetch(self, owner: str, key: str) -> Optional[ImageGenerationResponse]:
+        try:
+            reply = await self._peer_client().get(self._peer_url(owner, key))
+            if reply.status_code == 404:
+                return None
+            reply.raise_for_status()
+            return ImageGenerationResponse.model_validate_json(reply.content)
+        except Exception as e:
+            self.peer_errors += 1
+            logger.warning("Cache lookup on peer %s failed, generating locally: %s", owner, e)
+            return None
+
+    def put(self, request: ImageGenerationRequest, response: ImageGenerationResponse) -> None:
+        """Store a new result on the node that owns it; never blocks on the network"""
+        if not self.enabled:
+            return
+        key = cache_key(request)
+        self._remember(request, key)
+        if self.owns(key):
+            self.local.put(key, response)
+            return
+        owner = self.membership.owner(key)
+        task = asyncio.get_running_loop().create_task(self._push(owner, key, _copy(response)))
+        self._pushes.add(task)
+        task.add_done_callback(self._pushes.discard)
+
+    async def _push(self, owner: str, key: str, response: ImageGenerationResponse) -> None:
+        try:
+            reply = await self._peer_client().put(
+                self._peer_url(owner, key),
+                content=response.model_dump_json(),
+                headers={"content-type": "application/json"},
+            )
+            reply.raise_for_status()
+            self.pushes += 1
+        except Exception as e:
+            self.peer_errors += 1
+            logger.warning("Storing result on peer %s failed: %s", owner, e)
+
+    def start(self) -> None:
+        """Start following the peers file (no-op when the cache is disabled)"""
+        if self.enabled:
+            self.membership.start()
+
+    async def aclose(self) -> None:
+        await self.membership.stop()
+        for task in list(self._pushes):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "nodes": self.membership.nodes() if self.enabled else [],
+            "hits": self.hits,
+            "peer_hits": self.peer_hits,
+            "misses": self.misses,
+            "near_hits": self.near_hits,
+            "hit_ratio": round((self.hits + self.near_hits) / lookups, 3) if lookups else 0.0,
+            "peer_errors": self.peer_errors,
+            "pushes": self.pushes,
+            "local_entries": len(self.local),
+            "local_bytes": self.local.bytes,
+            "local_evictions": self.local.evictions,
+            "near_duplicate_index": self.similar.metrics() if self.similar is not None else None,
+        }
+
+
+result_cache = ResultCache(
+    LocalResultCache(settings.RESULT_CACHE_MAX_BYTES, settings.RESULT_CACHE_TTL_SECONDS),
+    ClusterMembership(
+        settings.CLUSTER_SELF_URL, settings.CLUSTER_PEERS, settings.CLUSTER_PEERS_FILE,
+        settings.CLUSTER_PEERS_REFRESH_SECONDS,
+    ),
+    settings.CLUSTER_PEER_TIMEOUT_SECONDS,
+    settings.CLUSTER_SECRET,
+    settings.RESULT_CACHE_ENABLED,
+    NearDuplicateIndex(settings.NEAR_DUPLICATE_INDEX_SIZE, settings.NEAR_DUPLICATE_THRESHOLD)
+    if settings.NEAR_DUPLICATE_ENABLED else None,
+)
@@ -0,0 +1,246 @@
+"""
+Generation Request Scheduler
+
+Limits how many generations run upstream at once and decides who goes next
+when capacity is saturated. Waiters are grouped into priority classes
+(interactive, batch, background) served in strict priority order, with
+weighted fair queuing between API keys inside each class. A waiter that
+has been queued longer than the starvation limit is served next regardless
+of class, and every class has a deadline after which a waiter gives up.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import Enum
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+from app.core.config import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Number of recent queue wait samples kept per class for percentiles
+WAIT_SAMPLES = 1000
+
+
+class PriorityClass(str, Enum):
+    """Scheduling classes, highest priority first"""
+    INTERACTIVE = "interactive"
+    BATCH = "batch"
+    BACKGROUND = "background"
+
+
+PRIORITY_ORDER = list(PriorityClass)
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a request waits in the queue past its class deadline"""
+
+
+def resolve_priority(key_priority: str, requested: Optional[str] = None) -> PriorityClass:
+    """
+    Work out a request's class from its key and an optional ``x-priority`` header.
+
+    Clients may lower their priority but never raise it above their key's class.
+    """
+    try:
+        base = PriorityClass(key_priority)
+    except ValueError:
+        base = PriorityClass.INTERACTIVE
+    try:
+        wanted = PriorityClass(requested) if requested else base
+    except ValueError:
+        return base
+    return max(base, wanted, key=PRIORITY_ORDER.index)
+
+
+class _Waiter:
+    __slots__ = ("future", "key_id", "priority", "enqueued", "finish", "done")
+
+    def __init__(self, future: asyncio.Future, key_id: str, priority: PriorityClass, finish: float):
+        self.future = future
+        self.key_id = key_id
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.finish = finish
+        self.done = False
+
+
+class _ClassState:
+    """Queues and counters for one priority class"""
+
+    def __init__(self):
+        self.heap: List = []  # (virtual finish tag, seq, waiter)
+        self.fifo: Deque[_Waiter] = deque()  # arrival order, for starvation checks
+        self.virtual_time = 0.0
+        self.last_finish: Dict[str, float] = {}
+        self.depth = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.expired = 0
+        self.waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    def oldest(self) -> Optional[_Waiter]:
+        while self.fifo and self.fifo[0].done:
+            self.fifo.popleft()
+        return self.fifo[0] if self.fifo else None
+
+    def pop_fair(self) -> Optional[_Waiter]:
+        while self.heap:
+            _, _, waiter = heapq.heappop(self.heap)
+            if not waiter.done:
+                return waiter
+        return None
+
+
+class Scheduler:
+    """Priority and weighted-fair admission of generation requests"""
+
+    def __init__(self, max_concurrency: int, deadlines: Dict[str, float], starvation_seconds: float):
+        self.max_concurrency = max_concurrency
+        self.deadlines = deadlines
+        self.starvation_seconds = starvation_seconds
+        self.in_flight = 0
+        self._classes = {p: _ClassState() for p in PriorityClass}
+        self._seq = itertools.count()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(state.depth for state in self._classes.values())
+
+    def _grant(self, waiter: _Waiter) -> None:
+        state = self._classes[waiter.priority]
+        waiter.done = True
+        state.depth -= 1
+        state.virtual_time = max(state.virtual_time, waiter.finish)
+        self._start(waiter.priority, time.monotonic() - waiter.enqueued)
+        waiter.future.set_result(None)
+
+    def _start(self, priority: PriorityClass, waited: float) -> None:
+        state = self._classes[priority]
+        self.in_flight += 1
+        state.in_flight += 1
+        state.admitted += 1
+        state.waits.append(waited)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        now = time.monotonic()
+        # Starvation protection: the longest-waiting request past the limit goes first
+        starved = [w for w in (s.oldest() for s in self._classes.values()) if w is not None]
+        starved = [w for w in starved if now - w.enqueued >= self.starvation_seconds]
+        if starved:
+            return min(starved, key=lambda w: w.enqueued)
+        for priority in PRIORITY_ORDER:
+            waiter = self._classes[priority].pop_fair()
+            if waiter is not None:
+                return waiter
+        return None
+
+    def _dispatch(self) -> None:
+        while self.in_flight < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self._grant(waiter)
+
+    async def acquire(
+        self,
+        key_id: str,
+        priority: PriorityClass,
+        weight: float = 1.0,
+        cost: float = 1.0,
+        max_wait: Optional[float] = None,
+    ) -> None:
+        """
+        Wait for an upstream slot.
+
+        Args:
+            max_wait: Give up sooner than the class deadline (e.g. for a client deadline)
+
+        Raises:
+            SchedulerTimeout: If the class deadline (or ``max_wait``) passes before a slot frees up
+        """
+        state = self._classes[priority]
+        if self.in_flight < self.max_concurrency and self.queue_depth == 0:
+            self._start(priority, 0.0)
+            return
+
+        # Weighted fair queuing: tag each request with its virtual finish time
+        start_tag = max(state.virtual_time, state.last_finish.get(key_id, 0.0))
+        finish = start_tag + cost / max(weight, 1e-6)
+        state.last_finish[key_id] = finish
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), key_id, priority, finish)
+        heapq.heappush(state.heap, (finish, next(self._seq), waiter))
+        state.fifo.append(waiter)
+        state.depth += 1
+
+        timeout = self.deadlines.get(priority.value)
+        if max_wait is not None:
+            timeout = max(0.0, max_wait if timeout is None else min(timeout, max_wait))
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done():
+                # Granted at the same moment we gave up: hand the slot on
+                self.release(priority)
+            else:
+                waiter.done = True
+                state.depth -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                state.expired += 1
+                raise SchedulerTimeout(f"Request waited longer than the {priority.value} deadline")
+            raise
+
+    def release(self, priority: PriorityClass) -> None:
+        """Return a slot and admit the next waiter"""
+        self.in_flight -= 1
+        self._classes[priority].in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        key_id: str,
+        priority: PriorityClass,
+        weight: float = 1.0,
+        cost: float = 1.0,
+        max_wait: Optional[float] = None,
+    ) -> AsyncIterator[None]:
+        """Hold an upstream slot for the duration of the block"""
+        await self.acquire(key_id, priority, weight, cost, max_wait)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Per-class queue metrics"""
+        classes = {}
+        for priority, state in self._classes.items():
+            waits = sorted(state.waits)
+            classes[priority.value] = {
+                "queue_depth": state.depth,
+                "in_flight": state.in_flight,
+                "admitted": state.admitted,
+                "expired": state.expired,
+                "wait_p50_seconds": round(waits[len(waits) // 2], 4) if waits else 0.0,
+                "wait_p95_seconds": round(waits[int(len(waits) * 0.95)], 4) if waits else 0.0,
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "classes": classes,
+        }
+
+
+scheduler = Scheduler(
+    settings.SCHEDULER_MAX_CONCURRENCY,
+    settings.SCHEDULER_DEADLINE_SECONDS,
+    settings.SCHEDULER_STARVATION_SECONDS,
+)
@@ -0,0 +1,312 @@
+"""
+Upstream Account Pool
+
+Spreads image generation calls over several OpenAI accounts. Each account
+has its own async client, connection pool and health state. Requests go to
+the account with the lowest expected wait: outstanding requests weighted by
+observed latency and 429 rate. Accounts that keep failing are ejected for
+an exponentially growing cooldown and readmitted once it expires.
+
+Upstream rate limits apply per model, so a 429 with ``Retry-After`` only
+takes the account out of rotation for that model; calls for other models
+(such as a routed request's fallback) still go to it.
+
+The OpenAI SDK is imported when the first account is built rather than at
+module import, so importing the app (and every worker boot or test run)
+does not pay for it.
+"""
+
+import logging
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type, TypeVar
+
+from app.core.config import settings
+from app.services.deadlines import Deadline, DeadlineExceeded
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Smoothing factor for latency and 429-rate moving averages
+EWMA_ALPHA = 0.2
+# Latency assumed for an account before it has served any request
+DEFAULT_LATENCY = 10.0
+# How strongly a high 429 rate steers traffic away from an account
+THROTTLE_PENALTY = 10.0
+
+
+@lru_cache(maxsize=None)
+def _retryable_errors() -> Tuple[Type[Exception], ...]:
+    """Errors that say something about the account rather than the request"""
+    import openai
+    return openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError
+
+
+@lru_cache(maxsize=None)
+def _credential_errors() -> Tuple[Type[Exception], ...]:
+    """Errors that mean the account's key is unusable"""
+    import openai
+    return openai.AuthenticationError, openai.PermissionDeniedError
+
+
+class NoUpstreamAvailable(Exception):
+    """Raised when every upstream account is ejected"""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamAccount:
+    """One upstream OpenAI account and its observed health"""
+
+    def __init__(
+        self,
+        name: str,
+        api_key: str,
+        org_id: Optional[str] = None,
+        base_url: Optional[str] = None,
+        weight: float = 1.0,
+    ):
+        import httpx
+        from openai import AsyncOpenAI
+
+        self.name = name
+        self.weight = weight
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            organization=org_id,
+            base_url=base_url,
+            max_retries=0,  # The pool fails over instead of retrying in place
+            timeout=settings.UPSTREAM_TIMEOUT_SECONDS,
+            default_headers={"OpenAI-Beta": "assistants=v1"},
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+                ),
+                timeout=settings.UPSTREAM_TIMEOUT_SECONDS,
+            ),
+        )
+        self.outstanding = 0
+        self.latency = DEFAULT_LATENCY
+        self.throttle_rate = 0.0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        # Model -> end of its rate-limit cooldown on this account
+        self.model_ejected_until: Dict[str, float] = {}
+        self.requests = 0
+        self.errors = 0
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def serves(self, model: Optional[str], now: float) -> bool:
+        """Whether the account is available for calls to ``model``"""
+        return self.is_available(now) and (model is None or now >= self.model_ejected_until.get(model, 0.0))
+
+    def readmitted_at(self, model: Optional[str]) -> float:
+        """When the account can next serve ``model``"""
+        return max(self.ejected_until, self.model_ejected_until.get(model, 0.0) if model else 0.0)
+
+    def score(self) -> float:
+        """Expected wait on this account; lower is better"""
+        return (self.outstanding + 1) * self.latency * (1 + THROTTLE_PENALTY * self.throttle_rate) / self.weight
+
+    def record_success(self, elapsed: float) -> None:
+        if self.requests == self.errors:
+            self.latency = elapsed  # First success replaces the prior
+        else:
+            self.latency += EWMA_ALPHA * (elapsed - self.latency)
+        self.requests += 1
+        self.throttle_rate *= 1 - EWMA_ALPHA
+        self.consecutive_failures = 0
+        self.ejections = 0
+
+    def record_failure(self, error: Exception, now: float, model: Optional[str] = None) -> None:
+        """
+        Fold a failed call into the account's health.
+
+        Args:
+            error: The call's error
+            now: Monotonic time of the failure
+            model: The model the call was for; rate limits then only apply to it
+        """
+        self.requests += 1
+        self.errors += 1
+        import openai  # Already loaded by the account's client
+
+        throttled = isinstance(error, openai.RateLimitError)
+        self.throttle_rate += EWMA_ALPHA * ((1.0 if throttled else 0.0) - self.throttle_rate)
+        if throttled and model is not None:
+            # A rate limit on one model says nothing about the account's other models
+            retry_after = _retry_after(error)
+            if retry_after is not None:
+                self.model_ejected_until[model] = now + min(retry_after, settings.UPSTREAM_MAX_EJECTION_SECONDS)
+                logger.warning(f"Upstream account {self.name} rate limited on {model} for {retry_after:.0f}s")
+            return
+        self.consecutive_failures += 1
+
+        if isinstance(error, _credential_errors()):
+            self.eject(now, settings.UPSTREAM_MAX_EJECTION_SECONDS)
+        elif throttled and _retry_after(error) is not None:
+            self.eject(now, min(_retry_after(error), settings.UPSTREAM_MAX_EJECTION_SECONDS))
+        elif self.consecutive_failures >= settings.UPSTREAM_EJECT_AFTER_FAILURES:
+            cooldown = settings.UPSTREAM_EJECTION_SECONDS * 2 ** self.ejections
+            self.eject(now, min(cooldown, settings.UPSTREAM_MAX_EJECTION_SECONDS))
+
+    def eject(self, now: float, seconds: float) -> None:
+        self.ejections += 1
+        self.ejected_until = now + seconds
+        # Readmitted accounts get a single trial before being ejected again
+        self.consecutive_failures = settings.UPSTREAM_EJECT_AFTER_FAILURES - 1
+        logger.warning(f"Upstream account {self.name} ejected for {seconds:.0f}s")
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "available": self.is_available(now),
+            "outstanding": self.outstanding,
+            "latency_seconds": round(self.latency, 3),
+            "throttle_rate": round(self.throttle_rate, 3),
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejected_for_seconds": max(0.0, round(self.ejected_until - now, 1)),
+            "rate_limited_models": {
+                model: round(until - now, 1) for model, until in sorted(self.model_ejected_until.items()) if until > now
+            },
+        }
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Read ``Retry-After`` seconds from an API error response, if present"""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers["retry-after"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class UpstreamPool:
+    """Health-weighted load balancer over upstream accounts"""
+
+    def __init__(self, accounts: List[UpstreamAccount]):
+        self.accounts = accounts
+
+    def select(self, exclude: Optional[set] = None, model: Optional[str] = None) -> UpstreamAccount:
+        """
+        Pick the account with the lowest expected wait.
+
+        Args:
+            exclude: Names of accounts not to pick
+            model: Skip accounts rate limited on this model
+
+        Raises:
+            NoUpstreamAvailable: If no account is configured or all are ejected
+        """
+        now = time.monotonic()
+        candidates = [
+            a for a in self.accounts
+            if a.serves(model, now) and (not exclude or a.name not in exclude)
+        ]
+        if not candidates:
+            readmit = [a.readmitted_at(model) - now for a in self.accounts if not a.serves(model, now)]
+            raise NoUpstreamAvailable(
+                f"All upstream accounts are temporarily unavailable{f' for {model}' if model else ''}",
+                retry_after=min(readmit) if readmit else 0.0,
+            )
+        return min(candidates, key=UpstreamAccount.score)
+
+    async def run(
+        self,
+        operation: Callable[["AsyncOpenAI"], Awaitable[T]],
+        deadline: Optional[Deadline] = None,
+        model: Optional[str] = None,
+    ) -> T:
+        """
+        Run an upstream call, failing over to another account on account-level errors.
+
+        Args:
+            operation: Coroutine function taking the account's client
+            deadline: The request's deadline; no attempt starts after it has passed
+            model: The model called, so rate limits are tracked per model
+
+        Returns:
+            The operation's result
+
+        Raises:
+            DeadlineExceeded: If the deadline passes before the call succeeds
+        """
+        tried: set = set()
+        last_error: Optional[Exception] = None
+        while True:
+            if deadline is not None and deadline.expired():
+                raise DeadlineExceeded("Request deadline passed before the upstream call completed")
+            try:
+                account = self.select(tried, model)
+            except NoUpstreamAvailable:
+                if last_error is not None:
+                    raise last_error
+                raise
+            tried.add(account.name)
+            account.outstanding += 1
+            start = time.monotonic()
+            try:
+                result = await operation(account.client)
+            except _retryable_errors() + _credential_errors() as e:
+                import openai
+
+                if isinstance(e, openai.APITimeoutError) and deadline is not None and deadline.expired():
+                    # Cut short by the client's deadline, not the account's fault
+                    raise DeadlineExceeded("Request deadline passed before the upstream call completed") from e
+                account.record_failure(e, time.monotonic(), model)
+                last_error = e
+                if len(tried) >= settings.UPSTREAM_MAX_ATTEMPTS:
+                    raise
+                logger.warning(f"Upstream account {account.name} failed ({type(e).__name__}), failing over")
+                continue
+            finally:
+                account.outstanding -= 1
+            account.record_success(time.monotonic() - start)
+            return result
+
+    def available_count(self) -> int:
+        now = time.monotonic()
+        return sum(1 for a in self.accounts if a.is_available(now))
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Per-account routing state for metrics and health checks"""
+        now = time.monotonic()
+        return [a.snapshot(now) for a in self.accounts]
+
+    async def aclose(self) -> None:
+        for account in self.accounts:
+            await account.client.close()
+
+
+def build_pool(default_api_key: Optional[str], default_org_id: Optional[str]) -> UpstreamPool:
+    """
+    Build the pool from ``OPENAI_ACCOUNTS``, or a single account from the default key.
+    """
+    if settings.OPENAI_ACCOUNTS:
+        accounts = [
+            UpstreamAccount(
+                name=entry.get("name") or f"account-{i}",
+                api_key=entry["api_key"],
+                org_id=entry.get("org_id"),
+                base_url=entry.get("base_url") or settings.OPENAI_BASE_URL,
+                weight=float(entry.get("weight", 1.0)),
+            )
+            for i, entry in enumerate(settings.OPENAI_ACCOUNTS)
+        ]
+    elif default_api_key:
+        accounts = [UpstreamAccount("default", default_api_key, default_org_id, settings.OPENAI_BASE_URL)]
+    else:
+        accounts = []
+    return UpstreamPool(accounts)
@@ -0,0 +1,322 @@
+"""
+Usage and Cost Ledger
+
+Records tokens, images, latency and estimated cost for every generation.
+The request path only appends to an in-memory buffer; a background task
+writes batches to SQLite and folds them into hourly summaries in the same
+transaction, so aggregation queries never scan raw events.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+from collections import deque
+from dataclasses import astuple, dataclass, fields
+from typing import Any, Deque, Dict, List, Optional
+
+from app.core.config import settings
+from app.schemas.image import ImageGenerationRequest, ImageGenerationResponse
+from app.services.rate_limit import estimate_image_tokens
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# gpt-image-1 prices in USD per token
+GPT_IMAGE_TEXT_PRICE = 5.0 / 1_000_000
+GPT_IMAGE_OUTPUT_PRICE = 40.0 / 1_000_000
+
+# DALL-E prices in USD per image, by (model, quality, size)
+DALLE_PRICES = {
+    ("dall-e-3", "standard", "1024x1024"): 0.040,
+    ("dall-e-3", "standard", "1024x1536"): 0.080,
+    ("dall-e-3", "standard", "1536x1024"): 0.080,
+    ("dall-e-3", "hd", "1024x1024"): 0.080,
+    ("dall-e-3", "hd", "1024x1536"): 0.120,
+    ("dall-e-3", "hd", "1536x1024"): 0.120,
+    ("dall-e-2", "", "256x256"): 0.016,
+    ("dall-e-2", "", "512x512"): 0.018,
+    ("dall-e-2", "", "1024x1024"): 0.020,
+}
+
+
+def estimate_cost(model: str, size: str, quality: str, images: int, prompt_tokens: int, image_tokens: int) -> float:
+    """Estimate the upstream cost of a generation in USD"""
+    if model.startswith("gpt-image"):
+        return round(prompt_tokens * GPT_IMAGE_TEXT_PRICE + image_tokens * GPT_IMAGE_OUTPUT_PRICE, 6)
+    if model == "dall-e-2":
+        quality = ""
+    elif quality not in ("standard", "hd"):
+        quality = "standard"
+    return images * DALLE_PRICES.get((model, quality, size), 0.0)
+
+
+def estimate_request_cost(request: ImageGenerationRequest) -> float:
+    """Expected upstream cost of a request in USD, before it is generated"""
+    prompt_tokens = len(request.prompt) // 4 + 1
+    image_tokens = estimate_image_tokens(request) - prompt_tokens
+    return estimate_cost(
+        request.model.value, request.size.value, request.quality.value, request.n, prompt_tokens, image_tokens
+    )
+
+
+@dataclass
+class UsageRecord:
+    """One generation's usage"""
+    created: float
+    request_id: str
+    key_id: str
+    model: str
+    size: str
+    quality: str
+    images: int
+    prompt_tokens: int
+    image_tokens: int
+    total_tokens: int
+    latency_ms: float
+    cost_usd: float
+
+
+_COLUMNS = [f.name for f in fields(UsageRecord)]
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS usage_events (
+    {", ".join(_COLUMNS)}
+);
+CREATE TABLE IF NOT EXISTS usage_hourly (
+    hour INTEGER NOT NULL,
+    key_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    size TEXT NOT NULL,
+    quality TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    images INTEGER NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    latency_ms REAL NOT NULL,
+    cost_usd REAL NOT NULL,
+    PRIMARY KEY (hour, key_id, model, size, quality)
+);
+"""
+
+_ROLLUP = """
+INSERT INTO usage_hourly VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?)
+ON CONFLICT (hour, key_id, model, size, quality) DO UPDATE SET
+    requests = requests + 1,
+    images = images + excluded.images,
+    total_tokens = total_tokens + excluded.total_tokens,
+    latency_ms = latency_ms + excluded.latency_ms,
+    cost_usd = cost_usd + excluded.cost_usd
+"""
+
+# Usage is rolled up into buckets of this many seconds
+HOUR = 3600
+
+
+def _hour_floor(ts: float) -> int:
+    return int(ts // HOUR) * HOUR
+
+
+def _hour_ceil(ts: float) -> int:
+    return -int(-ts // HOUR) * HOUR
+
+
+# Aggregation dimensions exposed to callers, mapped to SQL expressions
+GROUP_BY = {"key": "key_id", "model": "model", "hour": "hour", "size": "size"}
+
+
+class UsageLedger:
+    """Buffered, batched writer and query interface for usage records"""
+
+    def __init__(self, path: str, flush_seconds: float = 5.0, batch_size: int = 500, max_buffer: int = 50000):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self._buffer: Deque[UsageRecord] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.written = 0
+        self.dropped = 0
+        self.flush_errors = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def record(self, record: UsageRecord) -> None:
+        """Queue a record for writing; never blocks on I/O"""
+        if len(self._buffer) >= self.max_buffer:
+            # Storage has fallen far behind: shed the oldest rather than grow without bound
+            self._buffer.popleft()
+            self.dropped += 1
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _write(self, batch: List[UsageRecord]) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO usage_events VALUES ({', '.join('?' * len(_COLUMNS))})",
+                    [astuple(r) for r in batch],
+                )
+                conn.executemany(_ROLLUP, [
+                    (_hour_floor(r.created), r.key_id, r.model, r.size, r.quality,
+                     r.images, r.total_tokens, r.latency_ms, r.cost_usd)
+                    for r in batch
+                ])
+        finally:
+            conn.close()
+
+    async def flush(self) -> None:
+        """Write everything buffered so far"""
+        if not self._buffer:
+            return
+        batch = list(self._buffer)
+        self._buffer.clear()
+        try:
+            await asyncio.to_thread(self._write, batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.flush_errors += 1
+            logger.error(f"Usage ledger flush failed: {e}")
+            # Put the batch back in front so it is retried on the next flush
+            self._buffer.extendleft(reversed(batch))
+            while len(self._buffer) > self.max_buffer:
+                self._buffer.popleft()
+                self.dropped += 1
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """Start the background flush task"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Stop the flush task and write out whatever is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def _summary(self, group_by: List[str], key_id: Optional[str], since: Optional[float], until: Optional[float]) -> List[Dict[str, Any]]:
+        columns = [GROUP_BY[g] for g in group_by]
+        where, params = [], []
+        if key_id is not None:
+            where.append("key_id = ?")
+            params.append(key_id)
+        # Bounds are widened to whole hours: every bucket overlapping [since, until) counts
+        if since is not None:
+            where.append("hour >= ?")
+            params.append(_hour_floor(since))
+        if until is not None:
+            where.append("hour < ?")
+            params.append(_hour_ceil(until))
+        select = columns + [
+            "SUM(requests)", "SUM(images)", "SUM(total_tokens)",
+            "SUM(latency_ms) / SUM(requests)", "SUM(cost_usd)",
+        ]
+        query = (
+            f"SELECT {', '.join(select)} FROM usage_hourly"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + (f" GROUP BY {', '.join(columns)} ORDER BY {', '.join(columns)}" if columns else "")
+        )
+        conn = self._connect()
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+        names = group_by + ["requests", "images", "total_tokens", "avg_latency_ms", "cost_usd"]
+        return [dict(zip(names, row)) for row in rows if row[len(columns)]]
+
+    async def summary(
+        self,
+        group_by: List[str],
+        key_id: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Aggregate usage from the hourly rollups.
+
+        Rollups have hour granularity, so each hour bucket that overlaps
+        ``[since, until)`` is counted in full.
+
+        Args:
+            group_by: Dimensions from ``GROUP_BY`` (e.g. ["key", "hour"])
+            key_id: Restrict to one API key
+            since: Unix timestamp lower bound (rounded down to the hour)
+            until: Unix timestamp upper bound, exclusive (rounded up to the hour)
+
+        Returns:
+            One row per group with request, image, token, latency and cost totals
+        """
+        return await asyncio.to_thread(self._summary, group_by, key_id, since, until)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "dropped": self.dropped,
+            "flush_errors": self.flush_errors,
+        }
+
+
+def record_generation(
+    request_id: str,
+    key_id: str,
+    request: ImageGenerationRequest,
+    response: ImageGenerationResponse,
+    latency_ms: float,
+) -> None:
+    """
+    Add a completed generation to the ledger
+
+    ``request_id`` is the request log's id, so ledger rows join with log lines.
+    """
+    usage = response.usage
+    prompt_tokens = usage.prompt_tokens if usage else 0
+    image_tokens = usage.image_tokens if usage else 0
+    usage_ledger.record(UsageRecord(
+        created=float(response.created),
+        request_id=request_id,
+        key_id=key_id,
+        model=response.model,
+        size=request.size.value,
+        quality=request.quality.value,
+        images=len(response.images),
+        prompt_tokens=prompt_tokens,
+        image_tokens=image_tokens,
+        total_tokens=usage.total_tokens if usage else 0,
+        latency_ms=round(latency_ms, 1),
+        cost_usd=estimate_cost(
+            response.model, request.size.value, request.quality.value,
+            len(response.images), prompt_tokens, image_tokens
+        ),
+    ))
+
+
+usage_ledger = UsageLedger(
+    settings.USAGE_DB_PATH,
+    settings.USAGE_FLUSH_SECONDS,
+    settings.USAGE_BATCH_SIZE,
+)
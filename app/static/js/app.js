@@ -15,11 +15,23 @@ document.addEventListener('DOMContentLoaded', function() {
     const statusText = document.getElementById('status');
     const loadingIndicator = document.getElementById('loading');
     
+    const historySearch = document.getElementById('history-search');
+    const historyList = document.getElementById('history-list');
+    const historyMore = document.getElementById('history-more');
+    const historyStatus = document.getElementById('history-status');
+    
     // Template for creating image elements
     const imageTemplate = document.getElementById('image-template');
+    const historyTemplate = document.getElementById('history-template');
     
     // Constants
     const API_URL = '/api/generate';
+    const HISTORY_URL = '/api/v1/history/';
+    const HISTORY_PAGE_SIZE = 12;
+    
+    // Cursor for the next page of history (null when there are no more)
+    let historyCursor = null;
+    let historySearchTimer = null;
 
     /**
      * Show a toast notification
@@ -149,6 +161,9 @@ document.addEventListener('DOMContentLoaded', function() {
             setAppState('success', `Generated ${data.images.length} image(s)`);
             showToast('Images generated successfully!');
             
+            // The history is saved just after the response is sent
+            setTimeout(() => loadHistory(true), 1000);
+            
         } catch (error) {
             console.error('Error generating images:', error);
             setAppState('error', error.message);
@@ -174,8 +189,69 @@ document.addEventListener('DOMContentLoaded', function() {
         document.body.removeChild(link);
     }
 
+    /**
+     * Load a page of past generations, matching the search box
+     * @param {boolean} reset - Start from the newest generation instead of the next page
+     */
+    async function loadHistory(reset = false) {
+        if (reset) {
+            historyCursor = null;
+        }
+        const params = new URLSearchParams({ limit: HISTORY_PAGE_SIZE });
+        const query = historySearch.value.trim();
+        if (query) {
+            params.set('q', query);
+        }
+        if (historyCursor) {
+            params.set('cursor', historyCursor);
+        }
+        
+        try {
+            const response = await fetch(`${HISTORY_URL}?${params}`);
+            if (!response.ok) {
+                throw new Error(`Failed to load history: ${response.statusText}`);
+            }
+            const page = await response.json();
+            
+            if (reset) {
+                historyList.innerHTML = '';
+            }
+            page.data.forEach(item => {
+                item.image_urls.forEach(url => {
+                    const entry = historyTemplate.content.cloneNode(true);
+                    const imgElement = entry.querySelector('img');
+                    imgElement.src = url;
+                    imgElement.alt = item.prompt;
+                    entry.querySelector('.download-btn').href = url;
+                    const promptElement = entry.querySelector('.history-prompt');
+                    promptElement.textContent = item.prompt;
+                    promptElement.title = `${item.prompt} (${new Date(item.created * 1000).toLocaleString()})`;
+                    historyList.appendChild(entry);
+                });
+            });
+            
+            historyCursor = page.next_cursor;
+            historyMore.classList.toggle('hidden', !historyCursor);
+            if (!historyList.children.length) {
+                historyStatus.textContent = query ? 'No matching generations' : 'No generations yet';
+            } else {
+                historyStatus.textContent = 'Your past generations';
+            }
+        } catch (error) {
+            console.error('Error loading history:', error);
+            historyStatus.textContent = 'History unavailable';
+        }
+    }
+
     // Event listeners
     generateBtn.addEventListener('click', generateImages);
+    historyMore.addEventListener('click', () => loadHistory(false));
+    historySearch.addEventListener('input', () => {
+        clearTimeout(historySearchTimer);
+        historySearchTimer = setTimeout(() => loadHistory(true), 300);
+    });
+    
+    loadHistory(true);
     
     // Handler for model changes to update available options
     modelSelect.addEventListener('change', function() {
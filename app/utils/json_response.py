@@ -0,0 +1,133 @@
+"""
+Fast JSON encoding for generation responses
+
+Image responses are dominated by megabyte-sized base64 strings. Going
+through FastAPI's response_model validation, ``jsonable_encoder`` and
+``json.dumps`` copies and rescans those strings several times. This module
+encodes trusted responses straight to bytes with orjson, handing it the
+model's own string objects so each payload is copied once, into the output.
+
+Large responses are streamed instead: the envelope is written first and
+each image payload follows in fixed-size chunks, so the full body is never
+held in memory and each image is released once it has been sent.
+"""
+
+import json
+from typing import Any, AsyncIterator, Dict, Mapping, Optional
+
+from fastapi.responses import Response, StreamingResponse
+
+from app.core.config import settings
+from app.schemas.image import ImageGenerationResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+
+def response_content(response: ImageGenerationResponse) -> Dict[str, Any]:
+    """Plain-dict view of a response that references (not copies) its strings"""
+    usage = response.usage
+    return {
+        "id": response.id,
+        "created": response.created,
+        "images": [
+            {"b64_json": image.b64_json, "filetype": image.filetype, "size": image.size}
+            for image in response.images
+        ],
+        "model": response.model,
+        "usage": None if usage is None else {
+            "prompt_tokens": usage.prompt_tokens,
+            "image_tokens": usage.image_tokens,
+            "total_tokens": usage.total_tokens,
+        },
+    }
+
+
+def _dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":")).encode("utf-8")
+
+
+def encode_response(response: ImageGenerationResponse) -> bytes:
+    """Encode a response to JSON bytes matching the ``ImageGenerationResponse`` schema"""
+    return _dumps(response_content(response))
+
+
+async def stream_response(response: ImageGenerationResponse, chunk_bytes: int) -> AsyncIterator[bytes]:
+    """
+    Yield a response as JSON, byte-identical to ``encode_response``.
+
+    The response's image list is emptied as images are written, so each
+    payload can be freed as soon as it has been sent.
+    """
+    images = response.images
+    response.images = []
+    yield _dumps({"id": response.id, "created": response.created})[:-1] + b',"images":['
+    first = True
+    while images:
+        image = images.pop(0)
+        payload = image.b64_json
+        yield (b'' if first else b',') + b'{"b64_json":'
+        first = False
+        if '"' in payload or "\\" in payload or not payload.isascii():
+            # Not plain base64: let the encoder escape it
+            yield _dumps(payload)
+        else:
+            yield b'"'
+            for start in range(0, len(payload), chunk_bytes):
+                yield payload[start:start + chunk_bytes].encode("ascii")
+            yield b'"'
+        yield b',' + _dumps({"filetype": image.filetype, "size": image.size})[1:]
+        del image, payload
+    usage = response_content(response)["usage"]
+    yield b'],' + _dumps({"model": response.model, "usage": usage})[1:]
+
+
+class ImageJSONResponse(Response):
+    """
+    JSON response for an already-validated ``ImageGenerationResponse``
+
+    Returning this from an endpoint bypasses ``response_model`` validation and
+    serialization; the route's ``response_model`` still documents the schema.
+    """
+    media_type = "application/json"
+
+    def __init__(
+        self,
+        content: ImageGenerationResponse,
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+    ):
+        super().__init__(content, status_code=status_code, headers=headers)
+
+    def render(self, content: ImageGenerationResponse) -> bytes:
+        return encode_response(content)
+
+
+class ImageStreamingResponse(StreamingResponse):
+    """Chunked JSON response for a large ``ImageGenerationResponse``"""
+
+    def __init__(
+        self,
+        content: ImageGenerationResponse,
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+        chunk_bytes: Optional[int] = None,
+    ):
+        super().__init__(
+            stream_response(content, chunk_bytes or settings.RESPONSE_STREAMING_CHUNK_BYTES),
+            status_code=status_code,
+            headers=headers,
+            media_type="application/json",
+        )
+
+
+def image_response(response: ImageGenerationResponse, headers: Optional[Mapping[str, str]] = None) -> Response:
+    """Encode small responses in one piece and stream large ones"""
+    payload_bytes = sum(len(image.b64_json) for image in response.images)
+    if payload_bytes >= settings.RESPONSE_STREAMING_MIN_BYTES:
+        return ImageStreamingResponse(response, headers=headers)
+    return ImageJSONResponse(response, headers=headers)
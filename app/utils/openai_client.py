@@ -1,15 +1,17 @@
 """
 OpenAI Client Initialization Utility
 
-This module handles the initialization and management of the OpenAI client,
-including API key validation, model selection, and error handling.
+This module handles the initialization and management of the upstream
+OpenAI account pool, including API key validation, model selection, and
+error handling.
 """
 
 import os
+import time
 import logging
 from typing import Optional, Tuple
-from openai import OpenAI, OpenAIError, APIStatusError, APIConnectionError, AuthenticationError
 from app.core.config import settings
+from app.services.upstream_pool import UpstreamPool, build_pool
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -18,45 +20,70 @@ logger = logging.getLogger(__name__)
 IMAGE_MODEL = "gpt-image-1"
 
 # Global client variable and state tracking
-client: Optional[OpenAI] = None
+client: Optional[UpstreamPool] = None
 active_image_model = IMAGE_MODEL
 using_fallback_mode = False
 
-def initialize_openai_client() -> Tuple[Optional[OpenAI], str, bool]:
-    """Initialize and validate the OpenAI client."""
+def initialize_openai_client() -> Tuple[Optional[UpstreamPool], str, bool]:
+    """Build the upstream account pool (no network calls)."""
     global client, active_image_model, using_fallback_mode
 
     api_key = settings.OPENAI_API_KEY
     org_id = os.getenv("OPENAI_ORG_ID")
-    if not api_key:
+    if not api_key and not settings.OPENAI_ACCOUNTS:
         logger.error("OPENAI_API_KEY is not set.")
         using_fallback_mode = True
         return None, active_image_model, True
 
-    logger.info(f"OpenAI API key detected: {api_key[:7]}...{api_key[-7:] if len(api_key) > 11 else ''}")
-    try:
-        client = OpenAI(api_key=api_key, organization=org_id, default_headers={"OpenAI-Beta": "assistants=v1"})
-        models = client.models.list()
-        if IMAGE_MODEL not in [m.id for m in models.data]:
-            logger.error(f"Model {IMAGE_MODEL} not available for this API key.")
-            using_fallback_mode = True
-            return None, active_image_model, True
-        logger.info(f"OpenAI API key validated. Using model: {IMAGE_MODEL}")
-        active_image_model = IMAGE_MODEL
-        using_fallback_mode = False
-    except (AuthenticationError, APIStatusError, APIConnectionError, Exception) as e:
-        logger.error(f"OpenAI client initialization failed: {e}")
-        client = None
-        using_fallback_mode = True
+    if api_key:
+        logger.info(f"OpenAI API key detected: {api_key[:7]}...{api_key[-7:] if len(api_key) > 11 else ''}")
+    client = build_pool(api_key, org_id)
+    logger.info(f"Upstream pool configured with {len(client.accounts)} account(s)")
+    active_image_model = IMAGE_MODEL
+    using_fallback_mode = False
 
     return client, active_image_model, using_fallback_mode
 
-def get_client() -> Optional[OpenAI]:
+async def validate_openai_client() -> bool:
     """
-    Get the current OpenAI client instance.
+    Validate every upstream account against the image model.
+
+    Accounts that cannot use the model are ejected from the pool; they are
+    readmitted automatically once their cooldown expires.
+
+    Returns:
+        True if at least one account is usable, False otherwise
+    """
+    global using_fallback_mode
+
+    if client is None:
+        return False
+
+    from openai import OpenAIError
+
+    valid = 0
+    for account in client.accounts:
+        try:
+            models = await account.client.models.list()
+            if IMAGE_MODEL in [m.id for m in models.data]:
+                valid += 1
+                continue
+            logger.error(f"Model {IMAGE_MODEL} not available for upstream account {account.name}.")
+        except OpenAIError as e:
+            logger.error(f"Upstream account {account.name} validation failed: {e}")
+        account.eject(time.monotonic(), settings.UPSTREAM_MAX_EJECTION_SECONDS)
+
+    using_fallback_mode = valid == 0
+    if valid:
+        logger.info(f"OpenAI API key validated on {valid} account(s). Using model: {IMAGE_MODEL}")
+    return valid > 0
+
+def get_client() -> Optional[UpstreamPool]:
+    """
+    Get the current upstream account pool.
     
     Returns:
-        The OpenAI client or None if not initialized
+        The upstream pool or None if not initialized
     """
     return client
 
@@ -73,29 +100,37 @@ def is_fallback_mode() -> bool:
     """
     Check if the client is in fallback mode.
     
+    The flag is recomputed from the pool on every call, so it clears as
+    soon as an ejected account is readmitted.
+
     Returns:
         True if in fallback mode, False otherwise
     """
+    global using_fallback_mode
+    using_fallback_mode = client is None or client.available_count() == 0
     return using_fallback_mode
 
 def reinitialize_client_if_needed() -> bool:
     """
-    Re-initialize the OpenAI client if it's None or in fallback mode.
+    Re-initialize the upstream pool if it has not been built.
+
+    Unhealthy accounts inside an existing pool recover on their own once
+    their ejection cooldown expires.
     
     Returns:
         True if reinitialization was attempted, False otherwise
     """
     global client, using_fallback_mode, active_image_model
     
-    if client is None or using_fallback_mode:
+    if client is None:
         logger.info("Attempting to reinitialize OpenAI client...")
         client, active_image_model, using_fallback_mode = initialize_openai_client()
         return True
     return False
 
-def cleanup_client():
-    """Clean up the OpenAI client resources"""
+async def cleanup_client():
+    """Close the upstream clients and their connection pools"""
     global client
-    # Note: OpenAI client doesn't have a close/cleanup method as of now
-    # but we can set it to None to help with garbage collection
-    client = None 
\ No newline at end of file
+    if client is not None:
+        await client.aclose()
+    client = None
\ No newline at end of file
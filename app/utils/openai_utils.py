@@ -1,12 +1,13 @@
 from typing import Optional
 import logging
-from openai import OpenAI
+
+from app.services.upstream_pool import UpstreamPool
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-def get_client() -> Optional[OpenAI]:
-    """Get the current OpenAI client instance."""
+def get_client() -> Optional[UpstreamPool]:
+    """Get the current upstream account pool."""
     # Import here to avoid circular import issues
     from app.utils.openai_client import client as _client
     
@@ -24,16 +25,16 @@ def get_active_model() -> str:
 def is_fallback_mode() -> bool:
     """Check if the client is in fallback mode."""
     # Import here to avoid circular import issues
-    from app.utils.openai_client import using_fallback_mode as _fallback_mode
-    return _fallback_mode
+    from app.utils.openai_client import is_fallback_mode as _is_fallback_mode
+    return _is_fallback_mode()
 
 def reinitialize_client_if_needed() -> bool:
-    """Re-initialize the OpenAI client if it's None or in fallback mode."""
+    """Re-initialize the upstream pool if it has not been built."""
     # Import here to avoid circular import issues
     from app.utils import openai_client
     from app.utils.openai_client import initialize_openai_client
     
-    if openai_client.client is None or openai_client.using_fallback_mode:
+    if openai_client.client is None:
         logger.info("Attempting to reinitialize OpenAI client...")
         try:
             openai_client.client, openai_client.active_image_model, openai_client.using_fallback_mode = initialize_openai_client()
@@ -48,9 +49,9 @@ def reinitialize_client_if_needed() -> bool:
             return False
     return False
 
-def cleanup_client():
-    """Clean up the OpenAI client resources."""
+async def cleanup_client():
+    """Close the upstream clients and their connection pools."""
     # Import here to avoid circular import issues
     from app.utils import openai_client
     logger.info("Cleaning up OpenAI client resources")
-    openai_client.client = None 
\ No newline at end of file
+    await openai_client.cleanup_client()
\ No newline at end of file
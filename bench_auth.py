@@ -0,0 +1,62 @@
+"""
+Microbenchmark for API key authentication and rate limiting
+
+Builds a key registry with 10k hashed keys and measures the per-request
+cost of looking up a key and checking its token buckets.
+
+Usage:
+    python bench_auth.py [--keys 10000] [--iterations 200000] [--backend memory|sqlite]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from app.schemas.image import ImageGenerationRequest
+from app.services.key_registry import ApiKeyRecord, KeyRegistry, hash_api_key
+from app.services.rate_limit import InMemoryRateLimiter, SQLiteRateLimiter, estimate_image_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API key auth overhead")
+    parser.add_argument("--keys", type=int, default=10000, help="Number of registered keys")
+    parser.add_argument("--iterations", type=int, default=200000, help="Number of lookups")
+    parser.add_argument("--backend", default="memory", choices=["memory", "sqlite"], help="Rate limiter backend")
+    args = parser.parse_args()
+
+    plaintext = [f"sk-client-{i:06d}-{os.urandom(8).hex()}" for i in range(args.keys)]
+    registry = KeyRegistry()
+    registry.set_records(
+        ApiKeyRecord(key_id=f"client-{i}", key_hash=hash_api_key(key), requests_per_minute=10**9,
+                     image_tokens_per_minute=10**12)
+        for i, key in enumerate(plaintext)
+    )
+    if args.backend == "sqlite":
+        limiter = SQLiteRateLimiter(os.path.join(tempfile.mkdtemp(), "ratelimit.db"))
+    else:
+        limiter = InMemoryRateLimiter()
+    request = ImageGenerationRequest(prompt="A castle on a cliff at dawn")
+
+    # Lookup only
+    start = time.perf_counter()
+    for i in range(args.iterations):
+        registry.lookup(plaintext[i % args.keys])
+    lookup_us = (time.perf_counter() - start) / args.iterations * 1e6
+
+    # Lookup + token estimate + both token buckets
+    iterations = args.iterations if args.backend == "memory" else args.iterations // 20
+    start = time.perf_counter()
+    for i in range(iterations):
+        record = registry.lookup(plaintext[i % args.keys])
+        limiter.check(record.key_id, record.requests_per_minute, record.image_tokens_per_minute,
+                      estimate_image_tokens(request))
+    full_us = (time.perf_counter() - start) / iterations * 1e6
+
+    print(f"keys={args.keys} backend={args.backend}")
+    print(f"lookup:              {lookup_us:.2f} us/request")
+    print(f"lookup + rate limit: {full_us:.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
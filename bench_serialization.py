@@ -0,0 +1,117 @@
+"""
+Benchmark for generation response serialization
+
+Compares the default path (validated models, FastAPI response_model
+serialization and JSONResponse), the fast path (model_construct and orjson
+via ImageJSONResponse) and the streaming path (ImageStreamingResponse) for
+n=1..10 at each image size, reporting encode time and peak Python
+allocation per response.
+
+Usage:
+    python bench_serialization.py [--iterations 5] [--sizes 1024x1024,1536x1024]
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+import time
+import tracemalloc
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.schemas.image import ImageData, ImageGenerationResponse, UsageInfo
+from app.utils.json_response import ImageJSONResponse, stream_response
+
+# Rough size of a generated PNG per pixel; real images vary with content
+PNG_BYTES_PER_PIXEL = 1.5
+
+RESPONSE_FIELD = create_response_field(name="Response_create_image", type_=ImageGenerationResponse)
+
+
+def make_payload(size: str) -> str:
+    width, height = (int(v) for v in size.split("x"))
+    return base64.b64encode(os.urandom(int(width * height * PNG_BYTES_PER_PIXEL))).decode("ascii")
+
+
+def default_path(payloads, size: str) -> bytes:
+    response = ImageGenerationResponse(
+        id="img_1", created=1, model="gpt-image-1",
+        images=[ImageData(b64_json=p, filetype="png", size=size) for p in payloads],
+        usage=UsageInfo(prompt_tokens=10, image_tokens=1056, total_tokens=1066),
+    )
+    content = asyncio.run(serialize_response(field=RESPONSE_FIELD, response_content=response, is_coroutine=True))
+    return JSONResponse(content).body
+
+
+def fast_path(payloads, size: str) -> bytes:
+    response = ImageGenerationResponse.model_construct(
+        id="img_1", created=1, model="gpt-image-1",
+        images=[ImageData.model_construct(b64_json=p, filetype="png", size=size) for p in payloads],
+        usage=UsageInfo(prompt_tokens=10, image_tokens=1056, total_tokens=1066),
+    )
+    return ImageJSONResponse(response).body
+
+
+def stream_path(payloads, size: str) -> int:
+    response = ImageGenerationResponse.model_construct(
+        id="img_1", created=1, model="gpt-image-1",
+        images=[ImageData.model_construct(b64_json=p, filetype="png", size=size) for p in payloads],
+        usage=UsageInfo(prompt_tokens=10, image_tokens=1056, total_tokens=1066),
+    )
+
+    async def drain() -> int:
+        # Stand-in for the socket: each chunk is dropped once "sent"
+        sent = 0
+        async for chunk in stream_response(response, 256 * 1024):
+            sent += len(chunk)
+        return sent
+
+    return asyncio.run(drain())
+
+
+def measure(path, payloads, size: str, iterations: int):
+    """Return (mean seconds, peak allocated bytes) for one encode"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        path(payloads, size)
+    elapsed = (time.perf_counter() - start) / iterations
+
+    tracemalloc.start()
+    path(payloads, size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark response serialization")
+    parser.add_argument("--iterations", type=int, default=5, help="Timed encodes per case")
+    parser.add_argument("--sizes", default="1024x1024,1024x1536,1536x1024", help="Comma-separated image sizes")
+    parser.add_argument("--n", default="1,2,5,10", help="Comma-separated image counts")
+    args = parser.parse_args()
+
+    print(
+        f"{'size':>10} {'n':>3} {'MB':>7} | {'default ms':>10} {'peak MB':>8} | "
+        f"{'fast ms':>8} {'peak MB':>8} | {'stream ms':>9} {'peak MB':>8}"
+    )
+    for size in args.sizes.split(","):
+        payload = make_payload(size)
+        for n in (int(v) for v in args.n.split(",")):
+            payloads = [payload] * n
+            assert default_path(payloads, size) == fast_path(payloads, size)
+            slow_s, slow_peak = measure(default_path, payloads, size, args.iterations)
+            fast_s, fast_peak = measure(fast_path, payloads, size, args.iterations)
+            stream_s, stream_peak = measure(stream_path, payloads, size, args.iterations)
+            print(
+                f"{size:>10} {n:>3} {len(payload) * n / 1e6:>7.1f} | "
+                f"{slow_s * 1000:>10.1f} {slow_peak / 1e6:>8.1f} | "
+                f"{fast_s * 1000:>8.1f} {fast_peak / 1e6:>8.1f} | "
+                f"{stream_s * 1000:>9.1f} {stream_peak / 1e6:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
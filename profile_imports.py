@@ -0,0 +1,90 @@
+"""
+Import-time profile of the application
+
+Runs ``python -X importtime`` on a fresh interpreter and reports the
+slowest top-level imports (cumulative, including their dependencies) and
+the slowest individual modules (self time), followed by the cold start
+time: import plus the first ``/health`` response.
+
+Usage:
+    python profile_imports.py [--module app.main] [--top 15]
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+from typing import List, Tuple
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+COLD_START = """
+import time
+start = time.perf_counter()
+from {module} import app
+from fastapi.testclient import TestClient
+imported = time.perf_counter()
+response = TestClient(app).get("/health")
+assert response.status_code == 200, response.text
+print(imported - start, time.perf_counter() - start)
+"""
+
+
+def import_profile(module: str) -> List[Tuple[int, int, int, str]]:
+    """(self_us, cumulative_us, depth, name) for every module imported by ``module``"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        depth = len(indent) // 2
+        if depth == 0 and name != module:
+            # Interpreter startup (site, encodings, ...) rather than the module
+            rows = []
+            continue
+        rows.append((int(self_us), int(cumulative_us), depth, name))
+    return rows
+
+
+def cold_start(module: str) -> Tuple[float, float]:
+    """Seconds to import ``module`` and to serve its first /health, in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-c", COLD_START.format(module=module)],
+        capture_output=True, text=True, check=True,
+    )
+    imported, first_response = result.stdout.split()[-2:]
+    return float(imported), float(first_response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--module", default="app.main", help="Module to profile")
+    parser.add_argument("--top", type=int, default=15, help="Rows per table")
+    args = parser.parse_args()
+
+    rows = import_profile(args.module)
+    total_us = sum(self_us for self_us, _, _, _ in rows)
+
+    # Depth 1 is what the module (or its parent packages) import directly,
+    # which is where the cost can be cut
+    top_level = sorted((r for r in rows if r[2] == 1), key=lambda r: r[1], reverse=True)
+    print(f"Importing {args.module}: {total_us / 1000:.0f} ms over {len(rows)} modules\n")
+    print(f"{'cumulative ms':>14}  top-level import")
+    for _, cumulative_us, _, name in top_level[:args.top]:
+        print(f"{cumulative_us / 1000:>14.1f}  {name}")
+
+    print(f"\n{'self ms':>14}  module")
+    for self_us, _, _, name in sorted(rows, reverse=True)[:args.top]:
+        print(f"{self_us / 1000:>14.1f}  {name}")
+
+    imported, first_response = cold_start(args.module)
+    print(f"\nCold start: import {imported * 1000:.0f} ms, first /health response at {first_response * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Traffic replay tool
+
+Replays recorded request logs (the service's JSONL request log, including
+rotated .jsonl.gz files) against a running instance, preserving the
+original inter-arrival times or compressing them by a speed-up factor, and
+reports throughput, latency percentiles and error rates.
+
+Requests that were rejected by the original instance (403/429) are skipped.
+Each request is replayed as the client sent it: for ``model: auto`` requests
+that is the logged ``client_request`` over the routed request, so the
+target's model router runs again. At most ``--concurrency`` requests are in
+flight; when that bound delays a send past its offset, the lag is reported.
+Each tenant is replayed with its own key when ``--key-map`` maps the logged
+``key_id`` to a plaintext key; unmapped tenants share ``--api-key``, which
+collapses them into one rate-limit bucket on the target.
+
+Usage:
+    python replay_traffic.py logs/requests.jsonl --target http://127.0.0.1:8000 --speed 10 \
+        --concurrency 64 --key-map replay_keys.json
+
+Fully offline: run the service against upstream_stub.py.
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+# Logged outcomes that were rejected before generation and would only replay as rejections
+SKIPPED_STATUSES = {403, 429}
+
+
+def load_requests(paths: List[str], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Read request log records in arrival order"""
+    records = []
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if "request" in record and "ts" in record and record.get("status") not in SKIPPED_STATUSES:
+                    records.append(record)
+    records.sort(key=lambda r: r["ts"])
+    return records[:limit] if limit else records
+
+
+def client_body(record: Dict[str, Any]) -> Dict[str, Any]:
+    """The request body the client originally sent (before model routing)"""
+    return {**record["request"], **record.get("client_request", {})}
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def load_key_map(path: Optional[str]) -> Dict[str, str]:
+    """Read a JSON object mapping logged key_id to the plaintext key to replay with"""
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+async def replay(
+    records: List[Dict[str, Any]],
+    target: str,
+    speed: float,
+    api_key: Optional[str],
+    key_map: Dict[str, str],
+    timeout: float,
+    concurrency: int,
+) -> Dict[str, Any]:
+    """
+    Send every record at its (scaled) original offset and collect results.
+
+    Sends are started one by one in log order, so only in-flight requests
+    exist as tasks, and never more than ``concurrency`` of them.
+    """
+    url = f"{target.rstrip('/')}/api/v1/generate/"
+    results: List[Dict[str, Any]] = []
+    slots = asyncio.Semaphore(concurrency)
+    lags: List[float] = []
+
+    async with httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def send(record: Dict[str, Any]) -> None:
+            key = key_map.get(record.get("key_id"), api_key)
+            headers = {"x-api-key": key} if key else {}
+            start = time.perf_counter()
+            try:
+                response = await client.post(url, json=client_body(record), headers=headers)
+                # Drain the body so latency includes the full transfer
+                await response.aread()
+                status = response.status_code
+                cache = response.headers.get("x-cache")
+            except httpx.HTTPError as e:
+                status, cache = type(e).__name__, None
+            finally:
+                slots.release()
+            results.append({"status": status, "latency": time.perf_counter() - start, "cache": cache})
+
+        first = records[0]["ts"] if records else 0.0
+        started = time.perf_counter()
+        tasks = set()
+        for record in records:
+            offset = (record["ts"] - first) / speed if speed > 0 else 0.0
+            delay = started + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await slots.acquire()
+            lags.append(max(0.0, time.perf_counter() - started - offset))
+            task = asyncio.create_task(send(record))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    report = summarize(results, elapsed)
+    # How far sends fell behind their logged offsets (concurrency bound or a slow client)
+    report["send_lag_seconds"] = {"p99": round(percentile(lags, 0.99), 4), "max": round(max(lags, default=0.0), 4)}
+    return report
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    ok = [r["latency"] for r in results if r["status"] == 200]
+    statuses = Counter(str(r["status"]) for r in results)
+    total = len(results)
+    # Only present when the instance has the result cache enabled
+    cached = [r["cache"] for r in results if r.get("cache")]
+    return {
+        "requests": total,
+        "duration_seconds": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 3) if elapsed else 0.0,
+        "success_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "error_rate": round(1 - len(ok) / total, 4) if total else 0.0,
+        "status_counts": dict(statuses),
+        "cache_hit_ratio": round(sum(c in ("HIT", "NEAR") for c in cached) / len(cached), 4) if cached else None,
+        "latency_seconds": {
+            "p50": round(percentile(ok, 0.50), 4),
+            "p90": round(percentile(ok, 0.90), 4),
+            "p95": round(percentile(ok, 0.95), 4),
+            "p99": round(percentile(ok, 0.99), 4),
+            "max": round(max(ok), 4) if ok else 0.0,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded request logs against a service instance")
+    parser.add_argument("logs", nargs="+", help="Request log files (.jsonl or .jsonl.gz)")
+    parser.add_argument("--target", default="http://127.0.0.1:8000", help="Base URL of the instance under test")
+    parser.add_argument("--speed", type=float, default=1.0, help="Speed-up factor for inter-arrival times (0 = all at once)")
+    parser.add_argument("--api-key", default=None, help="API key for tenants missing from --key-map")
+    parser.add_argument("--key-map", default=None, help="JSON file mapping logged key_id to the API key to replay with")
+    parser.add_argument("--concurrency", type=int, default=64, help="Most requests in flight at once")
+    parser.add_argument("--limit", type=int, default=None, help="Replay only the first N requests")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request timeout in seconds")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    records = load_requests(args.logs, args.limit)
+    if not records:
+        print("No requests found in the given logs")
+        return
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"Replaying {len(records)} requests spanning {span:.1f}s at {args.speed}x against {args.target}")
+
+    key_map = load_key_map(args.key_map)
+    report = asyncio.run(replay(records, args.target, args.speed, args.api_key, key_map, args.timeout, args.concurrency))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"Requests:        {report['requests']} in {report['duration_seconds']}s")
+    print(f"Throughput:      {report['throughput_rps']} req/s ({report['success_rps']} successful)")
+    print(f"Error rate:      {report['error_rate']:.2%}  {report['status_counts']}")
+    if report["cache_hit_ratio"] is not None:
+        print(f"Cache hit ratio: {report['cache_hit_ratio']:.2%}")
+    latency = report["latency_seconds"]
+    print(f"Latency (s):     p50={latency['p50']} p90={latency['p90']} p95={latency['p95']} p99={latency['p99']} max={latency['max']}")
+    lag = report["send_lag_seconds"]
+    print(f"Send lag (s):    p99={lag['p99']} max={lag['max']}")
+
+
+if __name__ == "__main__":
+    main()
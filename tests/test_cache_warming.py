@@ -0,0 +1,127 @@
+"""
+Unit tests for off-peak cache warming
+"""
+import asyncio
+import gzip
+import json
+import time
+
+import pytest
+
+import app.services.cache_warming as cache_warming
+from app.schemas.image import ImageData, ImageGenerationRequest, ImageGenerationResponse, UsageInfo
+from app.services.cache_warming import CacheWarmer, log_files, popular_requests, window_start
+from app.services.result_cache import ClusterMembership, LocalResultCache, ResultCache, cache_key
+from app.services.usage_ledger import estimate_request_cost
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def test_window_start():
+    midnight = 100 * DAY
+    assert window_start(midnight + 3 * HOUR, 2, 5) == midnight + 2 * HOUR
+    assert window_start(midnight + 5 * HOUR, 2, 5) is None
+    # Windows may wrap past midnight
+    assert window_start(midnight + 23 * HOUR, 22, 4) == midnight + 22 * HOUR
+    assert window_start(midnight + 1 * HOUR, 22, 4) == midnight - 2 * HOUR
+    assert window_start(midnight + 12 * HOUR, 22, 4) is None
+
+
+def _record(prompt, ts, status=200, **fields):
+    return {"ts": ts, "status": status, "request": ImageGenerationRequest(prompt=prompt, **fields).model_dump(mode="json")}
+
+
+@pytest.fixture
+def logs(tmp_path):
+    now = time.time()
+    path = tmp_path / "requests.jsonl"
+    archive = tmp_path / "requests-20240101-000000-abcdef.jsonl.gz"
+    with gzip.open(archive, "wt", encoding="utf-8") as f:
+        for _ in range(3):
+            f.write(json.dumps(_record("A castle at dawn", now - 2 * HOUR)) + "\n")
+        # Too old to count
+        f.write(json.dumps(_record("Sunset over the sea", now - 10 * DAY)) + "\n")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(_record("a castle, at dawn!", now - HOUR)) + "\n")
+        for _ in range(2):
+            f.write(json.dumps(_record("Sunset over the sea", now - HOUR)) + "\n")
+        f.write(json.dumps(_record("Sunset over the sea", now - HOUR, status=429)) + "\n")
+        f.write(json.dumps(_record("A cat", now - HOUR, size="1536x1024")) + "\n")
+        f.write("not json\n")
+    return str(path)
+
+
+def test_popular_requests_are_mined_from_current_and_rotated_logs(logs):
+    assert len(log_files(logs)) == 2
+    popular = popular_requests(log_files(logs), time.time() - DAY, limit=10, min_count=1)
+    assert [(p["request"].prompt, p["count"]) for p in popular] == [
+        ("A castle at dawn", 4), ("Sunset over the sea", 2), ("A cat", 1),
+    ]
+    assert [p["count"] for p in popular_requests(log_files(logs), time.time() - DAY, 10, min_count=2)] == [4, 2]
+    assert len(popular_requests(log_files(logs), time.time() - DAY, limit=1, min_count=1)) == 1
+
+
+@pytest.fixture
+def warmer(logs, monkeypatch):
+    calls = []
+
+    async def fake_generate(request, deadline=None):
+        calls.append(request.prompt)
+        image = ImageData(b64_json="aGVsbG8=", filetype="png", size=request.size.value)
+        usage = UsageInfo(prompt_tokens=10, image_tokens=1056, total_tokens=1066)
+        return ImageGenerationResponse(id="gen", created=1000, images=[image], model="gpt-image-1", usage=usage)
+
+    monkeypatch.setattr(cache_warming, "generate_image", fake_generate)
+    monkeypatch.setattr(cache_warming, "record_generation", lambda *args: None)
+    monkeypatch.setattr(cache_warming.settings, "CACHE_WARMING_MIN_REQUESTS", 2)
+    cache = ResultCache(LocalResultCache(1024 * 1024, 3600), ClusterMembership(None, []), 0.5, None)
+    warmer = CacheWarmer(cache, logs)
+    warmer.calls = calls
+    return warmer
+
+
+def test_popular_results_are_warmed_and_their_hits_reported(warmer):
+    report = asyncio.run(warmer.run())
+    assert (report["candidates"], report["warmed"], report["stopped"]) == (2, 2, "done")
+    assert report["spent_usd"] == pytest.approx(2 * (10 * 5 + 1056 * 40) / 1_000_000)
+    assert warmer.calls == ["A castle at dawn", "Sunset over the sea"]
+
+    response, outcome = asyncio.run(warmer.cache.lookup(ImageGenerationRequest(prompt="A CASTLE AT DAWN")))
+    assert outcome == "hit"
+    metrics = warmer.metrics()
+    assert (metrics["warmed_entries"], metrics["entries_hit"], metrics["hits"]) == (2, 1, 1)
+    assert metrics["entries"][0]["prompt"] == "A castle at dawn"
+    assert metrics["entries"][0]["requests"] == 4
+
+    # Cached results are not generated again
+    report = asyncio.run(warmer.run())
+    assert (report["already_cached"], report["warmed"]) == (2, 0)
+    assert len(warmer.calls) == 2
+
+
+def test_spend_budget_is_respected(warmer, monkeypatch):
+    one = estimate_request_cost(ImageGenerationRequest(prompt="A castle at dawn"))
+    monkeypatch.setattr(cache_warming.settings, "CACHE_WARMING_BUDGET_USD", one * 1.5)
+    report = asyncio.run(warmer.run())
+    assert (report["warmed"], report["stopped"]) == (1, "budget")
+
+
+def test_live_traffic_wins(warmer, monkeypatch):
+    monkeypatch.setattr(cache_warming, "load_score", lambda: 5.0)
+    monkeypatch.setattr(cache_warming.settings, "CACHE_WARMING_POLL_SECONDS", 0.01)
+    # A window that is long over
+    report = asyncio.run(warmer.run(window=0.0))
+    assert (report["warmed"], report["stopped"]) == (0, "window closed")
+    assert warmer.calls == []
+
+
+def test_nodes_only_warm_keys_they_own(warmer):
+    warmer.cache.membership = ClusterMembership("http://a:8000", ["http://b:8000"])
+    report = asyncio.run(warmer.run())
+    owned = [
+        p for p in ("A castle at dawn", "Sunset over the sea")
+        if warmer.cache.owns(cache_key(ImageGenerationRequest(prompt=p)))
+    ]
+    assert warmer.calls == owned
+    assert report["not_owned"] == 2 - len(owned)
@@ -0,0 +1,107 @@
+"""
+Unit tests for client disconnect cancellation
+"""
+import asyncio
+import json
+
+import pytest
+
+from app.services.cancellation import CancellationStats, ClientDisconnected, cancel_on_disconnect
+
+
+def _receive_disconnect_after(delay: float):
+    async def receive():
+        await asyncio.sleep(delay)
+        return {"type": "http.disconnect"}
+    return receive
+
+
+def test_returns_result_when_client_stays():
+    async def work():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    assert asyncio.run(cancel_on_disconnect(work(), _receive_disconnect_after(10))) == "done"
+
+
+def test_cancels_work_when_client_leaves():
+    state = {}
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    with pytest.raises(ClientDisconnected):
+        asyncio.run(cancel_on_disconnect(work(), _receive_disconnect_after(0.01)))
+    assert state == {"cancelled": True}
+
+
+def test_work_errors_propagate():
+    async def work():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        asyncio.run(cancel_on_disconnect(work(), _receive_disconnect_after(10)))
+
+
+def test_stats_separate_avoided_from_aborted_work():
+    stats = CancellationStats()
+    stats.record("queue", images=2, tokens=2000)
+    stats.record("generate", images=3, tokens=3000)
+    stats.record("respond", images=1, tokens=1000)
+
+    metrics = stats.metrics()
+    assert metrics["cancelled"] == {"queue": 1, "generate": 1, "respond": 1, "total": 3}
+    assert (metrics["avoided_images"], metrics["avoided_tokens"]) == (2, 2000)
+    assert metrics["aborted_images"] == 3
+
+
+def test_disconnect_during_generation_frees_resources(monkeypatch):
+    import app.api.v1.endpoints.generate as generate
+    from app.main import app
+    from app.services.memory_budget import memory_budget
+    from app.services.scheduler import scheduler
+
+    upstream = {}
+
+    async def slow_generate(request, deadline=None):
+        upstream["started"] = True
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            upstream["cancelled"] = True
+            raise
+
+    monkeypatch.setattr(generate, "generate_image", slow_generate)
+    monkeypatch.setattr(generate, "cancellation_stats", CancellationStats())
+    body = json.dumps({"prompt": "A castle"}).encode()
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        # The client hangs up while the image is being generated
+        while "started" not in upstream:
+            await asyncio.sleep(0.01)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/api/v1/generate/", "raw_path": b"/api/v1/generate/", "root_path": "",
+        "query_string": b"", "headers": [(b"content-type", b"application/json")],
+        "client": ("test", 1), "server": ("test", 80),
+    }
+    asyncio.run(app(scope, receive, send))
+
+    assert upstream == {"started": True, "cancelled": True}
+    assert sent[0]["status"] == 499
+    assert scheduler.in_flight == 0
+    assert memory_budget.in_flight_bytes == 0
+    assert generate.cancellation_stats.cancelled["generate"] == 1
@@ -0,0 +1,49 @@
+"""
+Startup budget: importing the app and serving the first /health must stay cheap
+
+Runs in a fresh interpreter so that modules imported by other tests do not
+hide the cost. Override the budget with COLD_START_BUDGET_SECONDS on slow
+machines.
+"""
+import os
+import subprocess
+import sys
+
+COLD_START_BUDGET_SECONDS = float(os.getenv("COLD_START_BUDGET_SECONDS", "2.0"))
+
+# Dependencies that only the doc pages or the first upstream call need
+DEFERRED_MODULES = ("openai", "markdown", "jinja2")
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+from app.main import app
+deferred = [m for m in {deferred!r} if m in sys.modules]
+from fastapi.testclient import TestClient
+response = TestClient(app).get("/health")
+print(response.status_code, time.perf_counter() - start, ",".join(deferred) or "-")
+"""
+
+
+def _cold_start():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(deferred=DEFERRED_MODULES)],
+        capture_output=True, text=True, check=True, cwd=root,
+    )
+    status, seconds, deferred = result.stdout.split()[-3:]
+    return int(status), float(seconds), deferred
+
+
+def test_cold_import_and_first_health_within_budget():
+    status, seconds, _ = _cold_start()
+    assert status == 200
+    assert seconds < COLD_START_BUDGET_SECONDS, (
+        f"Cold import + first /health took {seconds:.2f}s (budget {COLD_START_BUDGET_SECONDS}s); "
+        "run `python profile_imports.py` to see what got slower"
+    )
+
+
+def test_heavy_dependencies_are_not_imported_eagerly():
+    _, _, deferred = _cold_start()
+    assert deferred == "-", f"Imported at app import time: {deferred}"
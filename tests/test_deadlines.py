@@ -0,0 +1,96 @@
+"""
+Unit tests for request deadlines and the latency model
+"""
+import asyncio
+
+import pytest
+
+from app.schemas.image import ImageGenerationRequest
+from app.services.deadlines import Deadline, DeadlineExceeded, LatencyModel
+from app.services.scheduler import PriorityClass, Scheduler, SchedulerTimeout
+from app.services.upstream_pool import UpstreamPool
+
+
+def _request(**fields) -> ImageGenerationRequest:
+    return ImageGenerationRequest(prompt="A castle", **fields)
+
+
+def test_deadline_budget():
+    assert Deadline().remaining() is None
+    assert not Deadline().expired(reserve=1000)
+
+    deadline = Deadline(10)
+    assert 9 < deadline.remaining() <= 10
+    assert 4 < deadline.budget(reserve=5) <= 5
+    assert not deadline.expired(reserve=5)
+    assert deadline.expired(reserve=11)
+
+
+def test_latency_model_needs_samples_per_shape():
+    model = LatencyModel(alpha=0.1, z=1.28, min_samples=3)
+    for _ in range(2):
+        model.observe(_request(n=1), 10.0)
+    assert model.predict(_request(n=1)) is None
+
+    model.observe(_request(n=1), 10.0)
+    assert model.predict(_request(n=1)) == pytest.approx(10.0)
+    # Other shapes are tracked separately
+    assert model.predict(_request(n=2)) is None
+    assert model.predict(_request(n=1, size="1536x1024")) is None
+
+
+def test_latency_model_predicts_above_the_mean_for_noisy_latency():
+    model = LatencyModel(alpha=0.1, z=1.28, min_samples=5)
+    for seconds in [8.0, 12.0] * 50:
+        model.observe(_request(), seconds)
+    predicted = model.predict(_request())
+    assert 12.0 < predicted < 13.5
+
+    shape = model.metrics()["shapes"][0]
+    assert shape["samples"] == 100
+    assert 9.0 < shape["mean_seconds"] < 11.0
+
+
+def test_scheduler_wait_is_capped_by_max_wait():
+    async def scenario():
+        scheduler = Scheduler(1, {"interactive": 60.0}, 60.0)
+        await scheduler.acquire("holder", PriorityClass.INTERACTIVE)
+        with pytest.raises(SchedulerTimeout):
+            await asyncio.wait_for(scheduler.acquire("k", PriorityClass.INTERACTIVE, max_wait=0.01), timeout=1.0)
+
+    asyncio.run(scenario())
+
+
+def test_pool_does_not_start_calls_after_the_deadline():
+    calls = []
+
+    async def operation(client):
+        calls.append(client)
+
+    deadline = Deadline(0)
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(UpstreamPool([]).run(operation, deadline))
+    assert calls == []
+
+
+def test_request_that_cannot_finish_in_time_is_rejected_early(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import app.api.v1.endpoints.generate as generate
+    from app.main import app
+
+    model = LatencyModel(alpha=0.1, z=1.28, min_samples=1)
+    model.observe(_request(), 30.0)
+    calls = []
+
+    async def fake_generate(request, deadline=None):
+        calls.append(request)
+
+    monkeypatch.setattr(generate, "latency_model", model)
+    monkeypatch.setattr(generate, "generate_image", fake_generate)
+    client = TestClient(app)
+    response = client.post("/api/v1/generate/", json={"prompt": "A castle"}, headers={"x-deadline-ms": "5000"})
+
+    assert response.status_code == 504
+    assert calls == []
+    assert model.rejected_early == 1
@@ -0,0 +1,149 @@
+"""
+Unit tests for the generation history
+"""
+import asyncio
+import base64
+import os
+
+import pytest
+
+from app.schemas.image import ImageData
+from app.services.history import GenerationHistory, HistoryEntry, InvalidCursor, match_query
+
+PNG = b"\x89PNG\r\n\x1a\nfake"
+
+
+def _entry(request_id: str, prompt: str, created: float, key_id: str = "k1", model: str = "gpt-image-1", n: int = 1):
+    image = ImageData(b64_json=base64.b64encode(PNG).decode(), filetype="png", size="1024x1024")
+    return HistoryEntry(request_id, key_id, created, model, "1024x1024", "medium", "png", prompt, [image] * n)
+
+
+@pytest.fixture
+def history(tmp_path):
+    store = GenerationHistory(str(tmp_path / "history.db"), str(tmp_path / "images"))
+
+    async def fill():
+        await store.save(_entry("aa01", "A castle on a cliff at dawn", 100.0, n=2))
+        await store.save(_entry("aa02", "A cat in a castle", 200.0, model="dall-e-3"))
+        await store.save(_entry("aa03", "Sunset over the sea", 300.0))
+        await store.save(_entry("aa04", "Castles in the sky", 300.0, key_id="k2"))
+
+    asyncio.run(fill())
+    return store
+
+
+def test_images_are_stored_on_disk(history):
+    with open(history.image_path("aa01", 1, "png"), "rb") as f:
+        assert f.read() == PNG
+    assert history.saved == 4
+    # The database only holds metadata
+    assert os.path.getsize(history.path) < 64 * 1024
+
+
+def test_full_text_search_matches_word_prefixes(history):
+    items, _ = asyncio.run(history.search(text="castle"))
+    assert [i["request_id"] for i in items] == ["aa04", "aa02", "aa01"]
+
+    items, _ = asyncio.run(history.search(key_id="k1", text="castle dawn"))
+    assert [i["request_id"] for i in items] == ["aa01"]
+    assert items[0]["images"] == 2
+
+
+def test_filters(history):
+    items, _ = asyncio.run(history.search(model="dall-e-3"))
+    assert [i["request_id"] for i in items] == ["aa02"]
+
+    items, _ = asyncio.run(history.search(key_id="k1", since=150.0, until=300.0))
+    assert [i["request_id"] for i in items] == ["aa02"]
+
+
+def test_keyset_pagination_visits_every_row_once(history):
+    seen, cursor = [], None
+    while True:
+        items, cursor = asyncio.run(history.search(limit=1, cursor=cursor))
+        seen.extend(i["request_id"] for i in items)
+        if cursor is None:
+            break
+    # Rows created in the same second are ordered by id
+    assert seen == ["aa04", "aa03", "aa02", "aa01"]
+
+
+def test_invalid_cursor(history):
+    with pytest.raises(InvalidCursor):
+        asyncio.run(history.search(cursor="not-a-cursor"))
+
+
+def test_search_text_is_matched_literally(history):
+    assert match_query('castle AND "sky') == '"castle"* "AND"* """sky"*'
+    items, _ = asyncio.run(history.search(text='castle OR (sky'))
+    assert items == []
+
+
+def test_key_queries_use_the_index(history):
+    conn = history._connect()
+    plan = " ".join(
+        str(row) for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM generations WHERE key_id = ? ORDER BY created DESC, id DESC LIMIT 20",
+            ("k1",),
+        )
+    )
+    conn.close()
+    assert "generations_key_created" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_generations_are_saved_and_served(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import app.api.v1.endpoints.generate as generate
+    import app.api.v1.endpoints.history as history_endpoint
+    from app.main import app
+    from app.schemas.image import ImageGenerationResponse
+
+    store = GenerationHistory(str(tmp_path / "history.db"), str(tmp_path / "images"))
+    monkeypatch.setattr(generate, "generation_history", store)
+    monkeypatch.setattr(history_endpoint, "generation_history", store)
+
+    async def fake_generate(request, deadline=None):
+        image = ImageData(b64_json=base64.b64encode(PNG).decode(), filetype="png", size="1024x1024")
+        return ImageGenerationResponse(id="gen-1", created=1000, images=[image], model="gpt-image-1")
+
+    monkeypatch.setattr(generate, "generate_image", fake_generate)
+    client = TestClient(app)
+    assert client.post("/api/v1/generate/", json={"prompt": "A castle at night"}).status_code == 200
+
+    page = client.get("/api/v1/history/", params={"q": "cast"}).json()
+    assert [item["prompt"] for item in page["data"]] == ["A castle at night"]
+    assert page["next_cursor"] is None
+
+    image = client.get(page["data"][0]["image_urls"][0])
+    assert image.status_code == 200
+    assert image.headers["content-type"] == "image/png"
+    assert image.content == PNG
+    assert client.get(page["data"][0]["image_urls"][0].replace("/0", "/1")).status_code == 404
+
+
+def test_cache_hits_are_not_saved_again(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import app.api.v1.endpoints.generate as generate
+    from app.main import app
+    from app.schemas.image import ImageGenerationResponse
+    from app.services.result_cache import ClusterMembership, LocalResultCache, ResultCache
+
+    store = GenerationHistory(str(tmp_path / "history.db"), str(tmp_path / "images"))
+    monkeypatch.setattr(generate, "generation_history", store)
+    monkeypatch.setattr(generate, "result_cache", ResultCache(LocalResultCache(1024, 60), ClusterMembership(None, []), 0.5, None))
+
+    async def fake_generate(request, deadline=None):
+        image = ImageData(b64_json=base64.b64encode(PNG).decode(), filetype="png", size="1024x1024")
+        return ImageGenerationResponse(id="gen-1", created=1000, images=[image], model="gpt-image-1")
+
+    monkeypatch.setattr(generate, "generate_image", fake_generate)
+    client = TestClient(app)
+    responses = [client.post("/api/v1/generate/", json={"prompt": "A castle at night"}) for _ in range(2)]
+    assert [r.headers["x-cache"] for r in responses] == ["MISS", "HIT"]
+
+    items, _ = asyncio.run(store.search())
+    assert len(items) == 1
+    assert store.saved == 1
@@ -0,0 +1,38 @@
+"""
+Unit tests for turning upstream results into generation responses
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import app.services.image_service as image_service
+from app.schemas.image import ImageGenerationRequest
+
+
+class FakePool:
+    def __init__(self, data):
+        self.result = SimpleNamespace(id="gen", data=data, usage=None)
+
+    async def run(self, operation, deadline=None, model=None):
+        return self.result
+
+
+def _generate(monkeypatch, data, model="gpt-image-1"):
+    monkeypatch.setattr(image_service, "reinitialize_client_if_needed", lambda: None)
+    monkeypatch.setattr(image_service, "get_client", lambda: FakePool(data))
+    return asyncio.run(image_service.generate_image(ImageGenerationRequest(model=model, prompt="castle")))
+
+
+@pytest.mark.parametrize("model", ["gpt-image-1", "dall-e-3"])
+def test_base64_images_are_passed_through(monkeypatch, model):
+    response = _generate(monkeypatch, [SimpleNamespace(b64_json="aGVsbG8=", url=None)], model)
+    assert [image.b64_json for image in response.images] == ["aGVsbG8="]
+
+
+@pytest.mark.parametrize("b64_json", [None, "", 123, b"aGVsbG8="])
+def test_malformed_image_data_is_an_upstream_error(monkeypatch, b64_json):
+    with pytest.raises(Exception, match="Image data missing"):
+        _generate(monkeypatch, [SimpleNamespace(b64_json=b64_json, url=None)])
+    with pytest.raises(Exception, match="Image data missing"):
+        _generate(monkeypatch, [SimpleNamespace()])
@@ -0,0 +1,69 @@
+"""
+Unit tests for the fast generation response encoder
+"""
+import asyncio
+import json
+
+from fastapi.encoders import jsonable_encoder
+
+from app.schemas.image import ImageData, ImageGenerationResponse, UsageInfo
+from app.utils.json_response import (
+    ImageJSONResponse,
+    ImageStreamingResponse,
+    encode_response,
+    image_response,
+    stream_response,
+)
+
+
+def _response(usage=None, payloads=("QUJD" * 10, "QUJD" * 10)) -> ImageGenerationResponse:
+    return ImageGenerationResponse.model_construct(
+        id="img_1", created=1700000000, model="gpt-image-1", usage=usage,
+        images=[ImageData.model_construct(b64_json=p, filetype="png", size="1024x1024") for p in payloads],
+    )
+
+
+async def _collect(chunks) -> list:
+    return [chunk async for chunk in chunks]
+
+
+def test_matches_default_serialization():
+    for usage in (None, UsageInfo(prompt_tokens=5, image_tokens=1056, total_tokens=1061)):
+        response = _response(usage)
+        expected = json.dumps(jsonable_encoder(response), separators=(",", ":")).encode("utf-8")
+        assert encode_response(response) == expected
+
+
+def test_response_sets_json_body_and_headers():
+    http_response = ImageJSONResponse(_response(), headers={"RateLimit-Remaining": "3"})
+    assert http_response.media_type == "application/json"
+    assert http_response.headers["ratelimit-remaining"] == "3"
+    assert ImageGenerationResponse.model_validate_json(http_response.body).images[0].b64_json == "QUJD" * 10
+
+
+def test_stream_matches_single_encode():
+    usage = UsageInfo(prompt_tokens=5, image_tokens=1056, total_tokens=1061)
+    cases = [
+        _response(usage),
+        _response(None, payloads=()),
+        _response(usage, payloads=("QUJD" * 100, 'not "base64" \\ é', "QQ==")),
+    ]
+    for response in cases:
+        expected = encode_response(response)
+        body = b"".join(asyncio.run(_collect(stream_response(response, chunk_bytes=7))))
+        assert body == expected
+
+
+def test_stream_writes_payload_in_chunks_and_releases_images():
+    response = _response(payloads=("A" * 100,))
+    chunks = asyncio.run(_collect(stream_response(response, chunk_bytes=30)))
+    assert chunks.count(b"A" * 30) == 3
+    assert b"A" * 10 in chunks
+    assert response.images == []
+
+
+def test_large_responses_are_streamed(monkeypatch):
+    from app.utils import json_response
+    monkeypatch.setattr(json_response.settings, "RESPONSE_STREAMING_MIN_BYTES", 50)
+    assert isinstance(image_response(_response(payloads=("A" * 40,))), ImageJSONResponse)
+    assert isinstance(image_response(_response(payloads=("A" * 40, "A" * 40))), ImageStreamingResponse)
@@ -0,0 +1,77 @@
+"""
+Unit tests for the API key registry
+"""
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.services.key_registry import (
+    ANONYMOUS_KEY, KeyRegistry, add_key, hash_api_key, load_records, revoke_key,
+)
+
+
+def _write_keys(path, keys):
+    path.write_text(json.dumps({"keys": keys}), encoding="utf-8")
+
+
+def test_keys_are_stored_and_looked_up_by_hash(tmp_path):
+    path = tmp_path / "keys.json"
+    _write_keys(path, [{"id": "alice", "key_hash": hash_api_key("sk-alice"), "models": ["dall-e-3"]}])
+    registry = KeyRegistry(str(path))
+    assert registry.reload()
+
+    record = registry.lookup("sk-alice")
+    assert record.key_id == "alice"
+    assert record.key_hash != "sk-alice"
+    assert record.allows_model("dall-e-3") and not record.allows_model("gpt-image-1")
+    assert registry.lookup("sk-mallory") is None
+    assert registry.lookup("") is None
+    assert registry.lookup(None) is None
+
+
+def test_hash_secret_changes_the_stored_hash(monkeypatch):
+    plain = hash_api_key("sk-alice")
+    monkeypatch.setattr("app.services.key_registry.settings.API_KEY_HASH_SECRET", "pepper")
+    assert hash_api_key("sk-alice") != plain
+    assert hash_api_key("sk-alice") == hash_api_key("sk-alice")
+
+
+def test_limits_default_only_when_missing(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.services.key_registry.settings.DEFAULT_REQUESTS_PER_MINUTE", 60)
+    path = tmp_path / "keys.json"
+    _write_keys(path, [
+        {"id": "default", "key_hash": "a"},
+        {"id": "unlimited", "key_hash": "b", "requests_per_minute": 0},
+    ])
+    records = {r.key_id: r for r in load_records(str(path))}
+    assert records["default"].requests_per_minute == 60
+    # An explicit 0 means unlimited rather than "use the default"
+    assert records["unlimited"].requests_per_minute == 0
+
+
+def test_reload_picks_up_added_and_revoked_keys(tmp_path):
+    path = str(tmp_path / "keys.db")
+    add_key(path, "alice", "sk-alice", requests_per_minute=10, admin=True)
+    registry = KeyRegistry(path)
+    assert registry.reload()
+    assert registry.lookup("sk-alice").admin
+    # Unchanged stores are not reloaded
+    assert not registry.reload()
+
+    add_key(path, "bob", "sk-bob")
+    assert revoke_key(path, "alice")
+    assert not revoke_key(path, "nobody")
+    assert registry.reload()
+    assert registry.lookup("sk-alice") is None
+    assert registry.lookup("sk-bob").key_id == "bob"
+    assert len(registry) == 1
+
+
+def test_anonymous_callers_are_not_admins():
+    assert not ANONYMOUS_KEY.admin
+    from app.main import app
+
+    client = TestClient(app)
+    assert client.get("/api/v1/metrics/").status_code == 403
+    assert client.get("/api/v1/profile/", params={"seconds": 0.1}).status_code == 403
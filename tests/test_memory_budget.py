@@ -0,0 +1,81 @@
+"""
+Unit tests for memory admission control
+"""
+import asyncio
+
+import pytest
+
+from app.schemas.image import ImageGenerationRequest
+from app.services.memory_budget import MemoryBudget, MemoryBudgetExceeded, estimate_request_bytes
+
+
+def test_estimate_scales_with_count_and_size():
+    small = estimate_request_bytes(ImageGenerationRequest(prompt="castle", size="1024x1024"))
+    assert estimate_request_bytes(ImageGenerationRequest(prompt="castle", size="1024x1024", n=10)) == pytest.approx(10 * small, rel=1e-6)
+    assert estimate_request_bytes(ImageGenerationRequest(prompt="castle", size="1536x1024")) == pytest.approx(1.5 * small, rel=1e-6)
+    assert estimate_request_bytes(ImageGenerationRequest(prompt="castle", size="auto")) == pytest.approx(1.5 * small, rel=1e-6)
+
+
+def test_admits_within_budget_and_queues_beyond_it():
+    async def scenario():
+        budget = MemoryBudget(budget_bytes=100, wait_seconds=5.0)
+        await budget.acquire(60)
+        waiter = asyncio.create_task(budget.acquire(60))
+        await asyncio.sleep(0)
+        assert budget.metrics()["waiting"] == 1 and not waiter.done()
+
+        budget.release(60)
+        await waiter
+        return budget.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert metrics["in_flight_bytes"] == 60
+    assert metrics["admitted"] == 2 and metrics["queued"] == 1
+    assert metrics["peak_bytes"] == 60
+
+
+def test_oversized_request_runs_alone():
+    async def scenario():
+        budget = MemoryBudget(budget_bytes=100, wait_seconds=5.0)
+        await budget.acquire(500)
+        small = asyncio.create_task(budget.acquire(1))
+        await asyncio.sleep(0)
+        blocked = not small.done()
+        budget.release(500)
+        await small
+        return blocked, budget.in_flight_bytes
+
+    assert asyncio.run(scenario()) == (True, 1)
+
+
+def test_rejects_after_wait_limit():
+    async def scenario():
+        budget = MemoryBudget(budget_bytes=100, wait_seconds=0.02)
+        await budget.acquire(80)
+        with pytest.raises(MemoryBudgetExceeded):
+            await budget.acquire(80)
+        return budget.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert metrics["rejected"] == 1
+    assert metrics["waiting"] == 0
+    assert metrics["in_flight_bytes"] == 80
+
+
+def test_leaving_head_of_queue_admits_those_behind():
+    async def scenario():
+        budget = MemoryBudget(budget_bytes=100, wait_seconds=5.0)
+        await budget.acquire(50)
+        big = asyncio.create_task(budget.acquire(80))
+        small = asyncio.create_task(budget.acquire(20))
+        await asyncio.sleep(0)
+        # FIFO: the small request waits behind the big one even though it fits
+        assert not small.done()
+
+        big.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await big
+        await small
+        return budget.in_flight_bytes, budget.metrics()["waiting"]
+
+    assert asyncio.run(scenario()) == (70, 0)
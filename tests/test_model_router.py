@@ -0,0 +1,199 @@
+"""
+Unit tests for automatic model selection
+"""
+import base64
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+from fastapi.testclient import TestClient
+
+import app.api.deps as deps
+import app.api.v1.endpoints.generate as generate
+import app.services.model_router as model_router_module
+import app.services.upstream_pool as upstream_pool
+from app.schemas.image import ImageData, ImageGenerationRequest, ImageGenerationResponse
+from app.services.deadlines import LatencyModel
+from app.services.key_registry import ApiKeyRecord
+from app.services.model_router import ModelRouter, NoEligibleModel
+from app.services.upstream_pool import UpstreamAccount, UpstreamPool
+
+ANY_KEY = ApiKeyRecord(key_id="k", key_hash="h")
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"upstream returned {status_code}")
+        self.status_code = status_code
+
+
+@pytest.fixture
+def router(monkeypatch):
+    router = ModelRouter(error_alpha=0.2, max_error_rate=0.5, min_requests=3, cooldown_seconds=30)
+    monkeypatch.setattr(model_router_module, "latency_model", LatencyModel(alpha=0.1, z=1.28, min_samples=2))
+    monkeypatch.setattr(deps, "model_router", router)
+    monkeypatch.setattr(generate, "model_router", router)
+    return router
+
+
+def _auto(**fields) -> ImageGenerationRequest:
+    return ImageGenerationRequest(model="auto", prompt="castle", **fields)
+
+
+def _route(router, request, key=ANY_KEY, deadline=None):
+    routed = router.route(request, key, deadline)
+    return routed.model.value, routed.size.value, routed.quality.value
+
+
+def _observe(model, seconds, size="1024x1024", quality="standard"):
+    request = ImageGenerationRequest(model=model, prompt="x", size=size, quality=quality)
+    for _ in range(3):
+        model_router_module.latency_model.observe(request, seconds)
+
+
+def test_cheap_tier_picks_the_cheapest_suitable_model(router):
+    assert _route(router, _auto()) == ("dall-e-2", "1024x1024", "standard")
+    # An auto size lets the router pick the size too
+    assert _route(router, _auto(size="auto")) == ("dall-e-2", "256x256", "standard")
+    # dall-e-2 cannot do landscape, and gpt-image-1 is cheaper there than dall-e-3
+    assert _route(router, _auto(size="1536x1024")) == ("gpt-image-1", "1536x1024", "medium")
+
+
+def test_requests_only_go_to_models_that_support_them(router):
+    assert _route(router, _auto(background="transparent")) == ("gpt-image-1", "1024x1024", "medium")
+    assert _route(router, _auto(quality="hd")) == ("dall-e-3", "1024x1024", "hd")
+    with pytest.raises(NoEligibleModel) as e:
+        router.route(_auto(quality="hd", background="transparent"), ANY_KEY)
+    assert not e.value.forbidden
+
+    key = ApiKeyRecord(key_id="k", key_hash="h", models=frozenset({"dall-e-3"}))
+    assert _route(router, _auto(), key) == ("dall-e-3", "1024x1024", "standard")
+    with pytest.raises(NoEligibleModel) as e:
+        router.route(_auto(n=2), key)
+    assert e.value.forbidden
+
+
+def test_fast_tier_uses_measured_latency(router):
+    # Priors: dall-e-2 is the fastest
+    assert _route(router, _auto(tier="fast"))[0] == "dall-e-2"
+    _observe("dall-e-2", 60.0)
+    _observe("gpt-image-1", 5.0, quality="medium")
+    assert _route(router, _auto(tier="fast"))[0] == "gpt-image-1"
+    # The cheap tier only avoids dall-e-2 when it would miss the deadline
+    assert _route(router, _auto())[0] == "dall-e-2"
+    assert _route(router, _auto(), deadline=30.0)[0] == "dall-e-3"
+
+
+def test_rate_limited_and_failing_models_are_skipped(router):
+    router.record("dall-e-2", UpstreamError(429))
+    assert not router.is_healthy("dall-e-2")
+    assert _route(router, _auto())[0] == "dall-e-3"
+
+    for _ in range(3):
+        router.record("dall-e-3", UpstreamError(500))
+    assert _route(router, _auto())[0] == "gpt-image-1"
+
+    # With every model in cooldown the best one is still used
+    router.record("gpt-image-1", UpstreamError(429))
+    assert _route(router, _auto())[0] == "dall-e-2"
+    metrics = router.metrics()["models"]
+    assert metrics["dall-e-2"]["throttled"] == 1
+    assert metrics["dall-e-3"]["errors"] == 3
+
+
+def test_one_failure_in_many_does_not_trip_the_cooldown(router):
+    for _ in range(5):
+        router.record("dall-e-2")
+    router.record("dall-e-2", UpstreamError(500))
+    assert router.is_healthy("dall-e-2")
+
+
+@pytest.fixture
+def client(router, monkeypatch):
+    calls = []
+
+    async def fake_generate(request, deadline=None):
+        calls.append(request.model.value)
+        if request.model.value == "dall-e-2":
+            raise UpstreamError(429)
+        image = ImageData(b64_json=base64.b64encode(b"png").decode(), filetype="png", size=request.size.value)
+        return ImageGenerationResponse(id="gen", created=1000, images=[image], model=request.model.value)
+
+    monkeypatch.setattr(generate, "generate_image", fake_generate)
+    from app.main import app
+
+    client = TestClient(app)
+    client.calls = calls
+    return client
+
+
+def test_routed_request_falls_back_to_another_model(client, router):
+    response = client.post("/api/v1/generate/", json={"model": "auto", "prompt": "castle"})
+    assert response.status_code == 200
+    assert response.json()["model"] == "dall-e-3"
+    assert client.calls == ["dall-e-2", "dall-e-3"]
+    assert router.fallbacks == 1
+
+    # dall-e-2 is now rate limited and skipped up front
+    client.calls.clear()
+    assert client.post("/api/v1/generate/", json={"model": "auto", "prompt": "sea"}).json()["model"] == "dall-e-3"
+    assert client.calls == ["dall-e-3"]
+
+
+def test_single_account_rate_limit_falls_back_through_the_pool(router, monkeypatch):
+    # One upstream account: a 429 on the primary model must not take the account
+    # out for the fallback model too
+    import app.services.image_service as image_service
+
+    clock = SimpleNamespace(now=1000.0)
+    clock.monotonic = lambda: clock.now
+    monkeypatch.setattr(model_router_module, "time", clock)
+    monkeypatch.setattr(upstream_pool, "time", clock)
+    pool = UpstreamPool([UpstreamAccount("only", "sk-test", base_url="http://upstream.test")])
+    calls = []
+
+    async def images_generate(model, **params):
+        calls.append(model)
+        if model == "dall-e-2":
+            response = httpx.Response(
+                429, headers={"retry-after": "60"}, request=httpx.Request("POST", "http://upstream.test")
+            )
+            raise openai.RateLimitError("rate limited", response=response, body=None)
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=base64.b64encode(b"png").decode())], usage=None)
+
+    monkeypatch.setattr(pool.accounts[0].client.images, "generate", images_generate)
+    monkeypatch.setattr(image_service, "reinitialize_client_if_needed", lambda: None)
+    monkeypatch.setattr(image_service, "get_client", lambda: pool)
+    from app.main import app
+
+    client = TestClient(app)
+    response = client.post("/api/v1/generate/", json={"model": "auto", "prompt": "castle"})
+    assert response.status_code == 200
+    assert response.json()["model"] == "dall-e-3"
+    assert calls == ["dall-e-2", "dall-e-3"]
+    assert router.fallbacks == 1
+
+    # Once the router's cooldown ends the pool still has no account for dall-e-2,
+    # which is an upstream failure too
+    clock.now += 31
+    calls.clear()
+    response = client.post("/api/v1/generate/", json={"model": "auto", "prompt": "sea"})
+    assert response.status_code == 200
+    assert response.json()["model"] == "dall-e-3"
+    assert calls == ["dall-e-3"]
+    assert router.fallbacks == 2
+
+
+def test_explicit_models_are_never_swapped(client):
+    response = client.post("/api/v1/generate/", json={"model": "dall-e-2", "prompt": "castle", "tier": "fast"})
+    assert response.status_code == 500
+    assert client.calls == ["dall-e-2"]
+
+
+def test_unsatisfiable_auto_request(client):
+    response = client.post(
+        "/api/v1/generate/", json={"model": "auto", "prompt": "castle", "quality": "hd", "background": "transparent"}
+    )
+    assert response.status_code == 422
+    assert client.calls == []
@@ -0,0 +1,77 @@
+"""
+Unit tests for the event-loop lag monitor and the sampling profiler
+"""
+import asyncio
+import time
+
+import pytest
+
+from app.services.profiling import LoopLagMonitor, ProfilerBusy, SamplingProfiler
+
+
+def _block_the_loop(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+def test_lag_monitor_records_the_blocking_stack():
+    monitor = LoopLagMonitor(interval=0.01, threshold=0.05, keep=10)
+
+    async def scenario():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        _block_the_loop(0.3)
+        await asyncio.sleep(0.05)
+        monitor.stop()
+
+    asyncio.run(scenario())
+
+    assert monitor.slow >= 1
+    event = monitor.events[0]
+    assert event["lag_ms"] >= 200
+    assert any(frame.startswith("_block_the_loop ") for frame in event["stack"])
+    assert monitor.metrics()["max_lag_ms"] >= 200
+
+
+def test_lag_monitor_is_quiet_when_the_loop_is_responsive():
+    monitor = LoopLagMonitor(interval=0.01, threshold=0.1, keep=10)
+
+    async def scenario():
+        monitor.start()
+        await asyncio.sleep(0.2)
+        monitor.stop()
+
+    asyncio.run(scenario())
+    assert monitor.ticks > 5
+    assert monitor.slow == 0
+
+
+def test_profiler_returns_collapsed_stacks_of_the_loop():
+    profiler = SamplingProfiler()
+
+    async def scenario():
+        profiling = asyncio.create_task(profiler.profile(0.3, 0.005))
+        await asyncio.sleep(0.05)
+        _block_the_loop(0.15)
+        return await profiling
+
+    collapsed = asyncio.run(scenario())
+    lines = collapsed.splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+    assert any("_block_the_loop " in line for line in lines)
+    assert profiler.running is False
+
+
+def test_only_one_profile_runs_at_a_time():
+    profiler = SamplingProfiler()
+
+    async def scenario():
+        first = asyncio.create_task(profiler.profile(0.1, 0.01))
+        await asyncio.sleep(0)
+        with pytest.raises(ProfilerBusy):
+            await profiler.profile(0.1, 0.01)
+        await first
+
+    asyncio.run(scenario())
@@ -0,0 +1,62 @@
+"""
+Unit tests for prompt canonicalization and the near-duplicate index
+"""
+import time
+
+from app.services.prompt_index import NearDuplicateIndex, canonical_prompt, jaccard, prompt_words
+
+
+def test_canonical_prompt_ignores_case_whitespace_and_punctuation():
+    assert canonical_prompt("A castle on a cliff at dawn") == "a castle on a cliff at dawn"
+    assert canonical_prompt("  a Castle on a cliff,\tat dawn!") == "a castle on a cliff at dawn"
+    # Compatibility forms (full-width letters) fold to the plain ones
+    assert canonical_prompt("ＣＡＳＴＬＥ") == "castle"
+    # Word order is meaningful and kept
+    assert canonical_prompt("dog bites man") != canonical_prompt("man bites dog")
+    # Prompts of only punctuation do not all collapse to one key
+    assert canonical_prompt("?!") != canonical_prompt("...")
+
+
+def test_jaccard():
+    assert jaccard(prompt_words("a b c d"), prompt_words("d c b a")) == 1.0
+    assert jaccard(prompt_words("a b c"), prompt_words("a b d")) == 0.5
+
+
+def test_finds_reordered_and_slightly_changed_prompts():
+    index = NearDuplicateIndex(max_entries=100, threshold=0.8)
+    index.add("s", "A castle on a cliff at dawn, oil painting", "k1")
+    index.add("s", "A cat sleeping in the sun", "k2")
+
+    assert index.find("s", "Oil painting: a castle on a cliff at dawn") == ("k1", 1.0)
+    key, similarity = index.find("s", "A castle on a cliff at dawn, oil painting, detailed")
+    assert key == "k1" and 0.8 <= similarity < 1.0
+    assert index.find("s", "A castle on a hill at night") is None
+    # Other models, sizes, ... never match
+    assert index.find("other", "A castle on a cliff at dawn, oil painting") is None
+    assert (index.lookups, index.matches) == (4, 2)
+
+
+def test_memory_is_bounded():
+    index = NearDuplicateIndex(max_entries=10, threshold=0.8)
+    for i in range(100):
+        index.add("s", f"prompt number {i} with words", f"k{i}")
+    assert len(index) == 10
+    # Evicted prompts leave no buckets behind
+    assert len(index._buckets) <= 10 * index.bands
+    assert index.find("s", "prompt number 0 with words") is None
+    assert index.find("s", "prompt number 99 with words") == ("k99", 1.0)
+
+    index.discard("k99")
+    assert index.find("s", "prompt number 99 with words") is None
+
+
+def test_lookups_take_well_under_a_millisecond():
+    index = NearDuplicateIndex(max_entries=10000, threshold=0.8)
+    for i in range(10000):
+        index.add("s", f"a {i % 97} castle on a {i % 89} cliff at {i} dawn in style {i % 13}", f"k{i}")
+    prompts = [f"a {i % 97} castle on a {i % 89} cliff at {i} dusk in style {i % 13}" for i in range(500)]
+    start = time.perf_counter()
+    for prompt in prompts:
+        index.find("s", prompt)
+    per_lookup = (time.perf_counter() - start) / len(prompts)
+    assert per_lookup < 0.001, f"{per_lookup * 1e6:.0f}us per lookup"
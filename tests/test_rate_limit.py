@@ -0,0 +1,102 @@
+"""
+Unit tests for per-key token bucket rate limiting
+"""
+import pytest
+
+import app.services.rate_limit as rate_limit
+from app.schemas.image import ImageGenerationRequest
+from app.services.rate_limit import InMemoryRateLimiter, SQLiteRateLimiter, estimate_image_tokens
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def limiter(request, tmp_path, clock):
+    if request.param == "memory":
+        return InMemoryRateLimiter()
+    # The shared-store backend against a local database
+    return SQLiteRateLimiter(str(tmp_path / "ratelimit.db"))
+
+
+def test_request_bucket_empties_and_refills(limiter, clock):
+    for remaining in (2, 1, 0):
+        result = limiter.check("k", 3, 0, 0)
+        assert result.allowed and result.remaining == remaining
+    result = limiter.check("k", 3, 0, 0)
+    assert not result.allowed
+    # One request comes back every 60 / 3 seconds
+    assert result.retry_after == 20
+    assert result.headers()["Retry-After"] == "20"
+
+    clock.now += 10
+    assert not limiter.check("k", 3, 0, 0).allowed
+    clock.now += 10
+    assert limiter.check("k", 3, 0, 0).allowed
+    # Buckets never refill past their capacity
+    clock.now += 3600
+    assert limiter.check("k", 3, 0, 0).remaining == 2
+
+
+def test_token_bucket_and_settlement(limiter, clock):
+    assert limiter.check("k", 0, 1000, 600).allowed
+    result = limiter.check("k", 0, 1000, 600)
+    assert not result.allowed
+    assert result.retry_after == 12  # 200 missing tokens at 1000 per minute
+
+    # Refunding an over-estimate makes room right away
+    limiter.adjust("k", 1000, -400)
+    assert limiter.check("k", 0, 1000, 600).allowed
+    # Under-estimates are charged afterwards
+    limiter.adjust("k", 1000, 600)
+    assert not limiter.check("k", 0, 1000, 1).allowed
+
+
+def test_keys_have_separate_buckets(limiter):
+    assert limiter.check("a", 1, 0, 0).allowed
+    assert not limiter.check("a", 1, 0, 0).allowed
+    assert limiter.check("b", 1, 0, 0).allowed
+
+
+def test_zero_limits_are_unlimited(limiter):
+    for _ in range(100):
+        result = limiter.check("k", 0, 0, 10_000)
+        assert result.allowed
+    assert result.headers() == {"RateLimit-Limit": "0", "RateLimit-Remaining": "0", "RateLimit-Reset": "0"}
+
+
+def test_denied_checks_consume_nothing(limiter):
+    assert limiter.check("k", 2, 1000, 900).allowed
+    # The token bucket denies this one, so the request bucket is not charged either
+    assert not limiter.check("k", 2, 1000, 900).allowed
+    assert limiter.check("k", 2, 1000, 50).remaining == 0
+
+
+def test_sqlite_buckets_are_shared_between_limiters(tmp_path, clock):
+    path = str(tmp_path / "ratelimit.db")
+    first, second = SQLiteRateLimiter(path), SQLiteRateLimiter(path)
+    assert first.check("k", 2, 0, 0).allowed
+    assert second.check("k", 2, 0, 0).allowed
+    assert not first.check("k", 2, 0, 0).allowed
+
+
+def test_estimate_image_tokens():
+    gpt = ImageGenerationRequest(prompt="x" * 40, n=2, size="1024x1024")
+    assert estimate_image_tokens(gpt) == 11 + 2 * 1056
+    dalle = ImageGenerationRequest(prompt="x" * 40, model="dall-e-3")
+    assert estimate_image_tokens(dalle) == 11
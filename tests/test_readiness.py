@@ -0,0 +1,73 @@
+"""
+Unit tests for liveness, readiness and the load score
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+import app.services.readiness as readiness
+from app.main import app
+from app.services.memory_budget import MemoryBudget
+from app.services.scheduler import Scheduler
+from app.services.upstream_pool import UpstreamPool
+
+
+class _Account:
+    def __init__(self, available: bool):
+        self.available = available
+
+    def is_available(self, now: float) -> bool:
+        return self.available
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    scheduler = Scheduler(4, {}, 30.0)
+    memory = MemoryBudget(1000, 1.0)
+    pool = UpstreamPool([_Account(True), _Account(False)])
+    monkeypatch.setattr(readiness, "scheduler", scheduler)
+    monkeypatch.setattr(readiness, "memory_budget", memory)
+    monkeypatch.setattr(readiness, "get_client", lambda: pool)
+    return scheduler, memory, pool
+
+
+def test_ready_when_idle_with_an_upstream_account(worker):
+    report = readiness.readiness()
+    assert report["ready"] is True
+    assert report["load"] == 0.0
+    assert report["upstream"] == {"accounts": 2, "available": 1}
+
+
+def test_load_counts_in_flight_and_queued_work(worker):
+    scheduler, memory, _ = worker
+    scheduler.in_flight = 4
+    assert readiness.load_score() == 1.0
+    scheduler._classes[next(iter(scheduler._classes))].depth = 2
+    assert readiness.load_score() == 1.5
+    assert readiness.readiness()["reasons"] == ["overloaded"]
+
+
+def test_load_reflects_memory_headroom(worker):
+    _, memory, _ = worker
+    memory.in_flight_bytes = 900
+    assert readiness.load_score() == pytest.approx(0.9)
+
+
+def test_not_ready_without_an_available_upstream(worker, monkeypatch):
+    monkeypatch.setattr(readiness, "get_client", lambda: None)
+    report = readiness.readiness()
+    assert report["ready"] is False
+    assert report["reasons"] == ["no upstream account available"]
+
+
+def test_probe_endpoints(worker):
+    client = TestClient(app)
+    assert client.get("/health/live").status_code == 200
+    assert client.get("/health/ready").status_code == 200
+
+    scheduler, _, _ = worker
+    scheduler.in_flight = 8
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.json()["load"] == 2.0
+    # Liveness does not depend on load
+    assert client.get("/health").status_code == 200
@@ -0,0 +1,142 @@
+"""
+Unit tests for the structured request log
+"""
+import asyncio
+import glob
+import gzip
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from app.schemas.image import ImageGenerationRequest
+from app.services import request_log as request_log_module
+from app.services.request_log import CANCELLED_STATUS, RequestLogWriter, RequestTrace
+
+
+def _writer(tmp_path, **overrides) -> RequestLogWriter:
+    options = dict(max_bytes=10**9, max_seconds=10**9, backup_count=5, buffer_size=100)
+    options.update(overrides)
+    return RequestLogWriter(str(tmp_path / "requests.jsonl"), **options)
+
+
+def _archives(tmp_path):
+    return sorted(glob.glob(str(tmp_path / "requests-*.jsonl.gz")))
+
+
+def _read(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_background_thread_writes_and_drains_on_stop(tmp_path):
+    writer = _writer(tmp_path)
+    writer.start()
+    for i in range(10):
+        writer.log({"i": i})
+    writer.stop()
+
+    assert [r["i"] for r in _read(writer.path)] == list(range(10))
+    assert writer.metrics()["written"] == 10
+
+
+def test_rotates_by_size_and_gzips(tmp_path):
+    writer = _writer(tmp_path, max_bytes=1)
+    writer._write([{"batch": 1}])
+    writer._write([{"batch": 2}])
+    writer._file.close()
+
+    archives = _archives(tmp_path)
+    assert len(archives) == 1
+    assert _read(archives[0]) == [{"batch": 1}]
+    assert _read(writer.path) == [{"batch": 2}]
+    # The uncompressed rotated file is removed once compressed
+    assert not glob.glob(str(tmp_path / "requests-*.jsonl"))
+    assert writer.rotations == 1
+
+
+def test_rotates_by_age(tmp_path):
+    writer = _writer(tmp_path, max_seconds=60)
+    writer._write([{"batch": 1}])
+    writer._write([{"batch": 2}])
+    assert writer.rotations == 0
+
+    writer._opened_at -= 61
+    writer._write([{"batch": 3}])
+    writer._file.close()
+    assert writer.rotations == 1
+    assert _read(writer.path) == [{"batch": 3}]
+
+
+def test_prunes_old_backups(tmp_path):
+    writer = _writer(tmp_path, max_bytes=1, backup_count=2)
+    for i in range(5):
+        writer._write([{"batch": i}])
+    writer._file.close()
+
+    assert writer.rotations == 4
+    assert len(_archives(tmp_path)) == 2
+
+
+def test_drops_when_buffer_is_full(tmp_path):
+    writer = _writer(tmp_path, buffer_size=3)
+    for i in range(5):
+        writer.log({"i": i})
+
+    metrics = writer.metrics()
+    assert metrics["queued"] == 3
+    assert metrics["dropped"] == 2
+
+
+def test_write_failure_counts_batch_as_dropped(tmp_path):
+    # The log directory cannot be created because a file is in the way
+    (tmp_path / "blocked").write_text("")
+    writer = RequestLogWriter(str(tmp_path / "blocked" / "requests.jsonl"), 10**9, 10**9, 1, 10)
+    writer._write([{"i": 1}, {"i": 2}])
+    assert writer.metrics()["write_errors"] == 1
+    assert writer.metrics()["dropped"] == 2
+
+
+@pytest.fixture
+def captured(tmp_path, monkeypatch):
+    writer = _writer(tmp_path)
+    monkeypatch.setattr(request_log_module, "request_log", writer)
+    monkeypatch.setattr(request_log_module.settings, "REQUEST_LOG_ENABLED", True)
+    return writer
+
+
+def _logged(writer: RequestLogWriter):
+    return writer._queue.get_nowait()
+
+
+def test_trace_records_http_errors(captured):
+    with pytest.raises(HTTPException):
+        with RequestTrace("key", ImageGenerationRequest(prompt="castle")):
+            raise HTTPException(status_code=503, detail="busy")
+    record = _logged(captured)
+    assert (record["status"], record["error"]) == (503, "busy")
+
+
+def test_trace_records_cancellation_distinctly(captured):
+    with pytest.raises(asyncio.CancelledError):
+        with RequestTrace("key", ImageGenerationRequest(prompt="castle")) as trace:
+            trace.mark("queue")
+            raise asyncio.CancelledError()
+    record = _logged(captured)
+    assert (record["status"], record["error"]) == (CANCELLED_STATUS, "cancelled")
+    assert "queue_ms" in record["timings"] and "total_ms" in record["timings"]
+
+
+def test_trace_records_what_the_router_changed(captured):
+    sent = ImageGenerationRequest(model="auto", prompt="castle", size="auto")
+    routed = sent.model_copy(update={"model": "dall-e-2", "size": "256x256", "tier": "cheap"})
+    with RequestTrace("key", routed, sent):
+        pass
+    record = _logged(captured)
+    assert record["request"]["model"] == "dall-e-2"
+    assert record["client_request"] == {"model": "auto", "size": "auto", "tier": None}
+
+    with RequestTrace("key", sent, sent):
+        pass
+    assert "client_request" not in _logged(captured)
@@ -0,0 +1,340 @@
+"""
+Unit tests for the cluster-wide result cache
+"""
+import asyncio
+import base64
+import os
+import socket
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import app.api.v1.endpoints.cache as cache_endpoint
+import app.api.v1.endpoints.generate as generate
+import app.services.result_cache as result_cache_module
+from app.schemas.image import ImageData, ImageGenerationRequest, ImageGenerationResponse
+from app.services.key_registry import add_key, load_records
+from app.services.prompt_index import NearDuplicateIndex
+from app.services.result_cache import (
+    CLUSTER_SECRET_HEADER,
+    ClusterMembership,
+    LocalResultCache,
+    ResultCache,
+    cache_key,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _response(prompt: str, size: int = 10) -> ImageGenerationResponse:
+    image = ImageData(b64_json="A" * size, filetype="png", size="1024x1024")
+    return ImageGenerationResponse(id=prompt, created=1000, images=[image], model="gpt-image-1")
+
+
+def test_cache_key_ignores_field_order_but_not_values():
+    a = ImageGenerationRequest(prompt="castle", size="1024x1024", quality="standard")
+    b = ImageGenerationRequest(quality="standard", prompt="castle", size="1024x1024")
+    assert cache_key(a) == cache_key(b)
+    assert cache_key(a) != cache_key(ImageGenerationRequest(prompt="castle", size="1024x1024", quality="medium"))
+
+
+def test_cache_key_uses_the_canonical_prompt():
+    a = ImageGenerationRequest(prompt="A castle on a cliff at dawn")
+    b = ImageGenerationRequest(prompt="a castle on a cliff,  at dawn.")
+    assert cache_key(a) == cache_key(b)
+    assert cache_key(a) != cache_key(ImageGenerationRequest(prompt="At dawn, a castle on a cliff"))
+
+
+def test_near_duplicates_are_served_only_when_asked_for():
+    async def scenario():
+        cache = ResultCache(
+            LocalResultCache(1024, 60), ClusterMembership(None, []), 0.5, None,
+            similar=NearDuplicateIndex(100, 0.8),
+        )
+        cache.put(ImageGenerationRequest(prompt="A castle on a cliff at dawn"), _response("castle"))
+        reordered = ImageGenerationRequest(prompt="At dawn, a castle on a cliff")
+        other_size = ImageGenerationRequest(prompt="At dawn, a castle on a cliff", size="1536x1024")
+
+        assert await cache.lookup(reordered) == (None, "miss")
+        response, outcome = await cache.lookup(reordered, near_duplicates=True)
+        assert (response.id, outcome) == ("castle", "near")
+        assert await cache.lookup(other_size, near_duplicates=True) == (None, "miss")
+        return cache.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert (metrics["hits"], metrics["near_hits"], metrics["misses"]) == (0, 1, 2)
+
+
+def test_keys_opt_in_to_near_duplicates(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / "keys.db")
+    # A key store created before the near_duplicates column existed
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE api_keys (id TEXT PRIMARY KEY, key_hash TEXT NOT NULL UNIQUE, name TEXT, models TEXT, "
+            "requests_per_minute INTEGER, image_tokens_per_minute INTEGER, priority TEXT, weight REAL, "
+            "admin INTEGER NOT NULL DEFAULT 0, revoked INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL)"
+        )
+        conn.execute("INSERT INTO api_keys (id, key_hash, updated_at) VALUES ('old', 'abc', 0)")
+    conn.close()
+
+    assert add_key(path, "new", "secret-key", near_duplicates=True).near_duplicates
+    records = {r.key_id: r.near_duplicates for r in load_records(path)}
+    assert records == {"old": False, "new": True}
+
+
+def test_local_cache_is_a_byte_bounded_lru(monkeypatch):
+    cache = LocalResultCache(max_bytes=25, ttl_seconds=60)
+    cache.put("a", _response("a"))
+    cache.put("b", _response("b"))
+    assert cache.get("a").id == "a"
+    cache.put("c", _response("c"))
+    # "b" was the least recently used
+    assert cache.get("b") is None
+    assert (len(cache), cache.bytes, cache.evictions) == (2, 20, 1)
+    # Results larger than the whole cache are not stored
+    cache.put("big", _response("big", size=100))
+    assert cache.get("big") is None and len(cache) == 2
+
+
+def test_local_cache_entries_expire():
+    cache = LocalResultCache(max_bytes=100, ttl_seconds=0)
+    cache.put("a", _response("a"))
+    time.sleep(0.01)
+    assert cache.get("a") is None
+    assert cache.bytes == 0
+
+
+def test_cached_responses_are_copies():
+    cache = LocalResultCache(max_bytes=100, ttl_seconds=60)
+    cache.put("a", _response("a"))
+    # Streaming responses pop their images; that must not empty the cache
+    cache.get("a").images.pop()
+    assert len(cache.get("a").images) == 1
+
+
+def test_rendezvous_ownership_moves_few_keys():
+    nodes = [f"http://node{i}:8000" for i in range(4)]
+    keys = [f"key-{i}" for i in range(2000)]
+    before = ClusterMembership(nodes[0], nodes[1:])
+    owners = {key: before.owner(key) for key in keys}
+    # Every node agrees on ownership and keys spread over all of them
+    assert all(ClusterMembership(nodes[2], nodes).owner(k) == owners[k] for k in keys[:100])
+    assert set(owners.values()) == set(nodes)
+
+    after = ClusterMembership(nodes[0], nodes[1:3])
+    moved = [k for k in keys if after.owner(k) != owners[k]]
+    # Only the keys of the node that left move
+    assert all(owners[k] == nodes[3] for k in moved)
+    assert 0.15 < len(moved) / len(keys) < 0.35
+
+
+def test_standalone_node_owns_nothing():
+    assert ClusterMembership(None, ["http://peer:8000"]).owner("k") is None
+    assert ClusterMembership("http://me:8000", []).owner("k") is None
+
+
+def test_peers_file_is_reloaded_when_it_changes(tmp_path):
+    peers = tmp_path / "peers"
+    peers.write_text("http://b:8000/\n# comment\n\n")
+    membership = ClusterMembership("http://a:8000", [], str(peers))
+    assert membership.nodes() == ["http://a:8000", "http://b:8000"]
+
+    peers.write_text("http://b:8000\nhttp://c:8000\n")
+    os.utime(peers, (time.time() + 5, time.time() + 5))
+    # Lookups read the snapshot; only a reload looks at the file
+    assert membership.nodes() == ["http://a:8000", "http://b:8000"]
+    assert membership.reload()
+    assert membership.nodes() == ["http://a:8000", "http://b:8000", "http://c:8000"]
+    assert not membership.reload()
+
+    peers.unlink()
+    assert membership.reload()
+    assert membership.nodes() == ["http://a:8000"]
+
+
+def test_membership_lookups_do_no_io(tmp_path, monkeypatch):
+    peers = tmp_path / "peers"
+    peers.write_text("http://b:8000\n")
+    membership = ClusterMembership("http://a:8000", [], str(peers), refresh_seconds=0.01)
+
+    def no_stat(*args):
+        raise AssertionError("stat on the lookup path")
+
+    monkeypatch.setattr(result_cache_module, "os", SimpleNamespace(stat=no_stat))
+    assert membership.owner("k") in ("http://a:8000", "http://b:8000")
+    monkeypatch.undo()
+
+    async def follow_changes():
+        membership.start()
+        peers.write_text("http://b:8000\nhttp://c:8000\n")
+        os.utime(peers, (time.time() + 5, time.time() + 5))
+        for _ in range(100):
+            if len(membership.nodes()) == 3:
+                break
+            await asyncio.sleep(0.01)
+        await membership.stop()
+
+    asyncio.run(follow_changes())
+    assert membership.nodes() == ["http://a:8000", "http://b:8000", "http://c:8000"]
+
+
+def test_unreachable_owner_is_a_miss():
+    async def scenario():
+        # Nothing listens on port 1
+        cache = ResultCache(
+            LocalResultCache(100, 60), ClusterMembership("http://127.0.0.1:2", ["http://127.0.0.1:1"]), 0.5, "s"
+        )
+        request = next(
+            r for r in (ImageGenerationRequest(prompt=f"castle {i}") for i in range(50))
+            if cache.membership.owner(cache_key(r)) == "http://127.0.0.1:1"
+        )
+        try:
+            assert await cache.lookup(request) == (None, "miss")
+        finally:
+            await cache.aclose()
+        return cache.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert (metrics["misses"], metrics["peer_errors"]) == (1, 1)
+
+
+def test_repeated_request_is_served_from_cache(monkeypatch):
+    cache = ResultCache(LocalResultCache(1024, 60), ClusterMembership(None, []), 0.5, None)
+    monkeypatch.setattr(generate, "result_cache", cache)
+    calls = []
+
+    async def fake_generate(request, deadline=None):
+        calls.append(request.prompt)
+        image = ImageData(b64_json=base64.b64encode(b"png").decode(), filetype="png", size="1024x1024")
+        return ImageGenerationResponse(id="gen", created=1000, images=[image], model="gpt-image-1")
+
+    monkeypatch.setattr(generate, "generate_image", fake_generate)
+    from app.main import app
+
+    client = TestClient(app)
+    first = client.post("/api/v1/generate/", json={"prompt": "castle"})
+    second = client.post("/api/v1/generate/", json={"prompt": "castle"})
+    assert (first.headers["x-cache"], second.headers["x-cache"]) == ("MISS", "HIT")
+    assert first.json()["images"] == second.json()["images"]
+    assert calls == ["castle"]
+
+
+def test_peer_endpoints_require_the_cluster_secret(monkeypatch):
+    cache = ResultCache(LocalResultCache(1024, 60), ClusterMembership(None, []), 0.5, "s3cret")
+    monkeypatch.setattr(cache_endpoint, "result_cache", cache)
+    from app.main import app
+
+    client = TestClient(app)
+    key = "ab" * 32
+    url = f"/api/v1/cache/{key}"
+    body = _response("a").model_dump_json()
+    assert client.put(url, content=body).status_code == 403
+    assert client.put(url, content=body, headers={CLUSTER_SECRET_HEADER: "wrong"}).status_code == 403
+    assert client.put(url, content=body, headers={CLUSTER_SECRET_HEADER: "s3cret"}).status_code == 204
+    assert client.get(url).status_code == 403
+    assert client.get(url, headers={CLUSTER_SECRET_HEADER: "s3cret"}).json()["id"] == "a"
+    assert client.get("/api/v1/cache/" + "cd" * 32, headers={CLUSTER_SECRET_HEADER: "s3cret"}).status_code == 404
+
+    cache.enabled = False
+    assert client.get(url, headers={CLUSTER_SECRET_HEADER: "s3cret"}).status_code == 404
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_up(url: str, timeout: float = 20.0) -> None:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    """An upstream stub and two service processes sharing one result cache"""
+    stub_port, ports = _free_port(), [_free_port(), _free_port()]
+    nodes = [f"http://127.0.0.1:{port}" for port in ports]
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    processes = [subprocess.Popen(
+        [sys.executable, "upstream_stub.py", "--port", str(stub_port), "--latency", "0.05", "--payload-kb", "4"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )]
+    try:
+        _wait_until_up(f"{stub_url}/stub/stats")
+        for i, port in enumerate(ports):
+            data = tmp_path / f"node{i}"
+            env = dict(
+                os.environ,
+                OPENAI_API_KEY="stub",
+                OPENAI_BASE_URL=f"{stub_url}/v1",
+                RESULT_CACHE_ENABLED="true",
+                CLUSTER_SELF_URL=nodes[i],
+                CLUSTER_PEERS=f'["{nodes[1 - i]}"]',
+                CLUSTER_SECRET="s3cret",
+                HISTORY_ENABLED="false",
+                REQUEST_LOG_ENABLED="false",
+                USAGE_DB_PATH=str(data / "usage.db"),
+            )
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+                cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            ))
+        for node in nodes:
+            _wait_until_up(f"{node}/health/live")
+        yield stub_url, nodes
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+
+def test_nodes_share_results_across_processes(cluster):
+    stub_url, (a, b) = cluster
+    membership = ClusterMembership(a, [b])
+
+    def owned_by(node):
+        return next(
+            p for p in (f"castle {i}" for i in range(100))
+            if membership.owner(cache_key(ImageGenerationRequest(prompt=p))) == node
+        )
+
+    def generate_on(node, prompt):
+        response = httpx.post(f"{node}/api/v1/generate/", json={"prompt": prompt}, timeout=30.0)
+        assert response.status_code == 200
+        return response.headers["x-cache"], response.json()["images"]
+
+    # Generated on the owner, then fetched from it by the other node
+    prompt = owned_by(a)
+    miss = generate_on(a, prompt)
+    hit = generate_on(b, prompt)
+    assert (miss[0], hit[0]) == ("MISS", "HIT")
+    assert miss[1] == hit[1]
+
+    # Generated on the other node and pushed to the owner in the background
+    prompt = owned_by(b)
+    assert generate_on(a, prompt)[0] == "MISS"
+    key_url = f"{b}/api/v1/cache/{cache_key(ImageGenerationRequest(prompt=prompt))}"
+    end = time.monotonic() + 5
+    while httpx.get(key_url, headers={CLUSTER_SECRET_HEADER: "s3cret"}).status_code != 200:
+        assert time.monotonic() < end, "Result was not pushed to its owner"
+        time.sleep(0.05)
+    assert generate_on(b, prompt)[0] == "HIT"
+    assert generate_on(a, prompt)[0] == "HIT"
+
+    assert httpx.get(f"{stub_url}/stub/stats").json() == {"generations": 2}
@@ -0,0 +1,161 @@
+"""
+Unit tests for the generation request scheduler
+"""
+import asyncio
+
+import pytest
+
+from app.services.scheduler import PriorityClass, Scheduler, SchedulerTimeout, resolve_priority
+
+DEADLINES = {"interactive": 5.0, "batch": 5.0, "background": 5.0}
+
+
+def _scheduler(**overrides) -> Scheduler:
+    options = {"max_concurrency": 1, "deadlines": DEADLINES, "starvation_seconds": 60.0}
+    options.update(overrides)
+    return Scheduler(**options)
+
+
+async def _admit(scheduler: Scheduler, order: list, name: str, priority: PriorityClass, key_id: str = "k", weight: float = 1.0):
+    await scheduler.acquire(key_id, priority, weight)
+    order.append(name)
+
+
+async def _drain(scheduler: Scheduler, tasks: list, priority: PriorityClass) -> None:
+    """Release the held slot once per queued task, letting each admitted task run"""
+    for _ in tasks:
+        scheduler.release(priority)
+        await asyncio.sleep(0)
+
+
+def test_resolve_priority_only_lowers():
+    assert resolve_priority("interactive", "batch") is PriorityClass.BATCH
+    assert resolve_priority("background", "interactive") is PriorityClass.BACKGROUND
+    assert resolve_priority("batch", "bogus") is PriorityClass.BATCH
+    assert resolve_priority("bogus") is PriorityClass.INTERACTIVE
+
+
+def test_higher_class_is_served_first():
+    async def scenario():
+        scheduler = _scheduler()
+        await scheduler.acquire("holder", PriorityClass.INTERACTIVE)
+        order: list = []
+        tasks = [
+            asyncio.create_task(_admit(scheduler, order, "background", PriorityClass.BACKGROUND)),
+            asyncio.create_task(_admit(scheduler, order, "batch", PriorityClass.BATCH)),
+            asyncio.create_task(_admit(scheduler, order, "interactive", PriorityClass.INTERACTIVE)),
+        ]
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth == 3
+
+        scheduler.release(PriorityClass.INTERACTIVE)
+        await asyncio.sleep(0)
+        scheduler.release(PriorityClass.INTERACTIVE)
+        await asyncio.sleep(0)
+        scheduler.release(PriorityClass.BATCH)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["interactive", "batch", "background"]
+
+
+def test_weighted_fair_share_within_class():
+    async def scenario():
+        scheduler = _scheduler()
+        await scheduler.acquire("holder", PriorityClass.BATCH)
+        order: list = []
+        tasks = [
+            asyncio.create_task(_admit(scheduler, order, "light", PriorityClass.BATCH, key_id="light", weight=1.0))
+            for _ in range(4)
+        ] + [
+            asyncio.create_task(_admit(scheduler, order, "heavy", PriorityClass.BATCH, key_id="heavy", weight=3.0))
+            for _ in range(4)
+        ]
+        await asyncio.sleep(0)
+        await _drain(scheduler, tasks, PriorityClass.BATCH)
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(scenario())
+    # Finish tags: heavy 1/3, 2/3, 1, 4/3; light 1, 2, 3, 4 (ties go to the earlier arrival)
+    assert order[:5] == ["heavy", "heavy", "light", "heavy", "heavy"]
+    assert order[5:] == ["light"] * 3
+
+
+def test_starved_waiter_is_promoted():
+    async def scenario():
+        scheduler = _scheduler(starvation_seconds=0.05)
+        await scheduler.acquire("holder", PriorityClass.INTERACTIVE)
+        order: list = []
+        old = asyncio.create_task(_admit(scheduler, order, "background", PriorityClass.BACKGROUND))
+        await asyncio.sleep(0.06)
+        new = asyncio.create_task(_admit(scheduler, order, "interactive", PriorityClass.INTERACTIVE))
+        await asyncio.sleep(0)
+
+        scheduler.release(PriorityClass.INTERACTIVE)
+        await asyncio.sleep(0)
+        scheduler.release(PriorityClass.BACKGROUND)
+        await asyncio.gather(old, new)
+        return order
+
+    assert asyncio.run(scenario()) == ["background", "interactive"]
+
+
+def test_waiter_expires_at_class_deadline():
+    async def scenario():
+        scheduler = _scheduler(deadlines={"interactive": 0.05})
+        await scheduler.acquire("holder", PriorityClass.INTERACTIVE)
+        with pytest.raises(SchedulerTimeout):
+            await scheduler.acquire("late", PriorityClass.INTERACTIVE)
+        metrics = scheduler.metrics()
+
+        # The expired waiter must not be granted the slot afterwards
+        scheduler.release(PriorityClass.INTERACTIVE)
+        return metrics, scheduler.in_flight
+
+    metrics, in_flight = asyncio.run(scenario())
+    assert metrics["classes"]["interactive"]["expired"] == 1
+    assert metrics["queue_depth"] == 0
+    assert in_flight == 0
+
+
+def test_cancel_while_queued_frees_queue_entry():
+    async def scenario():
+        scheduler = _scheduler()
+        await scheduler.acquire("holder", PriorityClass.INTERACTIVE)
+        waiter = asyncio.create_task(scheduler.acquire("gone", PriorityClass.INTERACTIVE))
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth == 1
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.queue_depth == 0
+
+        scheduler.release(PriorityClass.INTERACTIVE)
+        return scheduler.in_flight
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_cancel_racing_grant_does_not_leak_slot():
+    async def scenario():
+        scheduler = _scheduler()
+        await scheduler.acquire("holder", PriorityClass.INTERACTIVE)
+        waiter = asyncio.create_task(scheduler.acquire("gone", PriorityClass.INTERACTIVE))
+        await asyncio.sleep(0)
+
+        # Grant the slot, then cancel before the waiter task resumes
+        scheduler.release(PriorityClass.INTERACTIVE)
+        assert scheduler.in_flight == 1
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        else:
+            # Some Python versions let the grant win the race; the caller then owns the slot
+            scheduler.release(PriorityClass.INTERACTIVE)
+        return scheduler.in_flight, scheduler.queue_depth
+
+    assert asyncio.run(scenario()) == (0, 0)
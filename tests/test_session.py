@@ -0,0 +1,206 @@
+"""
+Unit tests for WebSocket generation sessions
+"""
+import asyncio
+import base64
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import app.api.deps as deps
+import app.api.v1.endpoints.generate as generate
+import app.api.v1.endpoints.session as session
+from app.main import app
+from app.schemas.image import ImageData, ImageGenerationResponse
+from app.services.cancellation import CancellationStats
+from app.services.history import GenerationHistory
+from app.services.memory_budget import memory_budget
+from app.services.scheduler import scheduler
+
+URL = "/api/v1/generate/ws"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    async def fake_generate(request, deadline=None):
+        if "slow" in request.prompt:
+            await asyncio.sleep(10)
+        images = [
+            ImageData(b64_json=base64.b64encode(f"{request.prompt}-{i}".encode()).decode(), filetype="png", size="1024x1024")
+            for i in range(request.n)
+        ]
+        return ImageGenerationResponse(id="gen", created=1000, images=images, model="gpt-image-1")
+
+    monkeypatch.setattr(generate, "generate_image", fake_generate)
+    monkeypatch.setattr(generate, "cancellation_stats", CancellationStats())
+    monkeypatch.setattr(session, "generation_history", GenerationHistory(str(tmp_path / "h.db"), str(tmp_path / "img")))
+    return TestClient(app)
+
+
+def _receive_generation(ws):
+    """Read one generation's messages: (id, [image bytes], done message)"""
+    images = []
+    while True:
+        message = ws.receive_json()
+        if message["type"] == "image":
+            data = ws.receive_bytes()
+            assert len(data) == message["bytes"]
+            images.append(data)
+        else:
+            return message["id"], images, message
+
+
+def test_many_generations_share_one_connection(client):
+    with client.websocket_connect(URL) as ws:
+        ws.send_json({"type": "generate", "id": "a", "request": {"prompt": "castle", "n": 2}})
+        ws.send_json({"type": "generate", "id": "b", "request": {"prompt": "sea"}})
+        results = {}
+        for _ in range(2):
+            gen_id, images, done = _receive_generation(ws)
+            assert done["type"] == "done"
+            assert done["images"] == len(images)
+            results[gen_id] = images
+
+    assert results == {"a": [b"castle-0", b"castle-1"], "b": [b"sea-0"]}
+    assert scheduler.in_flight == 0
+    assert memory_budget.in_flight_bytes == 0
+
+
+def test_cancel_a_superseded_generation(client):
+    with client.websocket_connect(URL) as ws:
+        ws.send_json({"type": "generate", "id": "old", "request": {"prompt": "slow castle"}})
+        ws.send_json({"type": "cancel", "id": "old"})
+        assert ws.receive_json() == {"type": "cancelled", "id": "old"}
+
+        ws.send_json({"type": "generate", "id": "new", "request": {"prompt": "castle"}})
+        gen_id, images, done = _receive_generation(ws)
+        assert (gen_id, images, done["type"]) == ("new", [b"castle-0"], "done")
+
+    assert sum(generate.cancellation_stats.cancelled.values()) == 1
+    assert scheduler.in_flight == 0
+    assert memory_budget.in_flight_bytes == 0
+
+
+def test_protocol_errors(client, monkeypatch):
+    monkeypatch.setattr(session.settings, "WS_MAX_IN_FLIGHT", 1)
+    with client.websocket_connect(URL) as ws:
+        ws.send_text("not json")
+        assert ws.receive_json()["status"] == 400
+        ws.send_json({"type": "generate", "id": "x", "request": {"prompt": "castle", "n": 99}})
+        assert ws.receive_json()["status"] == 422
+        ws.send_json({"type": "cancel", "id": "missing"})
+        assert ws.receive_json()["status"] == 404
+
+        ws.send_json({"type": "generate", "id": "a", "request": {"prompt": "slow"}})
+        ws.send_json({"type": "generate", "id": "b", "request": {"prompt": "castle"}})
+        assert ws.receive_json() == {
+            "type": "error", "id": "b", "status": 429,
+            "detail": "At most 1 generations may run at once on a connection",
+        }
+
+
+def test_invalid_key_is_refused(client, monkeypatch):
+    monkeypatch.setattr(deps, "is_auth_enabled", lambda: True)
+    with pytest.raises(WebSocketDisconnect) as e:
+        with client.websocket_connect(URL + "?api_key=wrong"):
+            pass
+    assert e.value.code == 1008
+
+
+def test_outbox_holds_producers_back_until_frames_are_sent():
+    async def scenario():
+        outbox = session._Outbox(max_bytes=10)
+        await outbox.put([b"12345678"])
+        blocked = asyncio.create_task(outbox.put([b"12345678"]))
+        await asyncio.sleep(0.01)
+        assert not blocked.done() and outbox.buffered == 8
+
+        frames, size = await outbox.get()
+        await outbox.sent(size)
+        await asyncio.wait_for(blocked, timeout=1.0)
+        assert outbox.buffered == 8
+
+        # A message larger than the whole buffer goes through once the buffer is empty
+        await outbox.sent((await outbox.get())[1])
+        await asyncio.wait_for(outbox.put([b"x" * 100]), timeout=1.0)
+
+    asyncio.run(scenario())
+
+
+def test_replies_skip_a_full_outbox_and_cancelled_frames_are_dropped():
+    async def scenario():
+        outbox = session._Outbox(max_bytes=10)
+        await outbox.put([b"12345678"], "a")
+        blocked = asyncio.create_task(outbox.put([b"12345678"], "a"))
+        await asyncio.sleep(0.01)
+
+        # A reply never waits for space and is sent before queued images
+        await asyncio.wait_for(outbox.reply('{"type": "cancelled"}'), timeout=1.0)
+        assert await outbox.get() == (['{"type": "cancelled"}'], 0)
+
+        # Dropping a cancelled generation's frames frees the buffer
+        await outbox.discard("a")
+        assert outbox.buffered == 0
+        await asyncio.wait_for(blocked, timeout=1.0)
+        await outbox.discard("a")
+        await outbox.put([b"1"], "b")
+        assert await outbox.get() == ([b"1"], 1)
+
+    asyncio.run(scenario())
+
+
+def test_a_client_that_never_reads_replies_is_cut_off():
+    async def scenario():
+        outbox = session._Outbox(max_bytes=10)
+        for _ in range(session.MAX_PENDING_REPLIES):
+            await outbox.reply("{}")
+        with pytest.raises(session.ClientNotReading):
+            await outbox.reply("{}")
+
+    asyncio.run(scenario())
+
+
+class StalledWebSocket:
+    """A client that sends messages but never reads what it is sent"""
+
+    def __init__(self):
+        self.incoming = asyncio.Queue()
+        self.stalled = asyncio.Event()
+
+    async def receive_text(self):
+        return await self.incoming.get()
+
+    async def _stall(self, frame):
+        self.stalled.set()
+        await asyncio.Event().wait()
+
+    send_text = send_bytes = _stall
+
+
+def test_cancel_is_handled_while_the_client_is_not_reading(client, monkeypatch):
+    monkeypatch.setattr(session.settings, "WS_MAX_BUFFERED_BYTES", 16)
+
+    async def scenario():
+        websocket = StalledWebSocket()
+        generation = session.GenerationSession(websocket, deps.ANONYMOUS_KEY)
+        runner = asyncio.create_task(generation.run())
+        await websocket.incoming.put('{"type": "generate", "id": "a", "request": {"prompt": "castle", "n": 4}}')
+        await asyncio.wait_for(websocket.stalled.wait(), timeout=5)
+        await asyncio.sleep(0.05)
+        # The writer is stuck and the generation waits for buffer space
+        assert "a" in generation.tasks
+
+        await websocket.incoming.put('{"type": "cancel", "id": "a"}')
+        for _ in range(100):
+            if generation.outbox._replies:
+                break
+            await asyncio.sleep(0.01)
+        assert list(generation.outbox._replies) == ['{"type": "cancelled", "id": "a"}']
+        # Only the frame the writer is stuck on is left; the rest were dropped
+        assert not generation.tasks and not generation.outbox._items
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert memory_budget.in_flight_bytes == 0
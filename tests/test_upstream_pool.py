@@ -0,0 +1,165 @@
+"""
+Unit tests for the upstream account pool
+"""
+import asyncio
+
+import httpx
+import openai
+import pytest
+from fastapi.testclient import TestClient
+
+import app.api.v1.endpoints.generate as generate
+import app.services.upstream_pool as upstream_pool
+from app.services.upstream_pool import NoUpstreamAvailable, UpstreamAccount, UpstreamPool
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(upstream_pool, "time", clock)
+    return clock
+
+
+@pytest.fixture(autouse=True)
+def pool_settings(monkeypatch):
+    for name, value in {
+        "UPSTREAM_MAX_ATTEMPTS": 2,
+        "UPSTREAM_EJECT_AFTER_FAILURES": 2,
+        "UPSTREAM_EJECTION_SECONDS": 30.0,
+        "UPSTREAM_MAX_EJECTION_SECONDS": 300.0,
+    }.items():
+        monkeypatch.setattr(upstream_pool.settings, name, value)
+
+
+def _error(status: int, headers=None) -> openai.APIStatusError:
+    response = httpx.Response(status, headers=headers, request=httpx.Request("POST", "http://upstream.test"))
+    cls = {429: openai.RateLimitError, 401: openai.AuthenticationError}.get(status, openai.InternalServerError)
+    return cls(f"upstream returned {status}", response=response, body=None)
+
+
+def _pool(*names, **weights) -> UpstreamPool:
+    return UpstreamPool([
+        UpstreamAccount(name, "sk-test", base_url="http://upstream.test", weight=weights.get(name, 1.0))
+        for name in names
+    ])
+
+
+def _run(pool: UpstreamPool, outcomes):
+    """Run one call; ``outcomes`` maps account name to an error to raise (default: success)"""
+    names = {id(a.client): a.name for a in pool.accounts}
+    calls = []
+
+    async def operation(client):
+        name = names[id(client)]
+        calls.append(name)
+        if outcomes.get(name) is not None:
+            raise outcomes[name]
+        return name
+
+    return asyncio.run(pool.run(operation)), calls
+
+
+def test_selection_prefers_fast_idle_accounts(clock):
+    pool = _pool("a", "b")
+    a, b = pool.accounts
+    a.record_success(2.0)
+    b.record_success(4.0)
+    assert pool.select() is a
+    # Outstanding requests count against an account
+    a.outstanding = 2
+    assert pool.select() is b
+    # So does a high 429 rate
+    a.outstanding = 0
+    a.throttle_rate = 0.5
+    assert pool.select() is b
+    # Weight scales an account's share
+    b.weight = 0.1
+    assert pool.select() is a
+
+
+def test_fails_over_to_the_next_account(clock):
+    pool = _pool("a", "b")
+    pool.accounts[1].latency = 20.0
+    result, calls = _run(pool, {"a": _error(500)})
+    assert (result, calls) == ("b", ["a", "b"])
+    assert pool.accounts[0].errors == 1
+
+    # Errors about the request itself are not retried elsewhere
+    bad_request = openai.BadRequestError(
+        "bad", response=httpx.Response(400, request=httpx.Request("POST", "http://upstream.test")), body=None
+    )
+    with pytest.raises(openai.BadRequestError):
+        _run(pool, {"a": bad_request, "b": bad_request})
+
+
+def test_ejection_cooldown_grows_exponentially_and_expires(clock):
+    pool = _pool("a")
+    account = pool.accounts[0]
+    for _ in range(2):
+        with pytest.raises(openai.InternalServerError):
+            _run(pool, {"a": _error(500)})
+    assert not account.is_available(clock.now)
+    assert account.ejected_until == clock.now + 30
+
+    with pytest.raises(NoUpstreamAvailable) as e:
+        pool.select()
+    assert e.value.retry_after == 30
+
+    # Readmitted after the cooldown with a single trial; failing it doubles the cooldown
+    clock.now += 30
+    assert pool.select() is account
+    with pytest.raises(openai.InternalServerError):
+        _run(pool, {"a": _error(500)})
+    assert account.ejected_until == clock.now + 60
+
+    # A success resets the backoff
+    clock.now += 60
+    assert _run(pool, {})[0] == "a"
+    assert account.ejections == 0
+    assert pool.available_count() == 1
+
+
+def test_rate_limits_and_bad_credentials_eject_at_once(clock):
+    pool = _pool("a", "b")
+    a, b = pool.accounts
+    a.record_failure(_error(429, {"retry-after": "12"}), clock.now)
+    assert a.ejected_until == clock.now + 12
+    b.record_failure(_error(401), clock.now)
+    assert b.ejected_until == clock.now + 300
+    assert [s["available"] for s in pool.snapshot()] == [False, False]
+
+
+def test_rate_limits_on_a_model_only_take_the_account_out_for_that_model(clock):
+    pool = _pool("a")
+    (account,) = pool.accounts
+    account.record_failure(_error(429, {"retry-after": "12"}), clock.now, "dall-e-2")
+    assert account.ejected_until == 0.0
+    assert account.consecutive_failures == 0
+    assert pool.select(model="dall-e-3") is account
+    with pytest.raises(NoUpstreamAvailable) as e:
+        pool.select(model="dall-e-2")
+    assert e.value.retry_after == 12
+    assert pool.snapshot()[0]["rate_limited_models"] == {"dall-e-2": 12.0}
+
+    clock.now += 12
+    assert pool.select(model="dall-e-2") is account
+
+
+def test_no_available_account_is_a_503_with_retry_after(monkeypatch):
+    async def fake_generate(request, deadline=None):
+        raise NoUpstreamAvailable("All upstream accounts are temporarily unavailable", retry_after=12.3)
+
+    monkeypatch.setattr(generate, "generate_image", fake_generate)
+    from app.main import app
+
+    response = TestClient(app).post("/api/v1/generate/", json={"prompt": "castle"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "13"
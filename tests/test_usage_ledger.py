@@ -0,0 +1,125 @@
+"""
+Unit tests for the usage and cost ledger
+"""
+import asyncio
+
+import pytest
+
+from app.services.usage_ledger import UsageLedger, UsageRecord, estimate_cost
+
+HOUR = 3600
+BASE = 1_700_000_000 // HOUR * HOUR  # An hour boundary
+
+
+def _record(created: float, key_id: str = "a", model: str = "gpt-image-1", latency_ms: float = 100.0, **overrides) -> UsageRecord:
+    values = dict(
+        created=created, request_id=f"req-{created}", key_id=key_id, model=model,
+        size="1024x1024", quality="medium", images=1, prompt_tokens=10,
+        image_tokens=1056, total_tokens=1066, latency_ms=latency_ms, cost_usd=0.5,
+    )
+    values.update(overrides)
+    return UsageRecord(**values)
+
+
+@pytest.fixture
+def ledger(tmp_path) -> UsageLedger:
+    return UsageLedger(str(tmp_path / "usage.db"))
+
+
+def _fill(ledger: UsageLedger, records) -> None:
+    for record in records:
+        ledger.record(record)
+    asyncio.run(ledger.flush())
+
+
+def test_estimate_cost():
+    assert estimate_cost("gpt-image-1", "1024x1024", "medium", 1, 1_000_000, 0) == 5.0
+    assert estimate_cost("gpt-image-1", "1024x1024", "medium", 1, 0, 1_000_000) == 40.0
+    assert estimate_cost("dall-e-3", "1024x1024", "hd", 2, 0, 0) == 0.16
+    assert estimate_cost("dall-e-3", "1024x1024", "auto", 1, 0, 0) == 0.04
+    assert estimate_cost("dall-e-2", "512x512", "hd", 1, 0, 0) == 0.018
+
+
+def test_rollup_sums_within_an_hour(ledger):
+    _fill(ledger, [
+        _record(BASE + 10, latency_ms=100.0, images=1, total_tokens=1000, cost_usd=0.25),
+        _record(BASE + 20, latency_ms=300.0, images=2, total_tokens=3000, cost_usd=0.75),
+        _record(BASE + HOUR + 5, latency_ms=50.0),
+    ])
+    rows = asyncio.run(ledger.summary(["key", "hour"]))
+
+    assert rows[0] == {
+        "key": "a", "hour": BASE, "requests": 2, "images": 3,
+        "total_tokens": 4000, "avg_latency_ms": 200.0, "cost_usd": 1.0,
+    }
+    assert rows[1]["hour"] == BASE + HOUR
+    assert rows[1]["requests"] == 1
+
+
+def test_rollup_groups_by_dimension(ledger):
+    _fill(ledger, [
+        _record(BASE, key_id="a", model="gpt-image-1"),
+        _record(BASE, key_id="b", model="dall-e-3"),
+        _record(BASE, key_id="b", model="gpt-image-1"),
+    ])
+    by_model = asyncio.run(ledger.summary(["model"]))
+    assert [(r["model"], r["requests"]) for r in by_model] == [("dall-e-3", 1), ("gpt-image-1", 2)]
+
+    only_b = asyncio.run(ledger.summary(["key"], key_id="b"))
+    assert [(r["key"], r["requests"]) for r in only_b] == [("b", 2)]
+
+
+def test_time_bounds_select_whole_hours(ledger):
+    _fill(ledger, [_record(BASE + h * HOUR + 30) for h in range(4)])
+
+    def hours(since=None, until=None):
+        rows = asyncio.run(ledger.summary(["hour"], since=since, until=until))
+        return [(r["hour"] - BASE) // HOUR for r in rows]
+
+    # Mid-hour bounds include the hours they fall in
+    assert hours(since=BASE + HOUR + 1800, until=BASE + 2 * HOUR + 1800) == [1, 2]
+    # An until on an hour boundary excludes the hour starting there
+    assert hours(since=BASE + HOUR, until=BASE + 3 * HOUR) == [1, 2]
+    assert hours(until=BASE + 1) == [0]
+
+
+def test_failed_flush_is_retried(ledger, monkeypatch):
+    write = ledger._write
+    calls = []
+
+    def flaky_write(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise OSError("disk full")
+        write(batch)
+
+    monkeypatch.setattr(ledger, "_write", flaky_write)
+    ledger.record(_record(BASE, request_id="first"))
+    ledger.record(_record(BASE, request_id="second"))
+
+    asyncio.run(ledger.flush())
+    assert ledger.metrics() == {"buffered": 2, "written": 0, "dropped": 0, "flush_errors": 1}
+    assert [r.request_id for r in ledger._buffer] == ["first", "second"]
+
+    # Records added after the failure queue behind the retried batch
+    ledger.record(_record(BASE, request_id="third"))
+    asyncio.run(ledger.flush())
+    assert calls == [2, 3]
+    assert ledger.metrics() == {"buffered": 0, "written": 3, "dropped": 0, "flush_errors": 1}
+    assert asyncio.run(ledger.summary(["key"]))[0]["requests"] == 3
+
+
+def test_failed_flush_respects_buffer_bound(tmp_path, monkeypatch):
+    ledger = UsageLedger(str(tmp_path / "usage.db"), max_buffer=2)
+
+    def failing_write(batch):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(ledger, "_write", failing_write)
+    ledger.record(_record(BASE, request_id="old"))
+    ledger.record(_record(BASE, request_id="new"))
+    asyncio.run(ledger.flush())
+    ledger.record(_record(BASE, request_id="newest"))
+
+    assert [r.request_id for r in ledger._buffer] == ["new", "newest"]
+    assert ledger.dropped == 1
@@ -0,0 +1,85 @@
+"""
+Local upstream stub for offline load testing
+
+Serves the subset of the OpenAI API this service calls (model listing and
+image generation) with configurable latency, payload size and error rate,
+so capacity and replay tests never spend real credits.
+
+Usage:
+    python upstream_stub.py --port 9000 --latency 2.0 --payload-kb 1500
+
+Then point the service at it:
+    OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:9000/v1 python run.py
+"""
+
+import argparse
+import asyncio
+import base64
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Upstream stub")
+config = argparse.Namespace(latency=1.0, jitter=0.2, payload_kb=64, error_rate=0.0)
+stats = {"generations": 0}
+
+
+@app.get("/v1/models")
+async def list_models():
+    """List the image models the service validates against"""
+    models = ["gpt-image-1", "dall-e-3", "dall-e-2"]
+    return {"object": "list", "data": [{"id": m, "object": "model", "created": 0, "owned_by": "stub"} for m in models]}
+
+
+@app.get("/stub/stats")
+async def get_stats():
+    """How many generation calls the stub has received"""
+    return stats
+
+
+@app.post("/v1/images/generations")
+async def generate(request: Request):
+    """Return n fake base64 images after a simulated generation delay"""
+    body = await request.json()
+    n = int(body.get("n") or 1)
+    stats["generations"] += 1
+    await asyncio.sleep(max(0.0, random.gauss(config.latency, config.jitter * config.latency)))
+
+    if random.random() < config.error_rate:
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+            headers={"retry-after": "1"},
+        )
+
+    payload = base64.b64encode(random.randbytes(config.payload_kb * 1024)).decode("ascii")
+    prompt_tokens = len(body.get("prompt", "")) // 4 + 1
+    image_tokens = 1056 * n
+    return {
+        "created": int(time.time()),
+        "data": [{"b64_json": payload} for _ in range(n)],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "total_tokens": prompt_tokens + image_tokens,
+            "input_tokens": prompt_tokens,
+            "output_tokens": image_tokens,
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local OpenAI image API stub")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to bind the stub to")
+    parser.add_argument("--port", type=int, default=9000, help="Port to bind the stub to")
+    parser.add_argument("--latency", type=float, default=1.0, help="Mean generation latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency standard deviation as a fraction of the mean")
+    parser.add_argument("--payload-kb", type=int, default=64, help="Size of each fake image before base64 encoding")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    args = parser.parse_args()
+    config.latency, config.jitter = args.latency, args.jitter
+    config.payload_kb, config.error_rate = args.payload_kb, args.error_rate
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")